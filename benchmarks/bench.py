@@ -0,0 +1,243 @@
+
+''' Times each phase of dissecting synthetic files of increasing size in
+every bundled format, and compares results against a stored baseline.
+
+    python3 -m benchmarks.bench run -o results.json
+    python3 -m benchmarks.bench compare baseline.json results.json
+'''
+
+import io
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import platform
+import tracemalloc
+from vbincarver.config import FormatConfig
+from vbincarver.parser import FileParser
+from vbincarver.formatter import HexFormatter, SummaryFormatter
+from .generators import GENERATORS
+
+PHASES = ['grammar', 'parse', 'hex', 'summary']
+
+SIZE_SUFFIXES = {'k': 1024, 'm': 1024 * 1024}
+
+DEFAULT_SIZES = '1k,10k,100k'
+
+def parse_size( size : str ) -> int:
+    if size[-1].lower() in SIZE_SUFFIXES:
+        return int( size[:-1] ) * SIZE_SUFFIXES[size[-1].lower()]
+    return int( size )
+
+def run_phases( format_name : str, data : bytes, measure ) -> dict:
+
+    ''' Run each phase of a dissection once, passing a function doing each
+    phase to measure() and returning what it returns by phase name. '''
+
+    results = {}
+    state = {}
+
+    def load_grammar():
+        state['format_data'] = FormatConfig( None, format_name )
+
+    def parse():
+        state['parser'] = FileParser( data, state['format_data'] )
+        state['parser'].parse()
+
+    def render_hex():
+        HexFormatter( io.StringIO(), state['parser'] ).write_layout()
+
+    def render_summary():
+        SummaryFormatter( io.StringIO(), state['parser'] ).write_layout()
+
+    for name, func in zip( PHASES,
+        [load_grammar, parse, render_hex, render_summary]
+    ):
+        results[name] = measure( func )
+
+    return results
+
+def measure_time( func ) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def measure_memory( func ) -> int:
+
+    ''' Return the peak memory allocated while running func, in bytes. '''
+
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    func()
+    return tracemalloc.get_traced_memory()[1] - start
+
+def scaling( prev : dict, result : dict, phase : str ) -> float:
+
+    ''' Return the exponent k for which the phase's time grew as size^k
+    since the previous (smaller) result: about 1 for linear. '''
+
+    if not prev or prev['bytes'] == result['bytes']:
+        return None
+
+    prev_time = prev['phases'][phase]['time']
+    time_taken = result['phases'][phase]['time']
+    if 0 >= prev_time or 0 >= time_taken:
+        return None
+
+    return math.log( time_taken / prev_time ) / \
+        math.log( result['bytes'] / prev['bytes'] )
+
+def run( args ):
+
+    logger = logging.getLogger( 'bench.run' )
+
+    formats = args.formats.split( ',' ) if args.formats else list( GENERATORS )
+    sizes = [parse_size( x ) for x in args.sizes.split( ',' )]
+
+    results = []
+    row_format = '{:<6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8}'
+    print( row_format.format(
+        'format', 'bytes', 'grammar', 'parse', 'hex', 'summary', 'scaling' ) )
+
+    for format_name in formats:
+        prev = None
+        for size in sizes:
+            data = GENERATORS[format_name]( size )
+            logger.debug( 'generated %d bytes of %s',
+                len( data ), format_name )
+
+            # Best of several runs for time, one traced run for memory.
+            times = [run_phases( format_name, data, measure_time ) \
+                for x in range( args.repeat )]
+            memory = {}
+            if not args.no_memory:
+                tracemalloc.start()
+                memory = run_phases( format_name, data, measure_memory )
+                tracemalloc.stop()
+
+            result = {
+                'format': format_name,
+                'size': size,
+                'bytes': len( data ),
+                'phases': {x: {
+                    'time': min( [y[x] for y in times] ),
+                    'peak_memory': memory.get( x )} for x in PHASES}
+            }
+            result['parse_scaling'] = scaling( prev, result, 'parse' )
+            results.append( result )
+            prev = result
+
+            print( row_format.format(
+                format_name, result['bytes'],
+                *['{:.4f}'.format( result['phases'][x]['time'] ) \
+                    for x in PHASES],
+                '{:.2f}'.format( result['parse_scaling'] ) \
+                    if None != result['parse_scaling'] else '-' ) )
+            sys.stdout.flush()
+
+    with open( args.out_file, 'w' ) as out_file:
+        json.dump( {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+            'results': results}, out_file, indent=4 )
+
+def compare( args ) -> int:
+
+    ''' Print phases that got slower or used more memory than in the
+    baseline beyond the threshold. Returns the number of regressions. '''
+
+    with open( args.baseline ) as baseline_file:
+        baseline = {(x['format'], x['size']): x \
+            for x in json.load( baseline_file )['results']}
+    with open( args.current ) as current_file:
+        current = json.load( current_file )['results']
+
+    regressions = 0
+    for result in current:
+        key = (result['format'], result['size'])
+        if not key in baseline:
+            continue
+
+        for phase in PHASES:
+            for metric, floor in [('time', args.min_time),
+                ('peak_memory', args.min_memory)
+            ]:
+                old = baseline[key]['phases'][phase][metric]
+                new = result['phases'][phase][metric]
+                if None == old or None == new:
+                    continue
+
+                # Ignore differences too small to be more than noise.
+                if new > old * (1.0 + args.threshold) and new - old > floor:
+                    print( 'REGRESSION {} {} {} {}: {:.6g} -> {:.6g} ' \
+                        '({:+.0%})'.format( result['format'], result['bytes'],
+                            phase, metric, old, new, new / old - 1.0 \
+                                if old else float( 'inf' ) ) )
+                    regressions += 1
+                elif args.verbose:
+                    print( 'ok {} {} {} {}: {:.6g} -> {:.6g}'.format(
+                        result['format'], result['bytes'], phase, metric,
+                        old, new ) )
+
+    print( '{} regression(s) found.'.format( regressions ) )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    subparsers = parser.add_subparsers( dest='command', required=True )
+
+    parser_run = subparsers.add_parser( 'run',
+        help='Run the benchmarks and write the results as JSON.' )
+
+    parser_run.add_argument( '-o', '--out-file', action='store',
+        default='bench_results.json', help='Path to write results to.' )
+
+    parser_run.add_argument( '-f', '--formats', action='store',
+        help='Comma-separated formats to benchmark (default all).' )
+
+    parser_run.add_argument( '-s', '--sizes', action='store',
+        default=DEFAULT_SIZES,
+        help='Comma-separated file sizes, with optional k/m suffixes.' )
+
+    parser_run.add_argument( '-r', '--repeat', action='store', type=int,
+        default=1, help='Runs to take the best time of.' )
+
+    parser_run.add_argument( '--no-memory', action='store_true',
+        help='Skip the traced run that measures peak memory.' )
+
+    parser_compare = subparsers.add_parser( 'compare',
+        help='Flag regressions in results against a baseline.' )
+
+    parser_compare.add_argument( 'baseline', action='store' )
+
+    parser_compare.add_argument( 'current', action='store' )
+
+    parser_compare.add_argument( '-t', '--threshold', action='store',
+        type=float, default=0.2,
+        help='Fraction slower (or bigger) that counts as a regression.' )
+
+    parser_compare.add_argument( '--min-time', action='store', type=float,
+        default=0.005, help='Smallest time difference to flag, in seconds.' )
+
+    parser_compare.add_argument( '--min-memory', action='store', type=int,
+        default=64 * 1024,
+        help='Smallest memory difference to flag, in bytes.' )
+
+    parser_compare.add_argument( '-v', '--verbose', action='store_true' )
+
+    args = parser.parse_args()
+
+    # Grammars may warn about every file; only errors are of interest here.
+    logging.basicConfig( level=logging.ERROR )
+
+    if 'run' == args.command:
+        run( args )
+    elif compare( args ):
+        sys.exit( 1 )
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,403 @@
+
+''' Searches for inputs that make the parser slow or memory hungry per
+byte, by mutating synthetic seed files for each bundled grammar. The worst
+inputs found are kept in a corpus, which the check command then parses to
+make sure they stay within a time budget, scale about linearly and parse the
+same when fed a chunk at a time.
+
+    python3 -m benchmarks.fuzz fuzz -f png -n 500
+    python3 -m benchmarks.fuzz check
+'''
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import struct
+import hashlib
+import logging
+import argparse
+import tracemalloc
+import multiprocessing
+from vbincarver.config import FormatConfig
+from vbincarver.parser import FileParser
+from .generators import GENERATORS
+
+CORPUS_DIR = os.path.join( os.path.dirname( __file__ ), 'corpus' )
+
+OBJECTIVES = ['time', 'memory']
+
+# Sizes of the synthetic files mutated when there's no corpus yet.
+SEED_SIZES = [2048, 8192]
+
+class Corpus( object ):
+
+    ''' Directory of the worst inputs found for each format, with an index
+    of how bad each one was when found. '''
+
+    def __init__( self, corpus_dir : str, keep : int = 8 ):
+        self.corpus_dir = corpus_dir
+        self.keep = keep
+        self.index_path = os.path.join( corpus_dir, 'index.json' )
+        self.entries = []
+        if os.path.exists( self.index_path ):
+            with open( self.index_path ) as index_file:
+                self.entries = json.load( index_file )
+
+    def path( self, entry : dict ) -> str:
+        return os.path.join( self.corpus_dir, entry['format'], entry['file'] )
+
+    def read( self, entry : dict ) -> bytes:
+        with open( self.path( entry ), 'rb' ) as corpus_file:
+            return corpus_file.read()
+
+    def worst( self, format_name : str, objective : str ) -> list:
+        return sorted( [x for x in self.entries \
+            if x['format'] == format_name and x['objective'] == objective],
+            key=lambda x: x['score'], reverse=True )
+
+    def add(
+        self, format_name : str, objective : str, data : bytes,
+        result : dict
+    ) -> bool:
+
+        ''' Keep the input if it's among the worst found for its format and
+        objective. Returns True if it was kept. '''
+
+        worst = self.worst( format_name, objective )
+        if len( worst ) >= self.keep and \
+        result['score'] <= worst[self.keep - 1]['score']:
+            return False
+
+        entry = dict( result )
+        entry['format'] = format_name
+        entry['objective'] = objective
+        entry['file'] = hashlib.sha1( data ).hexdigest() + '.' + format_name
+        if [x for x in worst if x['file'] == entry['file']]:
+            return False
+
+        os.makedirs( os.path.dirname( self.path( entry ) ), exist_ok=True )
+        with open( self.path( entry ), 'wb' ) as corpus_file:
+            corpus_file.write( data )
+        self.entries.append( entry )
+
+        # Drop the least bad inputs beyond what we keep.
+        for old in self.worst( format_name, objective )[self.keep:]:
+            self.entries.remove( old )
+            if not [x for x in self.entries if x['file'] == old['file']]:
+                os.remove( self.path( old ) )
+
+        return True
+
+    def save( self ):
+        os.makedirs( self.corpus_dir, exist_ok=True )
+        with open( self.index_path, 'w' ) as index_file:
+            json.dump( sorted( self.entries,
+                key=lambda x: (x['format'], x['objective'], -x['score']) ),
+                index_file, indent=4 )
+
+def _parse_worker( format_name : str, data : bytes, objective : str, conn ):
+    logging.disable( logging.CRITICAL )
+    format_data = FormatConfig( None, format_name )
+    if 'memory' == objective:
+        tracemalloc.start()
+    start = time.perf_counter()
+    FileParser( data, format_data ).parse()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] \
+        if 'memory' == objective else None
+    conn.send( (elapsed, peak) )
+    conn.close()
+
+def measure(
+    format_name : str, data : bytes, objective : str, timeout : float
+) -> dict:
+
+    ''' Parse the data in a child process so pathological inputs can be
+    cut off, and return how long it took (or timeout if it didn't finish)
+    and its peak memory per byte of input. '''
+
+    recv_conn, send_conn = multiprocessing.Pipe( duplex=False )
+    worker = multiprocessing.Process( target=_parse_worker,
+        args=(format_name, data, objective, send_conn) )
+    worker.start()
+    send_conn.close()
+
+    result = {'bytes': len( data ), 'timed_out': False, 'failed': False}
+    if recv_conn.poll( timeout ):
+        try:
+            result['time'], result['peak_memory'] = recv_conn.recv()
+        except EOFError:
+            # The parser raised; crashes are for a different harness.
+            result['failed'] = True
+            result['time'], result['peak_memory'] = 0.0, 0
+    else:
+        worker.terminate()
+        result['timed_out'] = True
+        result['time'], result['peak_memory'] = timeout, None
+    worker.join()
+    recv_conn.close()
+
+    size = max( 1, len( data ) )
+    result['time_per_byte'] = result['time'] / size
+    result['memory_per_byte'] = result['peak_memory'] / size \
+        if None != result['peak_memory'] else None
+    result['score'] = result['time_per_byte'] if 'time' == objective else \
+        (result['memory_per_byte'] or 0.0)
+    return result
+
+def _parse_results( file_parser : FileParser ) -> tuple:
+    return (file_parser.struct_spans, file_parser.buffer,
+        list( file_parser.storage.records() ))
+
+def feed_mismatches(
+    format_name : str, data : bytes, chunk_sizes : list
+) -> list:
+
+    ''' Return the chunk sizes for which feeding the data to the parser a
+    chunk at a time gives different struct spans, bytes or records than
+    parsing it whole. '''
+
+    logging.disable( logging.CRITICAL )
+    format_data = FormatConfig( None, format_name )
+    full = FileParser( data, format_data )
+    full.parse()
+    expected = _parse_results( full )
+
+    mismatches = []
+    for chunk_sz in chunk_sizes:
+        fed = FileParser( b'', format_data )
+        for pos in range( 0, len( data ), chunk_sz ):
+            fed.feed( data[pos:pos + chunk_sz] )
+        fed.finish()
+        if _parse_results( fed ) != expected:
+            mismatches.append( chunk_sz )
+    logging.disable( logging.NOTSET )
+
+    return mismatches
+
+def mutate( rng : random.Random, data : bytes ) -> bytes:
+
+    ''' Return a copy of data with a random mutation chosen to upset the
+    grammar: big count and size fields, runs of repeated bytes, copied
+    regions or flipped bytes. '''
+
+    data = bytearray( data )
+    if not data:
+        return bytes( [rng.randrange( 256 )] )
+    pos = rng.randrange( len( data ) )
+    mutation = rng.randrange( 6 )
+
+    if 0 == mutation:
+        # Big number where a count or size field may be.
+        fmt = rng.choice( ['>I', '<I', '>H', '<H', 'B'] )
+        value = rng.choice( [0, 1, 0x7f, 0x80, 0xff, 0xffff, 0x7fffffff,
+            0xffffffff] ) & ((1 << (8 * struct.calcsize( fmt ))) - 1)
+        packed = struct.pack( fmt, value )
+        data[pos:pos + len( packed )] = packed
+    elif 1 == mutation:
+        # Run of one byte, e.g. endless var-length continuation bytes.
+        run = bytes( [rng.choice( [0x00, 0x80, 0xff, data[pos]] )] ) * \
+            rng.randrange( 1, 4096 )
+        data[pos:pos] = run
+    elif 2 == mutation:
+        # Copy a region elsewhere, repeating structures.
+        start = rng.randrange( len( data ) )
+        region = data[start:start + rng.randrange( 1, 1024 )]
+        data[pos:pos] = region * rng.randrange( 1, 16 )
+    elif 3 == mutation:
+        # Flip a few bytes.
+        for idx in range( rng.randrange( 1, 8 ) ):
+            data[rng.randrange( len( data ) )] ^= 1 << rng.randrange( 8 )
+    elif 4 == mutation:
+        # Drop a region.
+        del data[pos:pos + rng.randrange( 1, 256 )]
+    else:
+        # Set a byte to a random value.
+        data[pos] = rng.randrange( 256 )
+
+    return bytes( data )
+
+def fuzz( args ):
+
+    logger = logging.getLogger( 'fuzz' )
+
+    rng = random.Random( args.seed )
+    corpus = Corpus( args.corpus, args.keep )
+    formats = args.formats.split( ',' ) if args.formats else list( GENERATORS )
+
+    for format_name in formats:
+        pool = [GENERATORS[format_name]( x ) for x in SEED_SIZES] + \
+            [corpus.read( x ) \
+                for x in corpus.worst( format_name, args.objective )]
+        scores = [measure( format_name, x, args.objective, args.timeout ) \
+            ['score'] for x in pool]
+
+        for iteration in range( args.iterations ):
+            # Favor mutating the worst inputs found so far.
+            parent = rng.choices( pool, weights=[x + 1e-9 for x in scores] )[0]
+            child = parent
+            for idx in range( rng.randrange( 1, 4 ) ):
+                child = mutate( rng, child )
+            if len( child ) > args.max_size:
+                child = child[:args.max_size]
+            if len( child ) < args.min_size:
+                # Fixed costs swamp the per byte costs of tiny inputs.
+                continue
+
+            result = measure(
+                format_name, child, args.objective, args.timeout )
+            if result['failed']:
+                continue
+
+            pool.append( child )
+            scores.append( result['score'] )
+            if corpus.add( format_name, args.objective, child, result ):
+                logger.info( '%s: kept %d byte input (%.1f us/B%s%s)',
+                    format_name, len( child ),
+                    result['time_per_byte'] * 1000000,
+                    ', {:.0f} B/B'.format( result['memory_per_byte'] ) \
+                        if None != result['memory_per_byte'] else '',
+                    ', timed out' if result['timed_out'] else '' )
+                corpus.save()
+
+            # Don't let the pool grow without bound.
+            if len( pool ) > 64:
+                drop = scores.index( min( scores ) )
+                del pool[drop]
+                del scores[drop]
+
+    corpus.save()
+
+def check( args ) -> int:
+
+    ''' Parse each corpus input, failing any that takes longer per byte
+    than the budget, or than the given multiple of an unmutated synthetic
+    file of the same size, or whose time grows faster than the allowed
+    exponent of its size between its first half and the whole, or that
+    parses differently when fed a chunk at a time. Returns the number of
+    failures. '''
+
+    corpus = Corpus( args.corpus )
+    failures = 0
+    chunk_sizes = [int( x ) for x in args.feed_chunks.split( ',' )]
+
+    for entry in corpus.entries:
+        data = corpus.read( entry )
+        full = measure( entry['format'], data, 'time', args.timeout )
+        half = measure( entry['format'], data[:len( data ) // 2], 'time',
+            args.timeout )
+        seed = measure( entry['format'],
+            GENERATORS[entry['format']]( len( data ) ), 'time', args.timeout )
+
+        exponent = None
+        if len( data ) >= 2 * args.min_scaling_size and \
+        0 < half['time'] and not half['timed_out']:
+            exponent = math.log( full['time'] / half['time'] ) / math.log( 2 )
+
+        ratio = full['time_per_byte'] / seed['time_per_byte'] \
+            if 0 < seed['time_per_byte'] else None
+
+        problems = []
+        if full['timed_out']:
+            problems.append( 'timed out' )
+        if full['time_per_byte'] * 1000000 > args.budget_us:
+            problems.append( 'over budget' )
+        if None != ratio and ratio > args.max_ratio:
+            problems.append( '{:.1f}x slower than a synthetic file'.format(
+                ratio ) )
+        if None != exponent and exponent > args.max_exponent:
+            problems.append( 'scales as size^{:.2f}'.format( exponent ) )
+        if not full['timed_out'] and not full['failed']:
+            mismatches = feed_mismatches(
+                entry['format'], data, chunk_sizes )
+            if mismatches:
+                problems.append( 'differs fed in chunks of {}'.format(
+                    ', '.join( [str( x ) for x in mismatches] ) ) )
+
+        print( '{} {}/{}: {:.1f} us/B{}{}{}'.format(
+            'FAIL' if problems else 'ok', entry['format'], entry['file'],
+            full['time_per_byte'] * 1000000,
+            ', {:.1f}x synthetic'.format( ratio ) if None != ratio else '',
+            ', size^{:.2f}'.format( exponent ) if None != exponent else '',
+            ' (' + ', '.join( problems ) + ')' if problems else '' ) )
+        if problems:
+            failures += 1
+
+    print( '{} of {} corpus input(s) failed.'.format(
+        failures, len( corpus.entries ) ) )
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument( '-c', '--corpus', action='store',
+        default=CORPUS_DIR, help='Directory of worst-case inputs.' )
+
+    parser.add_argument( '-t', '--timeout', action='store', type=float,
+        default=30.0, help='Seconds to let a single parse run.' )
+
+    subparsers = parser.add_subparsers( dest='command', required=True )
+
+    parser_fuzz = subparsers.add_parser( 'fuzz',
+        help='Mutate inputs, keeping the worst found in the corpus.' )
+
+    parser_fuzz.add_argument( '-f', '--formats', action='store',
+        help='Comma-separated formats to fuzz (default all).' )
+
+    parser_fuzz.add_argument( '-n', '--iterations', action='store',
+        type=int, default=200, help='Mutated inputs to try per format.' )
+
+    parser_fuzz.add_argument( '-o', '--objective', action='store',
+        default='time', choices=OBJECTIVES,
+        help='Maximize time or peak memory per byte.' )
+
+    parser_fuzz.add_argument( '-k', '--keep', action='store', type=int,
+        default=8, help='Worst inputs to keep per format and objective.' )
+
+    parser_fuzz.add_argument( '--max-size', action='store', type=int,
+        default=64 * 1024, help='Largest input to try, in bytes.' )
+
+    parser_fuzz.add_argument( '--min-size', action='store', type=int,
+        default=1024, help='Smallest input to try, in bytes.' )
+
+    parser_fuzz.add_argument( '--seed', action='store', type=int,
+        help='Random seed, to repeat a fuzzing run.' )
+
+    parser_check = subparsers.add_parser( 'check',
+        help='Check corpus inputs parse within budget, scale linearly ' \
+            'and parse the same when fed in chunks.' )
+
+    parser_check.add_argument( '--budget-us', action='store', type=float,
+        default=500.0, help='Most parse time allowed per byte, in us.' )
+
+    parser_check.add_argument( '--max-ratio', action='store', type=float,
+        default=10.0, help='Most times slower per byte an input may be ' \
+            'than a synthetic file of the same size.' )
+
+    parser_check.add_argument( '--max-exponent', action='store', type=float,
+        default=1.5,
+        help='Highest allowed k for parse time growing as size^k.' )
+
+    parser_check.add_argument( '--min-scaling-size', action='store',
+        type=int, default=1024,
+        help='Smallest first half, in bytes, to check scaling with.' )
+
+    parser_check.add_argument( '--feed-chunks', action='store',
+        default='1,7,1000',
+        help='Comma-separated chunk sizes to feed inputs to the parser in ' \
+            'and compare against parsing them whole.' )
+
+    args = parser.parse_args()
+
+    logging.basicConfig( level=logging.INFO )
+
+    if 'fuzz' == args.command:
+        fuzz( args )
+    elif check( args ):
+        sys.exit( 1 )
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,182 @@
+
+''' Generators for synthetic files in each bundled format, built to roughly
+a requested size. Contents are made up, but laid out the way the grammars
+in vbincarver/formats expect, with many of the repeated structures that
+make files big in practice. '''
+
+import zlib
+import struct
+
+def _pattern( size : int, start : int = 0, step : int = 1 ) -> bytes:
+
+    ''' Return size bytes counting up from start by step, wrapping. '''
+
+    cycle = bytes( [(start + x * step) & 0xff for x in range( 256 )] )
+    return (cycle * (size // 256 + 1))[:size]
+
+def _png_chunk( chunk_type : bytes, data : bytes ) -> bytes:
+    return struct.pack( '>I', len( data ) ) + chunk_type + data + \
+        struct.pack( '>I', zlib.crc32( chunk_type + data ) )
+
+def generate_png( size : int ) -> bytes:
+
+    ''' PNG with a text chunk before each of many large IDAT chunks. '''
+
+    out = [b'\x89PNG\r\n\x1a\n', _png_chunk( b'IHDR',
+        struct.pack( '>IIBBBBB', 1024, 1024, 8, 2, 0, 0, 0 ) )]
+    written = len( out[0] ) + len( out[1] ) + 12
+
+    idx = 0
+    while written < size:
+        text = _png_chunk( b'tEXt',
+            b'Comment\x00' + bytes( [65 + idx % 26] ) * (idx % 32 + 1) )
+        idat = _png_chunk( b'IDAT',
+            _pattern( min( 8192,
+                max( 0, size - written - len( text ) - 12 ) ) ) )
+        out += [text, idat]
+        written += len( text ) + len( idat )
+        idx += 1
+
+    out.append( _png_chunk( b'IEND', b'' ) )
+    return b''.join( out )
+
+def generate_mid( size : int ) -> bytes:
+
+    ''' MIDI with a track per 64K (or less, for the last) of note on/off
+    events, using running status for every other event. '''
+
+    track_sz = 64 * 1024
+    num_tracks = max( 1, -(-size // track_sz) )
+
+    # Left for tracks after the header, less each track's header and end.
+    left = size - 14
+    tracks = []
+    for track_idx in range( num_tracks ):
+        events_sz_max = min( track_sz, left ) - 12
+        events = []
+        events_sz = 0
+        idx = 0
+        while events_sz < events_sz_max - 3:
+            note = (track_idx + idx) % 128
+            if idx % 2:
+                # Running status: note off as note on with zero velocity.
+                event = b'\x05' + bytes( [note, 0] )
+            else:
+                event = b'\x10' + bytes( [0x90 | (track_idx % 16), note, 64] )
+            events.append( event )
+            events_sz += len( event )
+            idx += 1
+        events.append( b'\x00\xff\x2f\x00' )
+        data = b''.join( events )
+        tracks.append( b'MTrk' + struct.pack( '>I', len( data ) ) + data )
+        left -= len( tracks[-1] )
+
+    return b'MThd' + struct.pack( '>IHHH', 6, 1, num_tracks, 96 ) + \
+        b''.join( tracks )
+
+def _bmp_info( width : int, height : int, bpp : int, img_sz : int,
+    ncolors : int
+) -> bytes:
+    return struct.pack( '<IiiHHIIiiII',
+        40, width, height, 1, bpp, 0, img_sz, 2835, 2835, ncolors, 0 )
+
+def _palette( ncolors : int ) -> bytes:
+    return b''.join( [bytes( [x & 0xff, (x * 3) & 0xff, (x * 7) & 0xff, 0] ) \
+        for x in range( ncolors )] )
+
+def generate_bmp( size : int ) -> bytes:
+
+    ''' 8-bit BMP with a full 256 color palette. '''
+
+    palette = _palette( 256 )
+    pixel_offset = 14 + 40 + len( palette )
+    width = 256
+    height = max( 1, (size - pixel_offset) // width )
+    img_sz = width * height
+
+    return b'BM' + struct.pack( '<IHHI',
+        pixel_offset + img_sz, 0, 0, pixel_offset ) + \
+        _bmp_info( width, height, 8, img_sz, 256 ) + palette + \
+        _pattern( img_sz )
+
+def generate_ico( size : int ) -> bytes:
+
+    ''' ICO with as many 16 color images as fit (up to 255), each with
+    its own palette. '''
+
+    num_images = max( 1, min( 255, size // 4096 ) )
+    img_sz = max( 64, (size - 6 - num_images * 16) // num_images - 40 - 64 )
+
+    entries = []
+    images = []
+    offset = 6 + num_images * 16
+    for idx in range( num_images ):
+        image = _bmp_info( 32, 64, 4, img_sz, 16 ) + _palette( 16 ) + \
+            _pattern( img_sz, idx )
+        entries.append( struct.pack( '<BBBBHHII',
+            32, 32, 16, 0, 1, 4, len( image ), offset ) )
+        images.append( image )
+        offset += len( image )
+
+    return struct.pack( '<HHH', 0, 1, num_images ) + b''.join( entries ) + \
+        b''.join( images )
+
+def generate_gif( size : int ) -> bytes:
+
+    ''' GIF with a 256 color global palette and many frames, each with a
+    graphic control extension and image data in 255 byte sub-blocks. '''
+
+    out = [b'GIF89a' + struct.pack( '<HHBBB', 64, 64, 0xf7, 0, 0 ) + \
+        b''.join( [bytes( [x, 255 - x, (x * 5) & 0xff] ) \
+            for x in range( 256 )] )]
+    written = len( out[0] ) + 1
+
+    # Fewer sub-blocks per frame for small files, so they still get frames.
+    num_blocks = max( 1, min( 16, size // 8192 ) )
+
+    idx = 0
+    while written < size:
+        frame = [b'\x21\xf9\x04\x04' + struct.pack( '<H', 10 ) + b'\x00\x00',
+            b'\x2c' + struct.pack( '<HHHHB', 0, 0, 64, 64, 0 ), b'\x08']
+        for block in range( num_blocks ):
+            frame.append( b'\xff' + _pattern( 255, idx + block ) )
+        frame.append( b'\x00' )
+        frame = b''.join( frame )
+        out.append( frame )
+        written += len( frame )
+        idx += 1
+
+    out.append( b'\x3b' )
+    return b''.join( out )
+
+def _iff_chunk( chunk_type : bytes, data : bytes ) -> bytes:
+    return chunk_type + struct.pack( '>I', len( data ) ) + data
+
+def generate_sc2( size : int ) -> bytes:
+
+    ''' SimCity 2000 city with the usual chunks, the altitude map growing
+    up to its real 32K and the terrain and text chunks growing to fill the
+    requested size. '''
+
+    name = b'Benchmark'
+    altm_sz = max( 2, min( 32768, size // 4 ) & ~1 )
+    chunks = [
+        _iff_chunk( b'CNAM',
+            bytes( [len( name )] ) + name.ljust( 31, b'\0' ) ),
+        _iff_chunk( b'ALTM', _pattern( altm_sz ) )]
+
+    fill = max( 3, size - 12 - sum( [len( x ) for x in chunks] ) - 24 ) // 3
+    for chunk_type in [b'XTER', b'XBIT', b'XTXT']:
+        chunks.append( _iff_chunk( chunk_type, _pattern( fill, step=13 ) ) )
+
+    data = b'SCDH' + b''.join( chunks )
+    return b'FORM' + struct.pack( '>I', len( data ) ) + data
+
+GENERATORS = {
+    'png': generate_png,
+    'mid': generate_mid,
+    'bmp': generate_bmp,
+    'ico': generate_ico,
+    'gif': generate_gif,
+    'sc2': generate_sc2,
+}
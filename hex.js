@@ -1,4 +1,102 @@
 
+function fetch_range( href, start, length, done ) {
+
+   // Fall back to cutting the range out if the server sends it all.
+   $.ajax( {
+      url: href,
+      dataType: 'text',
+      headers: { 'Range': 'bytes=' + start + '-' + (start + length - 1) },
+      success: function( data, status, xhr ) {
+         if( 206 != xhr.status ) {
+            data = data.substr( start, length );
+         }
+         done( data );
+      }
+   } );
+}
+
+function lazy_detail( lazy, row ) {
+
+   var detail = $('<tr class="hex-lazy-detail"><td colspan="4"></td></tr>');
+   fetch_range( lazy.data( 'href' ), row[4], row[5], function( data ) {
+      var instance = JSON.parse( data );
+      var cell = detail.find( 'td' );
+      $.each( instance.fields, function( i, field ) {
+         var field_span = $('<span class="hex-field"></span>');
+         field_span.append( $('<span class="hex-label"></span>').text(
+            field[0] + '[' + field[1] + ']' ) );
+         field_span.append( $('<span class="hex-sz"></span>').text(
+            '@' + field[2] + ' (' + field[3] + ' bytes)' ) );
+         field_span.append( $('<span class="hex-contents"></span>').text(
+            String( field[4] ) ) );
+         cell.append( field_span ).append( '<div class="spacer"></div>' );
+      } );
+
+      var lines = [];
+      for( var i = 0 ; instance.bytes.length > i ; i += 32 ) {
+         lines.push( instance.bytes.substr( i, 32 ).replace(
+            /(..)(?!$)/g, '$1 ' ) );
+      }
+      if( instance.truncated ) {
+         lines.push( '...' );
+      }
+      cell.append( $('<pre class="hex-lazy-bytes"></pre>').text(
+         lines.join( '\n' ) ) );
+   } );
+   return detail;
+}
+
+function lazy_page( lazy, page ) {
+
+   var row_len = lazy.data( 'row-len' );
+   var page_rows = lazy.data( 'page-rows' );
+   var first = page * page_rows;
+   var count = Math.min( page_rows, lazy.data( 'rows' ) - first );
+   if( 0 >= count ) {
+      lazy.text( 'No structs found.' );
+      return;
+   }
+
+   fetch_range( lazy.data( 'href' ), lazy.data( 'index' ) + first * row_len,
+      count * row_len, function( data ) {
+
+      var table = $('<table class="hex-lazy-table"><tr><th>struct</th>' +
+         '<th>sid</th><th>offset</th><th>size</th></tr></table>');
+      for( var i = 0 ; count > i ; i++ ) {
+         var row = JSON.parse( data.substr( i * row_len, row_len ) );
+         var tr = $('<tr class="hex-lazy-row"></tr>');
+         tr.addClass( 'hex-struct-' + row[0].replace( /_/g, '-' ) );
+         tr.append( $('<td></td>').text( row[0] ) );
+         tr.append( $('<td></td>').text( row[1] ) );
+         tr.append( $('<td></td>').text(
+            row[2] + ' (0x' + row[2].toString( 16 ) + ')' ) );
+         tr.append( $('<td></td>').text( row[3] ) );
+         tr.data( 'row', row );
+         table.append( tr );
+      }
+
+      // Expand (or collapse) an instance when its row is clicked.
+      table.on( 'click', '.hex-lazy-row', function() {
+         if( $(this).next().hasClass( 'hex-lazy-detail' ) ) {
+            $(this).next().remove();
+         } else {
+            $(this).after( lazy_detail( lazy, $(this).data( 'row' ) ) );
+         }
+      } );
+
+      var nav = $('<div class="hex-lazy-nav"></div>');
+      nav.append( $('<button>&lt;</button>').prop( 'disabled', 0 == page )
+         .click( function() { lazy_page( lazy, page - 1 ); } ) );
+      nav.append( $('<span></span>').text( 'structs ' + (first + 1) + '-' +
+         (first + count) + ' of ' + lazy.data( 'rows' ) ) );
+      nav.append( $('<button>&gt;</button>')
+         .prop( 'disabled', first + count >= lazy.data( 'rows' ) )
+         .click( function() { lazy_page( lazy, page + 1 ); } ) );
+
+      lazy.empty().append( nav ).append( table );
+   } );
+}
+
 $(document).ready( function() {
    $('.hex-field').click( function() {
 
@@ -10,5 +108,19 @@ $(document).ready( function() {
       $('.hex-field').removeClass( 'hex-selected' );
       $(sel_sel).addClass( 'hex-selected' );
    } );
+
+   $('.hex-overview rect, .hex-fields .hex-occurrence').click( function() {
+
+      var sel_sel = '.hex-layout .' + $(this).data( 'struct' );
+      $('.hex-selected').removeClass( 'hex-selected' );
+      $(sel_sel).addClass( 'hex-selected' );
+      if( $(sel_sel).length ) {
+         $(sel_sel)[0].scrollIntoView();
+      }
+   } );
+
+   $('.hex-lazy').each( function() {
+      lazy_page( $(this), 0 );
+   } );
 } );
 
@@ -1,11 +1,302 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import time
+import contextlib
+import functools
 import argparse
 import logging
 import pprint
-from vbincarver.parser import FileParser
-from vbincarver.formatter import HexFormatter, SummaryFormatter
-from vbincarver.config import FormatConfig
+import json
+from vbincarver.parser import FileParser, ParseLimits
+from vbincarver.formatter import PageFormatter, HexFormatter, \
+    ParallelHexFormatter, SummaryFormatter, JSONFormatter, \
+    OverviewFormatter, TermFormatter, LazyFormatter, \
+    render_outputs
+from vbincarver.config import FormatConfig, ConfigException
+from vbincarver.storage import SQLiteParserStorage
+from vbincarver.stats import ParseStats
+from vbincarver.profiler import ProfilingFileParser
+from vbincarver.server import DissectionServer
+from vbincarver.diff import StructDiff
+from vbincarver.corpus import corpus_stats
+
+FOLLOW_READ_SZ = 1024 * 1024
+
+def parse_limits( args ) -> ParseLimits:
+    return ParseLimits( args.max_repeats, args.max_structs, args.max_records,
+        args.max_memory_mb * 1024 * 1024 if args.max_memory_mb else None,
+        args.max_time )
+
+def parser_selection( args, db_path : str = None ) -> dict:
+
+    ''' Return the FileParser arguments for the selected range/structs,
+    storage (in the given database, or --storage-db) and limits. '''
+
+    db_path = db_path if db_path else args.storage_db
+
+    return {
+        'limits': parse_limits( args ),
+        'start': args.start,
+        'length': args.length,
+        'structs': args.structs.split( ',' ) if args.structs else None,
+        'storage': \
+            SQLiteParserStorage( db_path ) if db_path else None}
+
+def parser_class( args ):
+    return ProfilingFileParser \
+        if args.profile or args.profile_collapsed else FileParser
+
+def hex_formatter(
+    args, out_file, file_parser : FileParser
+) -> HexFormatter:
+    if args.render_workers:
+        return ParallelHexFormatter( out_file, file_parser,
+            workers=args.render_workers, collapse=args.collapse )
+    return HexFormatter( out_file, file_parser, collapse=args.collapse )
+
+def write_profile( args, file_parser : ProfilingFileParser ):
+    if args.profile:
+        with open( args.profile, 'w' ) as profile_file:
+            file_parser.write_report( profile_file, args.profile_sort )
+    if args.profile_collapsed:
+        with open( args.profile_collapsed, 'w' ) as profile_file:
+            file_parser.write_collapsed( profile_file )
+
+def stats_phase( stats : ParseStats, name : str ):
+    return stats.phase( name ) if stats else contextlib.nullcontext()
+
+def write_stats( args, stats : ParseStats, file_parser : FileParser ):
+    if '-' == args.stats:
+        stats.write( sys.stdout, file_parser )
+    else:
+        with open( args.stats, 'w' ) as stats_file:
+            stats.write( stats_file, file_parser )
+
+def write_page(
+    args, out_file, page : PageFormatter, file_parser : FileParser,
+    stats : ParseStats
+):
+
+    ''' Write the HTML page after its head, once the file is parsed. '''
+
+    if args.overview:
+        with stats_phase( stats, 'render_overview' ):
+            formatter = OverviewFormatter( out_file, file_parser )
+            formatter.write_layout()
+
+    if args.lazy:
+        # The page only points to the data file, next to it.
+        with open( args.out_file + '.data', 'wb' ) as data_file:
+            with stats_phase( stats, 'render_lazy' ):
+                formatter = LazyFormatter( out_file, file_parser,
+                    data_file, os.path.basename( args.out_file + '.data' ) )
+                formatter.write_layout()
+    else:
+        with stats_phase( stats, 'render_hex' ):
+            formatter = hex_formatter( args, out_file, file_parser )
+            formatter.write_layout()
+
+        #printer = pprint.PrettyPrinter()
+        #printer.pprint( file_parser.buffer )
+
+        with stats_phase( stats, 'render_summary' ):
+            formatter = SummaryFormatter( out_file, file_parser,
+                dedup=args.summary_dedup )
+            formatter.write_layout()
+
+    page.write_tail()
+    out_file.flush()
+
+def write_json( args, file_parser : FileParser, stats : ParseStats ):
+    with open( args.json_file, 'w' ) as json_file:
+        with stats_phase( stats, 'render_json' ):
+            JSONFormatter( json_file, file_parser ).write_layout()
+
+def write_text( args, file_parser : FileParser, stats : ParseStats ):
+    with open( args.text_file, 'w' ) as text_file:
+        with stats_phase( stats, 'render_text' ):
+            TermFormatter( text_file, file_parser, color=False ).write_layout()
+
+def diff( args, format_data ) -> int:
+
+    ''' Parse the file and the one given to --diff with the same grammar,
+    and write the struct instances that differ to stdout. Returns the
+    number that differ. '''
+
+    parsers = []
+    for path, db_suffix in [(args.parse_file, ''), (args.diff, '.new')]:
+        with open( path, 'rb' ) as parse_file:
+            file_parser = FileParser( parse_file.read(), format_data,
+                **parser_selection( args, args.storage_db + db_suffix \
+                    if args.storage_db else None ) )
+        file_parser.parse()
+        file_parser.storage.close()
+        parsers.append( file_parser )
+
+    key_fields = {}
+    for key_field in args.diff_key if args.diff_key else []:
+        struct_key, field_key = key_field.split( '/' )
+        key_fields.setdefault( struct_key, [] ).append( field_key )
+
+    struct_diff = StructDiff( parsers[0], parsers[1], key_fields )
+    changes = struct_diff.diff()
+    if args.diff_json:
+        struct_diff.write_json( sys.stdout, changes )
+    else:
+        struct_diff.write_text( sys.stdout, changes )
+
+    return len( changes )
+
+def corpus( args ):
+
+    ''' Parse every file under the directory without rendering anything,
+    and write the merged field and struct stats as JSON. '''
+
+    try:
+        stats = corpus_stats( [args.parse_file], args.format, args.workers,
+            args.corpus_resume, parse_limits( args ), args.corpus_bins )
+    except KeyboardInterrupt:
+        # Progress so far is in the resume file, if any.
+        sys.exit( 1 )
+
+    if '-' == args.corpus_out:
+        json.dump( stats.stats, sys.stdout, indent=4 )
+    else:
+        with open( args.corpus_out, 'w' ) as corpus_file:
+            json.dump( stats.stats, corpus_file, indent=4 )
+
+def term( args, format_data ):
+
+    ''' Write a colored hexdump of the file to stdout, parsing and writing
+    it a chunk at a time so a pager can show the start of a big file right
+    away. '''
+
+    file_parser = parser_class( args )(
+        b'', format_data, **parser_selection( args ) )
+
+    color = 'always' == args.term_color or \
+        ('auto' == args.term_color and sys.stdout.isatty())
+    formatter = TermFormatter( sys.stdout, file_parser, color=color )
+
+    try:
+        with open( args.parse_file, 'rb' ) as parse_file:
+            if file_parser.filtered:
+                # Only parse() skips ahead to the selection.
+                file_parser.in_file = parse_file.read()
+                file_parser.parse()
+            else:
+                while not file_parser.limit_reached:
+                    data = parse_file.read( FOLLOW_READ_SZ )
+                    if not data:
+                        break
+                    file_parser.feed( data )
+                    formatter.write_bytes( final=False )
+                file_parser.finish()
+        file_parser.storage.close()
+
+        formatter.write_layout()
+        sys.stdout.flush()
+
+    except BrokenPipeError:
+        # The pager was closed. Keep Python from complaining on exit.
+        devnull = os.open( os.devnull, os.O_WRONLY )
+        os.dup2( devnull, sys.stdout.fileno() )
+
+def follow( args, format_data, stats : ParseStats = None ):
+
+    ''' Keep parsing the file as it grows, appending to the outputs, until
+    interrupted or idle for too long. '''
+
+    logger = logging.getLogger( 'main.follow' )
+
+    file_parser = parser_class( args )(
+        b'', format_data, **parser_selection( args ) )
+
+    json_file = open( args.json_file, 'w' ) if args.json_file else None
+    text_file = open( args.text_file, 'w' ) if args.text_file else None
+
+    with open( args.out_file, 'w' ) as out_file:
+        with open( args.parse_file, 'rb' ) as parse_file:
+            page = PageFormatter( out_file, file_parser )
+            page.write_head()
+            hex_writer = hex_formatter( args, out_file, file_parser )
+            hex_writer.write_head()
+            json_formatter = \
+                JSONFormatter( json_file, file_parser ) if json_file else None
+            text_formatter = TermFormatter( text_file, file_parser,
+                color=False ) if text_file else None
+
+            idle_since = time.monotonic()
+            try:
+                while not file_parser.limit_reached:
+                    data = parse_file.read( FOLLOW_READ_SZ )
+                    if data:
+                        with stats_phase( stats, 'parse' ):
+                            file_parser.feed( data )
+                        idle_since = time.monotonic()
+
+                        with stats_phase( stats, 'render_hex' ):
+                            hex_writer.write_bytes()
+                            out_file.flush()
+                        if json_formatter:
+                            with stats_phase( stats, 'render_json' ):
+                                json_formatter.write_records( final=False )
+                                json_file.flush()
+                        if text_formatter:
+                            with stats_phase( stats, 'render_text' ):
+                                text_formatter.write_bytes( final=False )
+                                text_file.flush()
+                        continue
+
+                    if os.fstat( parse_file.fileno() ).st_size < \
+                    file_parser.bytes_read:
+                        logger.warning( 'file was truncated, stopping!' )
+                        break
+
+                    if args.follow_idle and \
+                    time.monotonic() - idle_since > args.follow_idle:
+                        logger.info( 'no new data for %s seconds, stopping.',
+                            args.follow_idle )
+                        break
+
+                    time.sleep( args.follow_interval )
+            except KeyboardInterrupt:
+                logger.info( 'stopped following.' )
+
+            with stats_phase( stats, 'parse' ):
+                file_parser.finish()
+                file_parser.storage.close()
+
+            with stats_phase( stats, 'render_hex' ):
+                hex_writer.write_bytes()
+                hex_writer.write_tail()
+
+            # The hex dump is already written, so this goes after it.
+            if args.overview:
+                with stats_phase( stats, 'render_overview' ):
+                    formatter = OverviewFormatter( out_file, file_parser )
+                    formatter.write_layout()
+            with stats_phase( stats, 'render_summary' ):
+                SummaryFormatter( out_file, file_parser,
+                    dedup=args.summary_dedup ).write_layout()
+            page.write_tail()
+
+            if json_formatter:
+                with stats_phase( stats, 'render_json' ):
+                    json_formatter.write_records()
+                json_file.close()
+
+            if text_formatter:
+                with stats_phase( stats, 'render_text' ):
+                    text_formatter.write_layout()
+                text_file.close()
+
+    if stats:
+        write_stats( args, stats, file_parser )
+    if args.profile or args.profile_collapsed:
+        write_profile( args, file_parser )
 
 def main():
     parser = argparse.ArgumentParser()
@@ -17,6 +308,130 @@ def main():
         '-o', '--out-file', action='store', default='output.html',
         help='Path to the HTML output file to create.' )
 
+    parser.add_argument( '-j', '--json-file', action='store',
+        help='Path to a file to write stored field records to as JSON lines.' )
+
+    parser.add_argument( '--text-file', action='store',
+        help='Path to a file to write a plain text hexdump to, like -t.' )
+
+    parser.add_argument( '--output-workers', action='store', type=int,
+        default=0, help='Processes to render the HTML, JSON and text ' \
+            'outputs on at once, sharing one parse (0 for one at a time).' )
+
+    parser.add_argument( '-F', '--follow', action='store_true',
+        help='Keep parsing the file as it grows, appending to the outputs.' )
+
+    parser.add_argument( '--follow-interval', action='store', type=float,
+        default=1.0, help='Seconds to wait between checks for new data.' )
+
+    parser.add_argument( '--follow-idle', action='store', type=float,
+        default=0,
+        help='Stop following after this many seconds without new data.' )
+
+    parser.add_argument( '--start', action='store', type=int, default=0,
+        help='Offset of the first byte to include in the outputs.' )
+
+    parser.add_argument( '--length', action='store', type=int,
+        help='Number of bytes to include in the outputs.' )
+
+    parser.add_argument( '--structs', action='store',
+        help='Comma-separated list of structs to include in the outputs.' )
+
+    parser.add_argument( '-d', '--storage-db', action='store',
+        help='Path to a SQLite database to store field records in, ' \
+            'instead of memory.' )
+
+    parser.add_argument( '--stats', action='store',
+        help='Path to write timings, throughput, counts and memory use to ' \
+            'as JSON, or - for stdout.' )
+
+    parser.add_argument( '--stats-tracemalloc', action='store_true',
+        help='Also trace peak Python memory use for --stats (slower).' )
+
+    parser.add_argument( '--profile', action='store',
+        help='Path to write the time spent on each grammar element to.' )
+
+    parser.add_argument( '--profile-sort', action='store', default='total',
+        choices=ProfilingFileParser.REPORT_SORTS,
+        help='Column to sort the --profile report by.' )
+
+    parser.add_argument( '--profile-collapsed', action='store',
+        help='Path to write grammar profile call stacks to, in the ' \
+            'collapsed format taken by flamegraph tools.' )
+
+    parser.add_argument( '--max-repeats', action='store', type=int,
+        help='Stop parsing if a field repeats more than this many times.' )
+
+    parser.add_argument( '--max-structs', action='store', type=int,
+        help='Stop parsing after this many struct instances.' )
+
+    parser.add_argument( '--max-records', action='store', type=int,
+        help='Stop parsing after storing this many field records.' )
+
+    parser.add_argument( '--max-memory-mb', action='store', type=int,
+        help='Stop parsing if the parser holds about this much memory.' )
+
+    parser.add_argument( '--max-time', action='store', type=float,
+        help='Stop parsing after this many seconds.' )
+
+    parser.add_argument( '--render-workers', action='store', type=int,
+        default=0,
+        help='Processes to render the hex dump on in parallel (0 for none).' )
+
+    parser.add_argument( '--collapse', action='store', type=int, default=0,
+        help='Write runs of at least this many free bytes, hidden bytes ' \
+            'or bytes of one field in the hex dump as a single line.' )
+
+    parser.add_argument( '--summary-dedup', action='store_true',
+        help='Write struct instances with identical fields once in the ' \
+            'summary, with a list of where they occur.' )
+
+    parser.add_argument( '--lazy', action='store_true',
+        help='Write a page that loads a table of struct instances, and ' \
+            'their fields and bytes, from a data file next to it as ' \
+            'needed, instead of the hex dump and summary.' )
+
+    parser.add_argument( '-t', '--term', action='store_true',
+        help='Write a hexdump to stdout for a terminal or pager instead ' \
+            'of the HTML output.' )
+
+    parser.add_argument( '--term-color', action='store',
+        choices=['auto', 'always', 'never'], default='auto',
+        help='When to color --term output (auto is only for a terminal, ' \
+            'so use always with less -R).' )
+
+    parser.add_argument( '--overview', action='store_true',
+        help='Start the HTML output with a picture of where structs sit ' \
+            'in the whole file.' )
+
+    parser.add_argument( '--diff', action='store',
+        help='Path to a newer version of the file to compare it with, ' \
+            'writing the struct instances that differ to stdout.' )
+
+    parser.add_argument( '--diff-key', action='append',
+        help='struct/field whose contents pair up instances of the struct ' \
+            'between the files for --diff, instead of their order. ' \
+            'Can be given more than once.' )
+
+    parser.add_argument( '--diff-json', action='store_true',
+        help='Write --diff changes as JSON lines instead of text.' )
+
+    parser.add_argument( '--corpus', action='store_true',
+        help='Treat the path as a directory of files to parse (without ' \
+            'rendering) for stats on their field values and structs.' )
+
+    parser.add_argument( '--corpus-out', action='store', default='-',
+        help='Path to write --corpus stats to as JSON, or - for stdout.' )
+
+    parser.add_argument( '--corpus-resume', action='store',
+        help='Path to save --corpus progress to, and resume from if it ' \
+            'exists.' )
+
+    parser.add_argument( '--corpus-bins', action='store', type=int,
+        default=1000,
+        help='Distinct values to count per field for --corpus, with the ' \
+            'rest counted together.' )
+
     mutex_verbose = parser.add_mutually_exclusive_group()
     
     mutex_verbose.add_argument( '-v', '--verbose', action='store_true' )
@@ -24,11 +439,28 @@ def main():
     mutex_verbose.add_argument(
         '-vv', '--extra-verbose', action='store_true' )
 
-    parser.add_argument( 'parse_file', action='store',
+    parser.add_argument( '-s', '--serve', action='store_true',
+        help='Run a local server that dissects files on request.' )
+
+    parser.add_argument( '-p', '--port', action='store', type=int,
+        default=8080, help='Port for the local server to listen on.' )
+
+    parser.add_argument( '-w', '--workers', action='store', type=int,
+        default=4, help='Number of requests the server handles at once, ' \
+            'or of files parsed at once with --corpus.' )
+
+    parser.add_argument( '-c', '--cache-mb', action='store', type=int,
+        default=512,
+        help='Approximate memory the server may use for parsed files.' )
+
+    parser.add_argument( 'parse_file', action='store', nargs='?',
         help='Path to the file to dissect.' )
 
     args = parser.parse_args()
 
+    if not args.serve and not args.parse_file:
+        parser.error( 'a file to dissect is required' )
+
     log_level = logging.INFO
     if args.verbose or args.extra_verbose:
         log_level = logging.DEBUG
@@ -56,29 +488,83 @@ def main():
 
     logger.debug( 'starting...' )
 
-    format_data = FormatConfig( args.parse_file, args.format )
+    if args.serve:
+        server = DissectionServer(
+            ('127.0.0.1', args.port), os.path.dirname(
+                os.path.abspath( __file__ ) ),
+            workers=args.workers, cache_bytes=args.cache_mb * 1024 * 1024,
+            limits=parse_limits( args ) )
+        logger.info( 'serving on http://127.0.0.1:%d/...', args.port )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        return
+
+    if args.corpus:
+        corpus( args )
+        return
+
+    stats = ParseStats( args.stats_tracemalloc ) if args.stats else None
+
+    with stats_phase( stats, 'grammar' ):
+        try:
+            format_data = FormatConfig( args.parse_file, args.format )
+        except ConfigException as e:
+            logger.error( '%s', e )
+            sys.exit( 1 )
+
+    if args.diff:
+        if diff( args, format_data ):
+            sys.exit( 1 )
+        return
+
+    if args.term:
+        term( args, format_data )
+        return
+
+    if args.follow:
+        follow( args, format_data, stats )
+        return
 
     with open( args.out_file, 'w' ) as out_file:
         with open( args.parse_file, 'rb' ) as parse_file:
-            file_parser = FileParser( parse_file.read(), format_data )
+            with stats_phase( stats, 'read' ):
+                in_file = parse_file.read()
+            file_parser = parser_class( args )( in_file, format_data,
+                **parser_selection( args ) )
 
-            out_file.write( '<!DOCTYPE html>\n<html>\n<head>\n' )
-            out_file.write( '<link rel="stylesheet" href="hex.css" />\n' )
-            out_file.write( '<script src="https://code.jquery.com/jquery-3.7.1.min.js" integrity="sha256-/JqT3SQfawRcv/BIHPThkBvs0OEvtFFmqPF/lYI/Cxo=" crossorigin="anonymous"></script>\n' )
-            out_file.write( '<script src="hex.js"></script>\n' )
-            out_file.write( '</head>\n<body>\n' )
+            page = PageFormatter( out_file, file_parser )
+            page.write_head()
 
-            file_parser.parse()
-            formatter = HexFormatter( out_file, file_parser )
-            formatter.write_layout()
+            with stats_phase( stats, 'parse' ):
+                file_parser.parse()
+                file_parser.storage.close()
 
-            #printer = pprint.PrettyPrinter()
-            #printer.pprint( file_parser.buffer )
+            renders = [functools.partial(
+                write_page, args, out_file, page, file_parser, stats )]
+            if args.json_file:
+                renders.append( functools.partial(
+                    write_json, args, file_parser, stats ) )
+            if args.text_file:
+                renders.append( functools.partial(
+                    write_text, args, file_parser, stats ) )
 
-            formatter = SummaryFormatter( out_file, file_parser )
-            formatter.write_layout()
+            # SQLite connections can't be shared with forked processes.
+            workers = 0 if args.storage_db else args.output_workers
+            if 1 < workers and 1 < len( renders ):
+                # Forked outputs write to the page after the head.
+                out_file.flush()
+                with stats_phase( stats, 'render_outputs' ):
+                    render_outputs( renders, workers )
+            else:
+                render_outputs( renders )
 
-            out_file.write( '</body></html>' )
+    if stats:
+        write_stats( args, stats, file_parser )
+    if args.profile or args.profile_collapsed:
+        write_profile( args, file_parser )
 
 if '__main__' == __name__:
     main()
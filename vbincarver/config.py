@@ -1,35 +1,353 @@
 
 import os
 import yaml
+import json
+import hashlib
 import logging
 import pprint
+import importlib
+import importlib.metadata
 import importlib.resources
 
 class ConfigException( Exception ):
     pass
 
+def read_format( path : str ) -> str:
+
+    ''' Return the text of a bundled grammar file. '''
+
+    try:
+        return importlib.resources.files( __package__ + '.formats' )\
+            .joinpath( path ).read_text( encoding='utf-8' )
+    except AttributeError:
+        return importlib.resources.read_text(
+            __package__ + '.formats', path )
+
+def list_formats() -> list:
+
+    ''' Return the names of all bundled grammars. '''
+
+    try:
+        names = [x.name for x in \
+            importlib.resources.files( __package__ + '.formats' ).iterdir()]
+    except AttributeError:
+        names = importlib.resources.contents( __package__ + '.formats' )
+
+    return sorted( [os.path.splitext( x )[0] for x in names \
+        if x.endswith( '.yaml' )] )
+
+# Entry point group for decoders installed by other packages.
+DECODER_ENTRY_POINTS = 'vbincarver.decoders'
+
+def load_decoder( name : str ):
+
+    ''' Return the decoder function a struct names with its decoder key:
+    module:function, with the module looked up among the bundled grammars
+    first and then as a full module path, or else the name of an entry point
+    in the vbincarver.decoders group. '''
+
+    if ':' in name:
+        module_name, func_name = name.split( ':' )
+        bundled_name = __package__ + '.formats.' + module_name
+        try:
+            module = importlib.import_module( bundled_name )
+        except ModuleNotFoundError as e:
+            # Errors importing a bundled module's own imports are its own.
+            if e.name != bundled_name:
+                raise
+            module = importlib.import_module( module_name )
+        if not hasattr( module, func_name ):
+            raise ConfigException( 'no decoder {} in {}'.format(
+                func_name, module.__name__ ) )
+        return getattr( module, func_name )
+
+    entry_points = importlib.metadata.entry_points()
+    try:
+        entry_points = entry_points.select( group=DECODER_ENTRY_POINTS )
+    except AttributeError:
+        entry_points = entry_points.get( DECODER_ENTRY_POINTS, [] )
+
+    for entry_point in entry_points:
+        if name == entry_point.name:
+            return entry_point.load()
+
+    raise ConfigException( 'decoder not found: {}'.format( name ) )
+
+class FormatIndex( object ):
+
+    ''' Magic number index over all bundled grammars, so a grammar can be
+    picked from the first few bytes of a file without loading them all. '''
+
+    CACHE_VERSION = 2
+
+    def __init__( self ):
+
+        # (offset, length) -> {magic bytes: [format names]}
+        self.signatures = {}
+
+        self.shapes = []
+        self.header_len = 1
+
+    def _sort_shapes( self ):
+
+        # Try longer (more specific) signatures first.
+        self.shapes = sorted( self.signatures,
+            key=lambda x: (x[1], -x[0]), reverse=True )
+        self.header_len = max( [x[0] + x[1] for x in self.shapes] + [1] )
+
+    @staticmethod
+    def magic_bytes( field_def : dict ) -> bytes:
+
+        ''' Convert a field's (or a grammar's declared) "magic" value to
+        the bytes it matches. '''
+
+        if str == type( field_def['magic'] ):
+            return field_def['magic'].encode( 'latin-1' )
+
+        return int( field_def['magic'] ).to_bytes(
+            field_def['size'],
+            'little' if field_def.get( 'lsbf' ) else 'big' )
+
+    def add_signature( self, format_name : str, offset : int, magic : bytes ):
+        shape = (offset, len( magic ))
+        if not shape in self.signatures:
+            self.signatures[shape] = {}
+        if not magic in self.signatures[shape]:
+            self.signatures[shape][magic] = []
+        if not format_name in self.signatures[shape][magic]:
+            self.signatures[shape][magic].append( format_name )
+        self._sort_shapes()
+
+    def add_format( self, format_name : str, format_data ):
+
+        ''' Index the magic values a loaded grammar declares, the static
+        struct at offset 0 and the chunk magic numbers. '''
+
+        logger = logging.getLogger( 'config.index' )
+
+        # Signatures not in any struct, like a container's type ID.
+        for magic in format_data.format_data.get( 'magic', [] ):
+            logger.debug( 'indexing %s declared magic at %d: %s',
+                format_name, magic['offset'], magic['magic'] )
+            self.add_signature( format_name, magic['offset'],
+                FormatIndex.magic_bytes( magic ) )
+
+        static_at_zero = False
+        for struct_key in format_data['structs']:
+            struct_def = format_data['structs'][struct_key]
+            if 'static' != struct_def.get( 'offset_type' ) or \
+            0 != struct_def.get( 'offset' ):
+                continue
+
+            static_at_zero = True
+
+            # Merge magic fields into contiguous runs.
+            pieces = []
+            for field_key in struct_def['fields']:
+                field_def = struct_def['fields'][field_key]
+                if 'magic' not in field_def or 'offset' not in field_def:
+                    continue
+                magic = FormatIndex.magic_bytes( field_def )
+                if pieces and \
+                pieces[-1][0] + len( pieces[-1][1] ) == field_def['offset']:
+                    pieces[-1] = (pieces[-1][0], pieces[-1][1] + magic)
+                else:
+                    pieces.append( (field_def['offset'], magic) )
+
+            for piece in pieces:
+                logger.debug( 'indexing %s magic at %d: %s',
+                    format_name, piece[0], piece[1] )
+                self.add_signature( format_name, piece[0], piece[1] )
+
+        # A file without a static header may start with any of its chunks.
+        if not static_at_zero:
+            for struct_key in format_data['structs']:
+                struct_def = format_data['structs'][struct_key]
+                if 'chunk' != struct_def.get( 'offset_type' ):
+                    continue
+                logger.debug( 'indexing %s chunk magic at %d: %s',
+                    format_name, format_data['chunk_type_offset'],
+                    struct_def['offset_magic'] )
+                self.add_signature( format_name,
+                    format_data['chunk_type_offset'],
+                    struct_def['offset_magic'].encode( 'latin-1' ) )
+
+    def detect( self, header : bytes ) -> str:
+
+        ''' Return the name of the grammar matching the given file header,
+        or None if no grammar matches. '''
+
+        for shape in self.shapes:
+            candidates = self.signatures[shape].get(
+                bytes( header[shape[0]:shape[0] + shape[1]] ) )
+            if candidates:
+                return candidates[0]
+
+        return None
+
+    def to_dict( self ) -> dict:
+        return {
+            'version': FormatIndex.CACHE_VERSION,
+            'signatures': [[x[0], y.hex(), self.signatures[x][y]] \
+                for x in self.signatures for y in self.signatures[x]]}
+
+    @staticmethod
+    def from_dict( data : dict ):
+        index = FormatIndex()
+        for sig in data['signatures']:
+            for format_name in sig[2]:
+                index.add_signature(
+                    format_name, sig[0], bytes.fromhex( sig[1] ) )
+        return index
+
+    @staticmethod
+    def formats_stamp() -> str:
+
+        ''' Return a digest of all bundled grammars, to tell if a cached
+        index is stale. '''
+
+        digest = hashlib.sha1()
+        for format_name in list_formats():
+            digest.update( format_name.encode( 'utf-8' ) )
+            digest.update(
+                read_format( format_name + '.yaml' ).encode( 'utf-8' ) )
+        return digest.hexdigest()
+
+    @staticmethod
+    def cache_path() -> str:
+        return os.path.join(
+            os.environ.get( 'XDG_CACHE_HOME',
+                os.path.join( os.path.expanduser( '~' ), '.cache' ) ),
+            'vbincarver', 'magic_index.json' )
+
+    @staticmethod
+    def build():
+
+        ''' Build the index by loading every bundled grammar. '''
+
+        logger = logging.getLogger( 'config.index' )
+
+        index = FormatIndex()
+        for format_name in list_formats():
+            logger.debug( 'indexing format %s...', format_name )
+            index.add_format( format_name, FormatConfig( None, format_name ) )
+        return index
+
+    @staticmethod
+    def load():
+
+        ''' Return the index from the on-disk cache, rebuilding and saving
+        it if the bundled grammars have changed since. '''
+
+        logger = logging.getLogger( 'config.index' )
+
+        stamp = FormatIndex.formats_stamp()
+        cache_path = FormatIndex.cache_path()
+
+        try:
+            with open( cache_path, 'r' ) as cache_file:
+                data = json.load( cache_file )
+            if FormatIndex.CACHE_VERSION == data['version'] and \
+            stamp == data['stamp']:
+                return FormatIndex.from_dict( data )
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug( 'could not use cached index: %s', e )
+
+        index = FormatIndex.build()
+
+        data = index.to_dict()
+        data['stamp'] = stamp
+        try:
+            os.makedirs( os.path.dirname( cache_path ), exist_ok=True )
+            with open( cache_path, 'w' ) as cache_file:
+                json.dump( data, cache_file )
+        except OSError as e:
+            logger.debug( 'could not write cached index: %s', e )
+
+        return index
+
+_format_index = None
+
+def get_format_index() -> FormatIndex:
+
+    ''' Return the magic number index, loading it once per process. '''
+
+    global _format_index
+
+    if not _format_index:
+        _format_index = FormatIndex.load()
+    return _format_index
+
+def detect_format( parse_path : str ) -> str:
+
+    ''' Return the name of the grammar matching the magic number of the file
+    at the given path, or None. '''
+
+    index = get_format_index()
+    with open( parse_path, 'rb' ) as parse_file:
+        return index.detect( parse_file.read( index.header_len ) )
+
+# Prefixes of the byte predicates a struct or field may have: first_byte_*
+# for its first byte, match_field_byte_* for its match_field's contents.
+BYTE_PREDICATE_PREFIXES = ['first', 'match_field']
+
+def compile_byte_table( element : dict, prefix : str ) -> bytes:
+
+    ''' Return a table with a 1 for each byte value passing all of the
+    element's byte predicates with the given prefix, and a 0 for the rest,
+    so that they can be checked with one lookup. '''
+
+    def passes( c : int ) -> bool:
+        if prefix + '_byte_is' in element and \
+        c not in element[prefix + '_byte_is']:
+            return False
+        if prefix + '_byte_is_and' in element and \
+        not [x for x in element[prefix + '_byte_is_and'] if x == c & x]:
+            return False
+        if prefix + '_byte_not' in element and \
+        c in element[prefix + '_byte_not']:
+            return False
+        if prefix + '_byte_not_and' in element and \
+        [x for x in element[prefix + '_byte_not_and'] if x == c & x]:
+            return False
+        if prefix + '_byte_gt' in element and \
+        c <= element[prefix + '_byte_gt']:
+            return False
+        if prefix + '_byte_lt' in element and \
+        c >= element[prefix + '_byte_lt']:
+            return False
+        return True
+
+    return bytes( [1 if passes( x ) else 0 for x in range( 256 )] )
+
 class FormatConfig( object ):
 
     def open_format( self, path ):
-        try:
-            # TODO: This is untested since we're on Python 3.8.
-            return importlib.resources.files( __package__ + '.formats' )\
-                .joinpath( path ).open( 'r', encoding=encoding )
-        except AttributeError:
-            return importlib.resources.read_text(
-                __package__ + '.formats', path )
+        return read_format( path )
 
     def __init__( self, parse_path : str, format_name : str = None ):
 
         logger = logging.getLogger( 'config.format' )
 
-        format_file = None
-        if format_name:
+        if not format_name:
+            format_name = detect_format( parse_path )
+            if format_name:
+                logger.debug( 'detected format %s from magic number',
+                    format_name )
+            else:
+                # Fall back to the file extension.
+                format_name = \
+                    os.path.splitext( parse_path )[1][1:].lower()
+        if not format_name:
+            raise ConfigException( 'could not detect the format of {}; ' \
+                'give one with -f'.format( parse_path ) )
+
+        self.format_name = format_name
+        try:
             format_file = self.open_format( format_name + '.yaml' )
-        else:
-            file_ext = os.path.splitext( parse_path )[1]
-            format_file = self.open_format( file_ext[1:].lower() + '.yaml' )
-        assert( None != format_file )
+        except OSError:
+            raise ConfigException( 'unknown format: {}'.format(
+                format_name ) )
 
         self.format_data = yaml.load( format_file, Loader=yaml.Loader )
 
@@ -55,7 +373,6 @@ class FormatConfig( object ):
 
         for struct_key in format_data['structs']:
             struct_def = format_data['structs'][struct_key]
-            struct_def['counts_written'] = 0
             if 'offset_field' in struct_def:
                 struct_def['offset_field'] = \
                     struct_def['offset_field'].split( '/' )
@@ -67,6 +384,11 @@ class FormatConfig( object ):
             assert( struct_def['summarize'] in \
                 ['sum_repeat', 'first_only', 'none',
                 'no_fields', 'default'] )
+            struct_def['byte_tables'] = \
+                {x: compile_byte_table( struct_def, x ) \
+                    for x in BYTE_PREDICATE_PREFIXES}
+            if 'decoder' in struct_def:
+                struct_def['decode'] = load_decoder( struct_def['decoder'] )
 
             for field_key in struct_def['fields']:
                 field_def = struct_def['fields'][field_key]
@@ -95,6 +417,9 @@ class FormatConfig( object ):
                     field_def['mod_contents'] = 'field_contents'
                 if 'summarize' not in field_def:
                     field_def['summarize'] = 'default'
+                field_def['byte_tables'] = \
+                    {x: compile_byte_table( field_def, x ) \
+                        for x in BYTE_PREDICATE_PREFIXES}
                 assert( field_def['summarize'] in \
                     ['sum_repeat', 'first_only', 'none', 'default'] )
 
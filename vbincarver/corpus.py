@@ -0,0 +1,285 @@
+
+import os
+import json
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .parser import FileParser, ParseLimits
+from .config import FormatConfig, detect_format
+
+class CorpusStats( object ):
+
+    ''' Histograms, ranges and counts of stored field values, and counts of
+    struct instances, over many files, kept per grammar. Stats gathered
+    separately (from each file, or an earlier run) are combined with
+    merge(), and kept in a JSON-ready dict so they can be saved and passed
+    between processes. '''
+
+    def __init__( self, max_bins : int = 1000 ):
+
+        # Values past this many per field are only counted under "other".
+        self.max_bins = max_bins
+
+        self.stats = {'files': 0, 'bytes': 0, 'limited': 0, 'failed': {},
+            'formats': {}}
+
+    def _format_stats( self, format_name : str ) -> dict:
+        if not format_name in self.stats['formats']:
+            self.stats['formats'][format_name] = \
+                {'files': 0, 'structs': {}, 'fields': {}}
+        return self.stats['formats'][format_name]
+
+    def _add_value( self, field : dict, value_key : str, count : int ):
+        if value_key in field['histogram'] or \
+        len( field['histogram'] ) < self.max_bins:
+            field['histogram'][value_key] = \
+                field['histogram'].get( value_key, 0 ) + count
+        else:
+            field['other'] += count
+
+    def _merge_range( self, field : dict, low, high ):
+        if None != low and (None == field['min'] or low < field['min']):
+            field['min'] = low
+        if None != high and (None == field['max'] or high > field['max']):
+            field['max'] = high
+
+    def add_parse( self, format_name : str, file_parser : FileParser ):
+
+        ''' Add the struct counts and stored field values of a finished
+        parse. '''
+
+        self.stats['files'] += 1
+        self.stats['bytes'] += len( file_parser.in_file )
+        if file_parser.limit_reached:
+            self.stats['limited'] += 1
+
+        format_stats = self._format_stats( format_name )
+        format_stats['files'] += 1
+
+        for struct_key in file_parser.struct_counts:
+            count = file_parser.struct_counts[struct_key]
+            if not count:
+                continue
+            struct = format_stats['structs'].setdefault(
+                struct_key, {'count': 0, 'files': 0} )
+            struct['count'] += count
+            struct['files'] += 1
+
+        field_storage = file_parser.storage.field_storage
+        for struct_key in field_storage:
+            for field_key in field_storage[struct_key]['fields']:
+                values = field_storage[struct_key]['fields'][field_key]
+                field = format_stats['fields'].setdefault(
+                    '{}/{}'.format( struct_key, field_key ),
+                    {'count': 0, 'files': 0, 'min': None, 'max': None,
+                        'histogram': {}, 'other': 0} )
+                field['count'] += len( values )
+                field['files'] += 1
+
+                # Strings get histograms, but only numbers have a range.
+                numbers = [x for x in values if type( x ) in [int, float]]
+                if numbers:
+                    self._merge_range( field, min( numbers ), max( numbers ) )
+
+                for value in values:
+                    self._add_value(
+                        field, json.dumps( value, default=repr ), 1 )
+
+    def add_failure( self, path : str, error : str ):
+        self.stats['failed'][path] = error
+
+    def merge( self, stats : dict ):
+
+        ''' Add stats from another CorpusStats' stats dict. '''
+
+        for key in ['files', 'bytes', 'limited']:
+            self.stats[key] += stats[key]
+        self.stats['failed'].update( stats['failed'] )
+
+        for format_name in stats['formats']:
+            other_format = stats['formats'][format_name]
+            format_stats = self._format_stats( format_name )
+            format_stats['files'] += other_format['files']
+
+            for struct_key in other_format['structs']:
+                struct = format_stats['structs'].setdefault(
+                    struct_key, {'count': 0, 'files': 0} )
+                for key in ['count', 'files']:
+                    struct[key] += other_format['structs'][struct_key][key]
+
+            for field_key in other_format['fields']:
+                other_field = other_format['fields'][field_key]
+                if not field_key in format_stats['fields']:
+                    format_stats['fields'][field_key] = \
+                        {'count': 0, 'files': 0, 'min': None, 'max': None,
+                            'histogram': {}, 'other': 0}
+                field = format_stats['fields'][field_key]
+                for key in ['count', 'files', 'other']:
+                    field[key] += other_field[key]
+                self._merge_range(
+                    field, other_field['min'], other_field['max'] )
+
+                # Add the most common values first, so they get the bins.
+                for value_key, count in sorted(
+                    other_field['histogram'].items(), key=lambda x: -x[1]
+                ):
+                    self._add_value( field, value_key, count )
+
+def _parse_file_stats(
+    path : str, format_name : str, limits : ParseLimits, max_bins : int
+) -> dict:
+
+    ''' Return the CorpusStats stats dict for a single file. Run in
+    corpus_stats() workers. '''
+
+    logger = logging.getLogger( 'corpus.file' )
+
+    file_stats = CorpusStats( max_bins )
+
+    try:
+        if not format_name:
+            format_name = detect_format( path )
+        if not format_name:
+            file_stats.add_failure( path, 'unknown format' )
+            return file_stats.stats
+
+        # Grammars are kept loaded for the life of the worker.
+        if not format_name in _parse_file_stats.formats:
+            _parse_file_stats.formats[format_name] = \
+                FormatConfig( path, format_name )
+
+        # Nothing is rendered, so the bytes needn't be kept.
+        with open( path, 'rb' ) as parse_file:
+            file_parser = FileParser( parse_file.read(),
+                _parse_file_stats.formats[format_name], limits=limits,
+                keep_buffer=False )
+        file_parser.parse()
+        file_stats.add_parse( format_name, file_parser )
+
+    except Exception as e:
+        logger.warning( 'could not parse %s: %s', path, e )
+        file_stats.add_failure( path, '{}: {}'.format(
+            type( e ).__name__, e ) )
+
+    return file_stats.stats
+
+_parse_file_stats.formats = {}
+
+def list_corpus( paths : list ) -> list:
+
+    ''' Return the files under the given files or directories, sorted. '''
+
+    files = []
+    for path in paths:
+        if os.path.isdir( path ):
+            for dir_path, dir_names, file_names in os.walk( path ):
+                files += [os.path.join( dir_path, x ) for x in file_names]
+        else:
+            files.append( path )
+    return sorted( files )
+
+def _save_resume( resume_path : str, stats : CorpusStats, done : set ):
+    with open( resume_path + '.tmp', 'w' ) as resume_file:
+        json.dump( {'stats': stats.stats, 'done': sorted( done )},
+            resume_file )
+    os.replace( resume_path + '.tmp', resume_path )
+
+def corpus_stats(
+    paths : list, format_name : str = None, workers : int = None,
+    resume_path : str = None, limits : ParseLimits = None,
+    max_bins : int = 1000, save_interval : int = 100
+) -> CorpusStats:
+
+    ''' Parse every file under the given paths on a pool of worker
+    processes, without rendering anything, and return their merged stats.
+    With a resume_path, the stats so far and the files done are saved there
+    every save_interval files (and if interrupted), and files already done
+    in it are skipped. Files that kill their worker process are listed as
+    failed, and the rest carry on. '''
+
+    logger = logging.getLogger( 'corpus' )
+
+    stats = CorpusStats( max_bins )
+    done = set()
+    if resume_path and os.path.exists( resume_path ):
+        with open( resume_path ) as resume_file:
+            resume = json.load( resume_file )
+        stats.merge( resume['stats'] )
+        done = set( resume['done'] )
+        logger.info( 'resuming after %d files...', len( done ) )
+
+    todo = deque( [x for x in list_corpus( paths ) if not x in done] )
+    workers = workers if workers else os.cpu_count()
+
+    # Files in flight when a worker died (e.g. killed for running out of
+    # memory), to be parsed again one at a time to find which killed it.
+    suspects = deque()
+
+    def add_stats( path : str, file_stats : dict ):
+        stats.merge( file_stats )
+        done.add( path )
+        if resume_path and 0 == len( done ) % save_interval:
+            _save_resume( resume_path, stats, done )
+
+    def failed_stats( path : str, error : str ) -> dict:
+        logger.warning( 'could not parse %s: %s', path, error )
+        file_stats = CorpusStats( max_bins )
+        file_stats.add_failure( path, error )
+        return file_stats.stats
+
+    try:
+        while todo or suspects:
+
+            if suspects:
+                path = suspects.popleft()
+                with ProcessPoolExecutor( 1 ) as pool:
+                    future = pool.submit( _parse_file_stats,
+                        path, format_name, limits, max_bins )
+                    try:
+                        file_stats = future.result()
+                    except BrokenProcessPool:
+                        file_stats = failed_stats( path, 'worker died' )
+                    except Exception as e:
+                        file_stats = failed_stats( path, '{}: {}'.format(
+                            type( e ).__name__, e ) )
+                add_stats( path, file_stats )
+                continue
+
+            with ProcessPoolExecutor( workers ) as pool:
+
+                # Only keep a few files per worker in flight.
+                pending = deque()
+                try:
+                    while todo or pending:
+                        while todo and len( pending ) < 4 * workers:
+                            path = todo.popleft()
+                            pending.append( (path, pool.submit(
+                                _parse_file_stats, path, format_name,
+                                limits, max_bins )) )
+
+                        path, future = pending[0]
+                        try:
+                            file_stats = future.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            file_stats = failed_stats( path, '{}: {}'.format(
+                                type( e ).__name__, e ) )
+                        pending.popleft()
+                        add_stats( path, file_stats )
+
+                except BrokenProcessPool:
+                    logger.warning( 'a worker died, parsing the %d files ' \
+                        'in flight again one at a time...', len( pending ) )
+                    suspects.extend( [x[0] for x in pending] )
+
+    except KeyboardInterrupt:
+        logger.info( 'interrupted after %d files.', len( done ) )
+        raise
+
+    finally:
+        if resume_path:
+            _save_resume( resume_path, stats, done )
+
+    return stats
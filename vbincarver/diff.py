@@ -0,0 +1,211 @@
+
+import json
+import hashlib
+from collections import OrderedDict
+from .parser import FileParser, FileParserStorage
+
+class StructDiff( object ):
+
+    ''' Compares the stored field records of two parses under the same
+    grammar, one struct instance at a time. Each instance is reduced to a
+    digest of its fields' names, sizes and contents and of its bytes (but
+    not its offset), so only instances whose digests differ are looked at
+    field by field. The bytes catch changes in fields whose contents
+    aren't kept, like summed repeats of pixel data.
+
+    Instances are paired up by struct and sid, or for structs given key
+    fields, by the contents of those fields (and then by order, among
+    instances with the same key). '''
+
+    def __init__(
+        self, old_parser : FileParser, new_parser : FileParser,
+        key_fields : dict = None
+    ):
+
+        self.old_parser = old_parser
+        self.new_parser = new_parser
+
+        # Struct -> list of fields whose contents identify its instances.
+        self.key_fields = key_fields if key_fields else {}
+
+    def _instance_key( self, instance : dict ):
+        if instance['struct'] in self.key_fields:
+            return tuple( [instance['keys'].get( x ) \
+                for x in self.key_fields[instance['struct']]] )
+        return instance['sid']
+
+    def _instances( self, file_parser : FileParser ) -> OrderedDict:
+
+        ''' Return (struct, key, nth with that key) -> offset, sid and
+        digest of every struct instance with stored records, in order. '''
+
+        instances = OrderedDict()
+        key_counts = {}
+        in_file = memoryview( file_parser.in_file )
+        spans = {(x[2], x[3]): x[:2] for x in file_parser.struct_spans}
+
+        def add_instance( instance : dict ):
+            key = (instance['struct'], self._instance_key( instance ))
+            nth = key_counts.get( key, 0 )
+            key_counts[key] = nth + 1
+            span = spans.get( (instance['struct'], instance['sid']) )
+            if span:
+                instance['hash'].update( in_file[span[0]:span[1]] )
+            instances[key + (nth,)] = {
+                'offset': instance['offset'],
+                'sid': instance['sid'],
+                'digest': instance['hash'].digest()}
+
+        instance = None
+        for offset, record in file_parser.storage.records():
+            if not instance or instance['struct'] != record['struct'] or \
+            instance['sid'] != record['sid']:
+                if instance:
+                    add_instance( instance )
+                instance = {
+                    'struct': record['struct'],
+                    'sid': record['sid'],
+                    'offset': offset,
+                    'keys': {},
+                    'hash': hashlib.blake2b( digest_size=16 )}
+
+            instance['hash'].update( json.dumps( [record['field'],
+                record['fid'], record['size'], record['contents']] ).encode(
+                    'utf-8' ) + b'\n' )
+
+            if record['field'] in self.key_fields.get( record['struct'], [] ) \
+            and not record['field'] in instance['keys']:
+                instance['keys'][record['field']] = record['contents']
+
+        if instance:
+            add_instance( instance )
+
+        return instances
+
+    def _instance_fields( self, storage : FileParserStorage, sids : set ):
+
+        ''' Return (struct, sid) -> (field, fid) -> record with its offset,
+        for the given (struct, sid) instances. '''
+
+        fields = {}
+        for offset, record in storage.records():
+            if (record['struct'], record['sid']) in sids:
+                record = dict( record )
+                record['offset'] = offset
+                fields.setdefault( (record['struct'], record['sid']), \
+                    OrderedDict() )[(record['field'], record['fid'])] = record
+        return fields
+
+    def _field_side( self, in_file, record : dict ) -> dict:
+
+        ''' Return the offset, size and contents of a field record, with a
+        digest of its bytes. '''
+
+        side = {x: record[x] for x in ['offset', 'size', 'contents']}
+        side['digest'] = hashlib.blake2b( in_file[record['offset']:
+            record['offset'] + record['size']], digest_size=8 ).hexdigest()
+        return side
+
+    def _field_changes( self, old_fields : dict, new_fields : dict ) -> list:
+
+        old_file = memoryview( self.old_parser.in_file )
+        new_file = memoryview( self.new_parser.in_file )
+
+        changes = []
+        for field_key in list( old_fields ) + \
+        [x for x in new_fields if not x in old_fields]:
+            old = old_fields.get( field_key )
+            old = self._field_side( old_file, old ) if old else None
+            new = new_fields.get( field_key )
+            new = self._field_side( new_file, new ) if new else None
+            if old and new and old['contents'] == new['contents'] and \
+            old['size'] == new['size'] and old['digest'] == new['digest']:
+                continue
+            changes.append( {
+                'field': field_key[0],
+                'fid': field_key[1],
+                'old': old,
+                'new': new} )
+        return changes
+
+    def diff( self ) -> list:
+
+        ''' Return a dict for each instance that was changed, removed or
+        added, with the fields that differ for changed instances. '''
+
+        old_instances = self._instances( self.old_parser )
+        new_instances = self._instances( self.new_parser )
+
+        changes = []
+        for ident in old_instances:
+            old = old_instances[ident]
+            new = new_instances.get( ident )
+            if new and new['digest'] == old['digest']:
+                continue
+            changes.append( {
+                'change': 'changed' if new else 'removed',
+                'struct': ident[0],
+                'key': ident[1],
+                'old': {'offset': old['offset'], 'sid': old['sid']},
+                'new': {'offset': new['offset'], 'sid': new['sid']} \
+                    if new else None} )
+
+        for ident in new_instances:
+            if not ident in old_instances:
+                new = new_instances[ident]
+                changes.append( {
+                    'change': 'added',
+                    'struct': ident[0],
+                    'key': ident[1],
+                    'old': None,
+                    'new': {'offset': new['offset'], 'sid': new['sid']}} )
+
+        # Only now look at the fields of instances that changed.
+        changed = [x for x in changes if 'changed' == x['change']]
+        old_fields = self._instance_fields( self.old_parser.storage,
+            set( [(x['struct'], x['old']['sid']) for x in changed] ) )
+        new_fields = self._instance_fields( self.new_parser.storage,
+            set( [(x['struct'], x['new']['sid']) for x in changed] ) )
+        for change in changed:
+            change['fields'] = self._field_changes(
+                old_fields[(change['struct'], change['old']['sid'])],
+                new_fields[(change['struct'], change['new']['sid'])] )
+
+        return changes
+
+    def _format_side( self, side : dict ) -> str:
+        return '@{} ({})'.format( side['offset'], hex( side['offset'] ) ) \
+            if side else '-'
+
+    def _format_field( self, side : dict ) -> str:
+        if not side:
+            return '-'
+        if None == side['contents']:
+            # Only the bytes are known, so show their digest.
+            return '<{} bytes {}>'.format( side['size'], side['digest'] )
+        return repr( side['contents'] )
+
+    def write_text( self, out_file, changes : list ):
+
+        ''' Write the given changes from diff() as plain text. '''
+
+        for change in changes:
+            out_file.write( '{} {} {}: {} -> {}\n'.format(
+                change['change'], change['struct'], change['key'],
+                self._format_side( change['old'] ),
+                self._format_side( change['new'] ) ) )
+            for field in change.get( 'fields', [] ):
+                out_file.write( '    {}[{}]: {} -> {}\n'.format(
+                    field['field'], field['fid'],
+                    self._format_field( field['old'] ),
+                    self._format_field( field['new'] ) ) )
+
+        out_file.write( '{} struct instance(s) differ.\n'.format(
+            len( changes ) ) )
+
+    def write_json( self, out_file, changes : list ):
+
+        ''' Write the given changes from diff() as JSON, one per line. '''
+
+        for change in changes:
+            out_file.write( json.dumps( change ) + '\n' )
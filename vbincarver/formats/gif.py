@@ -0,0 +1,27 @@
+
+''' Decoders for gif.yaml structs that are slow to parse with the rules. '''
+
+from ..parser import NeedMoreInput
+
+def decode_sub_blocks( data : memoryview, parser ) -> tuple:
+
+    ''' Decode a chain of data sub-blocks, each a size byte followed by that
+    many bytes, up to the zero size byte that ends it. '''
+
+    fields = []
+    pos = 0
+    while pos < len( data ):
+        size = data[pos]
+        if not size:
+            fields.append( (pos, 1, 'terminator', 0) )
+            return pos + 1, fields
+
+        if pos + 1 + size > len( data ):
+            raise NeedMoreInput()
+
+        # The LZW codes themselves aren't worth storing.
+        fields.append( (pos, 1, 'size', size) )
+        fields.append( (pos + 1, size, 'byte', None) )
+        pos += 1 + size
+
+    raise NeedMoreInput()
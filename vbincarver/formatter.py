@@ -1,4 +1,14 @@
 
+import io
+import os
+import sys
+import json
+import html
+import bisect
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from .parser import FileParser
 
 class BytesFormatter( object ):
@@ -59,6 +69,59 @@ class BytesFormatter( object ):
     def format_class( self, str_in : str ) -> str:
         return str_in.replace( '_', '-' )
 
+    def struct_spans( self ) -> list:
+
+        ''' Return the parser's struct spans, with the struct still open
+        where parsing stopped, if any. '''
+
+        spans = self.parser.struct_spans
+        if self.parser.spans_open:
+            span = self.parser.spans_open[0]
+            spans = spans + [(self.parser.bytes_written - span.bytes_written,
+                self.parser.bytes_written, span.key, span.sid)]
+        return spans
+
+    def write_limit( self, indent : int = 0 ):
+
+        ''' Write a marker saying where and why parsing stopped, if it
+        stopped at a limit. '''
+
+        limit = self.parser.limit_reached
+        if not limit:
+            return
+
+        self.open_div( 'hex-limit', indent=indent,
+            data_key='offset', data=str( limit['offset'] ),
+            contents='Parsing stopped @{} ({}): {}'.format(
+                limit['offset'], hex( limit['offset'] ), limit['reason'] ),
+            close=True )
+
+class PageFormatter( BytesFormatter ):
+
+    ''' Writes the HTML document that the other formatters go inside. '''
+
+    def __init__(
+        self, out_file, parser : FileParser, css_href : str = 'hex.css',
+        js_href : str = 'hex.js'
+    ):
+
+        super().__init__( out_file, parser )
+
+        self.css_href = css_href
+        self.js_href = js_href
+
+    def write_head( self ):
+        self.out_file.write( '<!DOCTYPE html>\n<html>\n<head>\n' )
+        self.out_file.write(
+            '<link rel="stylesheet" href="{}" />\n'.format( self.css_href ) )
+        self.out_file.write( '<script src="https://code.jquery.com/jquery-3.7.1.min.js" integrity="sha256-/JqT3SQfawRcv/BIHPThkBvs0OEvtFFmqPF/lYI/Cxo=" crossorigin="anonymous"></script>\n' )
+        self.out_file.write(
+            '<script src="{}"></script>\n'.format( self.js_href ) )
+        self.out_file.write( '</head>\n<body>\n' )
+
+    def write_tail( self ):
+        self.out_file.write( '</body></html>' )
+
 class HexFormatter( BytesFormatter ):
 
     INDENT_LINE=1
@@ -66,7 +129,13 @@ class HexFormatter( BytesFormatter ):
     INDENT_FIELD=3
     INDENT_BYTE=4
 
-    def __init__( self, out_file, parser : FileParser, column_len : int=20 ):
+    # Leading bytes to show for collapsed runs.
+    RUN_LEAD = 8
+
+    def __init__(
+        self, out_file, parser : FileParser, column_len : int=20,
+        collapse : int = 0
+    ):
 
         super().__init__( out_file, parser )
     
@@ -76,6 +145,14 @@ class HexFormatter( BytesFormatter ):
         self.last_field = None
         self.last_field_id = None
         self.column_len = column_len
+        self.buffer_pos = 0
+        self.gap_pos = 0
+
+        # Runs of at least this many free bytes, hidden bytes or bytes of
+        # one field are written as one placeholder line (0 for none).
+        self.collapse = collapse
+        self.runs = []
+        self.run_pos = 0
 
     def break_line( self ):
 
@@ -113,12 +190,144 @@ class HexFormatter( BytesFormatter ):
             type_in, type_in, class_in.replace( '_', '-' ), sid ),
             indent=indent )
 
-    def write_layout( self ):
-
+    def write_head( self ):
         self.open_div( 'hex-layout' )
         self.open_div( 'hex-line', indent=HexFormatter.INDENT_LINE )
 
-        for buf_tup in self.parser.buffer:
+    def write_gap( self, offset : int ):
+
+        ''' Write a marker where bytes outside of the parser's selection
+        were left out, and start a new line after it. '''
+
+        if self.last_field:
+            self.close_span( indent=HexFormatter.INDENT_FIELD )
+        if self.last_struct:
+            self.close_span( indent=HexFormatter.INDENT_STRUCT )
+        self.close_div( indent=HexFormatter.INDENT_LINE )
+
+        self.open_div( 'hex-gap', indent=HexFormatter.INDENT_LINE,
+            data_key='offset', data=str( offset ),
+            contents='@{} ({})'.format( offset, hex( offset ) ), close=True )
+        self.open_div( 'hex-line', indent=HexFormatter.INDENT_LINE )
+
+        self.bytes_written = 0
+        self.last_struct = None
+        self.last_struct_id = None
+        self.last_field = None
+        self.last_field_id = None
+
+    def find_runs( self, buffer : list, gaps : list, start : int ) -> list:
+
+        ''' Return (buffer index, length, offset) for each run from the
+        given buffer index on of at least collapse entries in no struct, or
+        in the same field (or struct, outside of fields) of one instance.
+        Runs stop at gaps. '''
+
+        runs = []
+        gap_idx = bisect.bisect_right( [x[0] for x in gaps], start ) - 1
+        pos = start
+        while pos < len( buffer ):
+            while gap_idx + 1 < len( gaps ) and gaps[gap_idx + 1][0] <= pos:
+                gap_idx += 1
+            run_end = gaps[gap_idx + 1][0] \
+                if gap_idx + 1 < len( gaps ) else len( buffer )
+
+            struct, sid, field = buffer[pos][1:4]
+            end = pos + 1
+            while end < run_end and buffer[end][3] == field and \
+            buffer[end][2] == sid and buffer[end][1] == struct:
+                end += 1
+
+            if end - pos >= self.collapse:
+                runs.append( (pos, end - pos, pos - gaps[gap_idx][0] + \
+                    gaps[gap_idx][1] if 0 <= gap_idx else pos) )
+            pos = end
+
+        return runs
+
+    def write_run( self, buffer : list, run : tuple ):
+
+        ''' Write a placeholder line for the given run from find_runs(),
+        with its range, first few bytes and a digest of all of them, and
+        start a new line after it. '''
+
+        pos, length, offset = run
+        buf_tup = buffer[pos]
+        run_bytes = bytes( [x[0] for x in buffer[pos:pos + length]] )
+
+        if self.last_field:
+            self.close_span( indent=HexFormatter.INDENT_FIELD )
+        if self.last_struct:
+            self.close_span( indent=HexFormatter.INDENT_STRUCT )
+        self.close_div( indent=HexFormatter.INDENT_LINE )
+
+        self.open_div( 'hex-run {}'.format(
+            'hex-struct-' + self.format_class( buf_tup[1] ) \
+                if buf_tup[1] else 'hex-run-free' ),
+            indent=HexFormatter.INDENT_LINE,
+            data_key='offset', data=str( offset ),
+            contents='@{} ({}): {} bytes of {}: {} ... blake2b {}'.format(
+                offset, hex( offset ), length,
+                '/'.join( [x for x in buf_tup[1:4:2] if x] ) \
+                    if buf_tup[1] else 'free space',
+                ' '.join( ['{:02x}'.format( x ) \
+                    for x in run_bytes[:HexFormatter.RUN_LEAD]] ),
+                hashlib.blake2b( run_bytes, digest_size=8 ).hexdigest() ),
+            close=True )
+        self.open_div( 'hex-line', indent=HexFormatter.INDENT_LINE )
+
+        self.bytes_written = 0
+        self.last_struct = None
+        self.last_struct_id = None
+        self.last_field = None
+        self.last_field_id = None
+
+    def get_state( self ) -> tuple:
+
+        ''' Return the line position and open struct/field, which with the
+        bytes that follow are all that decides how they're written. '''
+
+        return (self.bytes_written, self.last_struct, self.last_struct_id,
+            self.last_field, self.last_field_id)
+
+    def set_state( self, state : tuple ):
+        self.bytes_written, self.last_struct, self.last_struct_id, \
+            self.last_field, self.last_field_id = state
+
+    def write_bytes( self ):
+
+        ''' Write the bytes added to the parser buffer since the last call.
+        '''
+
+        if self.collapse:
+            self.runs += self.find_runs( self.parser.buffer,
+                self.parser.buffer_gaps, self.buffer_pos )
+
+        self.write_buffer(
+            self.parser.buffer, self.parser.buffer_gaps, self.runs )
+
+    def write_buffer( self, buffer : list, gaps : list, runs : list = [] ):
+
+        ''' Write the given buffer entries from buffer_pos on, with gaps
+        given as (buffer index, offset) tuples and runs to collapse as
+        returned by find_runs(). '''
+
+        while self.buffer_pos < len( buffer ):
+            if self.gap_pos < len( gaps ) and \
+            gaps[self.gap_pos][0] == self.buffer_pos:
+                self.write_gap( gaps[self.gap_pos][1] )
+                self.gap_pos += 1
+
+            if self.run_pos < len( runs ) and \
+            runs[self.run_pos][0] == self.buffer_pos:
+                self.write_run( buffer, runs[self.run_pos] )
+                self.buffer_pos += runs[self.run_pos][1]
+                self.run_pos += 1
+                continue
+
+            buf_tup = buffer[self.buffer_pos]
+            self.buffer_pos += 1
+
             # Break up lines.
             if 0 == self.bytes_written % self.column_len and \
             0 != self.bytes_written:
@@ -136,8 +345,8 @@ class HexFormatter( BytesFormatter ):
             None != self.last_field:
                 self.close_span( indent=HexFormatter.INDENT_FIELD )
 
-            # Don't write next byte if hidden.
-            # TODO: Write the first 3 or so of a repeating pattern? Placehold?
+            # Don't write next byte if hidden. Long runs of hidden bytes
+            # can be collapsed to a placeholder, instead.
             if buf_tup[5]['hidden']:
                 continue
 
@@ -169,6 +378,8 @@ class HexFormatter( BytesFormatter ):
             self.last_field = buf_tup[3]
             self.last_field_id = buf_tup[4]
 
+    def write_tail( self ):
+
         if self.last_field:
             self.close_span( indent=HexFormatter.INDENT_FIELD )
 
@@ -176,14 +387,146 @@ class HexFormatter( BytesFormatter ):
             self.close_span( indent=HexFormatter.INDENT_STRUCT )
 
         self.close_div( indent=HexFormatter.INDENT_LINE )
+        self.write_limit( indent=HexFormatter.INDENT_LINE )
         self.close_div()
 
+    def write_layout( self ):
+        self.write_head()
+        self.write_bytes()
+        self.write_tail()
+
+def _render_hex_block(
+    column_len : int, state : tuple, buffer : list, gaps : list, runs : list
+) -> str:
+
+    ''' Return the hex dump of a block of the parser buffer, starting from
+    the given formatter state. Run in ParallelHexFormatter workers. '''
+
+    out_file = io.StringIO()
+    formatter = HexFormatter( out_file, None, column_len )
+    formatter.set_state( state )
+    formatter.write_buffer( buffer, gaps, runs )
+    return out_file.getvalue()
+
+class ParallelHexFormatter( HexFormatter ):
+
+    ''' HexFormatter that splits the buffer into blocks of lines and writes
+    them on a pool of worker processes, each starting from the state the
+    formatter would be in at its first byte. The fragments are written out
+    in order, so the output is the same as HexFormatter's. '''
+
+    def __init__(
+        self, out_file, parser : FileParser, column_len : int = 20,
+        workers : int = None, block_lines : int = 4096, collapse : int = 0
+    ):
+
+        super().__init__( out_file, parser, column_len, collapse )
+
+        self.workers = workers if workers else os.cpu_count()
+        self.block_sz = block_lines * column_len
+
+    def _blocks( self, buffer : list, gaps : list, runs : list ):
+
+        ''' Yield the state, buffer entries and (rebased) gaps and runs for
+        each block from buffer_pos on, leaving the formatter in the state it
+        would be in after writing them all. Blocks don't split runs. '''
+
+        state = self.get_state()
+        bytes_written = state[0]
+        last_ids = state[1:]
+
+        def block( end : int ):
+            return state, buffer[block_start:end], \
+                [(x[0] - block_start, x[1]) \
+                    for x in gaps[block_gap:self.gap_pos]], \
+                [(x[0] - block_start,) + x[1:] \
+                    for x in runs[block_run:self.run_pos]]
+
+        block_start = self.buffer_pos
+        block_gap = self.gap_pos
+        block_run = self.run_pos
+        pos = self.buffer_pos
+        while pos < len( buffer ):
+            if pos - block_start >= self.block_sz:
+                yield block( pos )
+                state = (bytes_written,) + last_ids
+                block_start = pos
+                block_gap = self.gap_pos
+                block_run = self.run_pos
+
+            # Follow how write_buffer() tracks lines and open spans.
+            if self.gap_pos < len( gaps ) and gaps[self.gap_pos][0] == pos:
+                bytes_written = 0
+                last_ids = (None, None, None, None)
+                self.gap_pos += 1
+
+            if self.run_pos < len( runs ) and runs[self.run_pos][0] == pos:
+                bytes_written = 0
+                last_ids = (None, None, None, None)
+                pos += runs[self.run_pos][1]
+                self.run_pos += 1
+                continue
+
+            buf_tup = buffer[pos]
+            if not buf_tup[5]['hidden']:
+                bytes_written += 1
+                last_ids = buf_tup[1:5]
+            pos += 1
+
+        yield block( len( buffer ) )
+
+        self.set_state( (bytes_written,) + last_ids )
+        self.buffer_pos = len( buffer )
+
+    def write_bytes( self ):
+
+        buffer = self.parser.buffer
+        gaps = self.parser.buffer_gaps
+
+        if self.collapse:
+            self.runs += self.find_runs( buffer, gaps, self.buffer_pos )
+
+        if len( buffer ) - self.buffer_pos <= self.block_sz:
+            # Not worth starting workers for.
+            self.write_buffer( buffer, gaps, self.runs )
+            return
+
+        with ProcessPoolExecutor( self.workers ) as pool:
+
+            # Only keep a few blocks per worker in flight, so the whole
+            # buffer isn't copied at once.
+            pending = deque()
+            for state, block, block_gaps, block_runs in \
+            self._blocks( buffer, gaps, self.runs ):
+                pending.append( pool.submit( _render_hex_block,
+                    self.column_len, state, block, block_gaps, block_runs ) )
+                if len( pending ) >= 2 * self.workers:
+                    self.out_file.write( pending.popleft().result() )
+
+            while pending:
+                self.out_file.write( pending.popleft().result() )
+
 class SummaryFormatter( BytesFormatter ):
 
+    ''' Writes the stored field records of each struct instance. With dedup,
+    instances whose fields are identical are written once, at the first of
+    them, with a list of where the rest are. '''
+
     INDENT_STRUCT = 1
     INDENT_FIELD = 2
     INDENT_FIELD_CONTENTS = 3
 
+    # Runs of offsets listed before the rest are only counted.
+    MAX_OCCURRENCE_RUNS = 32
+
+    def __init__(
+        self, out_file, parser : FileParser, dedup : bool = False
+    ):
+
+        super().__init__( out_file, parser )
+
+        self.dedup = dedup
+
     def format_field( self, contents, format_in : str ):
         if 'color' == format_in:
             style = 'background: #{}; width: 10px; height: 10px;'.format(
@@ -216,12 +559,7 @@ class SummaryFormatter( BytesFormatter ):
             contents='({} bytes)'.format(
 
                 # Sum sizes of all fields in the struct.
-                sum( [storage.byte_storage[x]['size'] \
-                    for x in storage.byte_storage \
-                        if storage.byte_storage[x]['struct'] == \
-                            storage.byte_storage[offset]['struct'] and \
-                        storage.byte_storage[x]['sid'] == \
-                            storage.byte_storage[offset]['sid']] )
+                storage.struct_size( hex_byte['struct'], hex_byte['sid'] )
 
                         ), indent=SummaryFormatter.INDENT_FIELD, close=True )
 
@@ -230,25 +568,125 @@ class SummaryFormatter( BytesFormatter ):
     def write_spacer( self, indent : int ):
         self.open_div( 'spacer', contents=' ', indent=indent, close=True )
 
+    def instance_digests( self ) -> list:
+
+        ''' Return [offset, sid, digest] for every struct instance with
+        stored records, in order. Instances of a struct with the same digest
+        have the same fields, sizes and contents. '''
+
+        instances = []
+        instance_hash = None
+        last_struct = ''
+        for offset, record in self.parser.storage.records():
+            if record['struct'] != last_struct or \
+            record['sid'] != last_sid:
+                if instance_hash:
+                    instances[-1][2] = instance_hash.digest()
+                instance_hash = hashlib.blake2b( digest_size=16 )
+                instance_hash.update( record['struct'].encode( 'utf-8' ) )
+                instances.append( [offset, record['sid'], None] )
+
+            instance_hash.update( json.dumps( [record['field'],
+                record['fid'], record['size'], record['contents']],
+                default=repr ).encode( 'utf-8' ) + b'\n' )
+
+            last_struct = record['struct']
+            last_sid = record['sid']
+
+        if instance_hash:
+            instances[-1][2] = instance_hash.digest()
+
+        return instances
+
+    def group_offsets( self, occurrences : list ) -> list:
+
+        ''' Group (offset, sid) occurrences into [first offset, last offset,
+        stride, count, sid of first] runs of evenly spaced offsets. '''
+
+        runs = []
+        for offset, sid in occurrences:
+            if runs and (1 == runs[-1][3] or \
+            offset - runs[-1][1] == runs[-1][2]):
+                runs[-1][2] = offset - runs[-1][1]
+                runs[-1][1] = offset
+                runs[-1][3] += 1
+            else:
+                runs.append( [offset, offset, 0, 1, sid] )
+        return runs
+
+    def write_occurrences( self, struct : str, occurrences : list ):
+
+        ''' Write where each instance a deduplicated instance stands for is,
+        with evenly spaced runs of them as ranges. Clicking one selects it in
+        the hex dump. '''
+
+        struct_class = 'hex-struct-{}'.format( self.format_class( struct ) )
+
+        self.open_div( 'hex-occurrences', indent=SummaryFormatter.INDENT_FIELD,
+            contents='{} times:'.format( len( occurrences ) ) )
+
+        runs = self.group_offsets( occurrences )
+        for first, last, stride, count, sid in \
+        runs[:SummaryFormatter.MAX_OCCURRENCE_RUNS]:
+            if 2 < count:
+                contents = '@{}-{} every {} ({})'.format(
+                    hex( first ), hex( last ), stride, count )
+            elif 2 == count:
+                contents = '@{}, @{}'.format( hex( first ), hex( last ) )
+            else:
+                contents = '@{}'.format( hex( first ) )
+            self.open_span( 'hex-occurrence',
+                indent=SummaryFormatter.INDENT_FIELD_CONTENTS,
+                data_key='struct', data='{}-{}'.format( struct_class, sid ),
+                contents=contents, close=True )
+
+        if SummaryFormatter.MAX_OCCURRENCE_RUNS < len( runs ):
+            self.open_span( 'hex-occurrence-more',
+                indent=SummaryFormatter.INDENT_FIELD_CONTENTS,
+                contents='and {} more'.format( sum( [x[3] for x in \
+                    runs[SummaryFormatter.MAX_OCCURRENCE_RUNS:]] ) ),
+                close=True )
+
+        self.close_div( indent=SummaryFormatter.INDENT_FIELD )
+
+        self.write_spacer( indent=SummaryFormatter.INDENT_FIELD )
+
     def write_layout( self ):
 
         storage = self.parser.storage
 
+        # Instances are hashed first, so each group's count is known when
+        # the first of it is written.
+        if self.dedup:
+            instances = self.instance_digests()
+            occurrences = {}
+            for offset, sid, digest in instances:
+                occurrences.setdefault( digest, [] ).append( (offset, sid) )
+        instance_idx = -1
+        skip = False
+
         self.out_file.write( '<div class="hex-fields"><div>' )
         #self.open_div( 'hex-fields'
         last_struct = ''
-        for key in storage.byte_storage:
+        for key, hex_byte in storage.records():
 
-            hex_byte = storage.byte_storage[key]
-                
-            if storage.byte_storage[key]['struct'] != \
+            if hex_byte['struct'] != \
             last_struct or \
-            storage.byte_storage[key]['sid'] != \
+            hex_byte['sid'] != \
             last_sid:
-                self.close_div( indent=SummaryFormatter.INDENT_STRUCT )
-                self.write_struct_head( key, hex_byte )
+                instance_idx += 1
+                if self.dedup:
+                    digest = instances[instance_idx][2]
+                    skip = occurrences[digest][0][0] != key
+                if not skip:
+                    self.close_div( indent=SummaryFormatter.INDENT_STRUCT )
+                    self.write_struct_head( key, hex_byte )
+                if not skip and self.dedup and \
+                1 < len( occurrences[digest] ):
+                    self.write_occurrences(
+                        hex_byte['struct'], occurrences[digest] )
 
-            if 'no_fields' != hex_byte['summarize']:
+            if not skip and 'no_fields' != hex_byte['summarize']:
                 # Write the field.
 
                 self.open_span(
@@ -277,11 +715,466 @@ class SummaryFormatter( BytesFormatter ):
 
                 self.write_spacer( indent=SummaryFormatter.INDENT_FIELD )
 
-            last_struct = storage.byte_storage[key]['struct']
-            last_sid = storage.byte_storage[key]['sid']
+            last_struct = hex_byte['struct']
+            last_sid = hex_byte['sid']
 
         if last_struct:
             self.close_div( indent=SummaryFormatter.INDENT_STRUCT )
 
+        self.write_limit( indent=SummaryFormatter.INDENT_STRUCT )
+
         self.close_div() # hex-fields
 
+
+class JSONFormatter( BytesFormatter ):
+
+    ''' Writes the stored field records as JSON, one object per line. If
+    parsing stopped at a limit, a last line gives its offset and reason
+    under limit_reached. '''
+
+    def __init__( self, out_file, parser : FileParser ):
+
+        super().__init__( out_file, parser )
+
+        self.last_offset = -1
+
+    def write_records( self, final : bool = True ):
+
+        ''' Write the records stored since the last call. Unless final,
+        hold back the last record, as it may still grow. '''
+
+        new_records = list(
+            self.parser.storage.records( self.last_offset + 1 ) )
+
+        if not final:
+            new_records = new_records[:-1]
+
+        for offset, record in new_records:
+            record = dict( record )
+            record['offset'] = offset
+            self.out_file.write( json.dumps( record ) + '\n' )
+            self.last_offset = offset
+
+        if final and self.parser.limit_reached:
+            self.out_file.write( json.dumps( {
+                'offset': self.parser.limit_reached['offset'],
+                'limit_reached': self.parser.limit_reached['reason']} ) + \
+                    '\n' )
+
+    def write_layout( self ):
+        self.write_records()
+
+class OverviewFormatter( BytesFormatter ):
+
+    ''' Writes an SVG picture of the whole file, with a cell for every
+    cell_bytes bytes colored by the struct covering most of it. Cells are
+    worked out from the parser's table of struct spans a span at a time, so
+    the time taken depends on the number of structs and cells rather than
+    the size of the file. Clicking a cell selects its struct in the hex
+    dump. '''
+
+    def __init__(
+        self, out_file, parser : FileParser, columns : int = 256,
+        rows : int = 64, cell_px : int = 3
+    ):
+
+        super().__init__( out_file, parser )
+
+        self.columns = columns
+        self.rows = rows
+        self.cell_px = cell_px
+
+    def cells( self ) -> tuple:
+
+        ''' Return the bytes per cell and the (struct, sid) covering the
+        most of each cell, or None where most of it is in no struct. '''
+
+        file_sz = max( len( self.parser.in_file ), self.parser.bytes_written )
+        cell_bytes = max( 1, -(-file_sz // (self.columns * self.rows)) )
+        num_cells = -(-file_sz // cell_bytes)
+
+        # Struct -> [bytes, first sid] for each cell with any structs.
+        cover = [None] * num_cells
+        for start, end, key, sid in self.struct_spans():
+            if end <= start:
+                continue
+            first = start // cell_bytes
+            last = (end - 1) // cell_bytes
+
+            if first == last:
+                # Most structs are smaller than a cell.
+                structs = cover[first]
+                if None == structs:
+                    cover[first] = {key: [end - start, sid]}
+                elif key in structs:
+                    structs[key][0] += end - start
+                else:
+                    structs[key] = [end - start, sid]
+                continue
+
+            # Structs don't overlap, so only the first and last cells of a
+            # span can be shared with others.
+            for cell, overlap in [
+                (first, (first + 1) * cell_bytes - start),
+                (last, end - last * cell_bytes)
+            ]:
+                if None == cover[cell]:
+                    cover[cell] = {}
+                if key in cover[cell]:
+                    cover[cell][key][0] += overlap
+                else:
+                    cover[cell][key] = [overlap, sid]
+            for cell in range( first + 1, last ):
+                cover[cell] = {key: [cell_bytes, sid]}
+
+        cells = []
+        for cell, structs in enumerate( cover ):
+            if not structs:
+                cells.append( None )
+                continue
+            key = max( structs, key=lambda x: structs[x][0] )
+            free = min( cell_bytes, file_sz - cell * cell_bytes ) - \
+                sum( [x[0] for x in structs.values()] )
+            cells.append(
+                None if free > structs[key][0] else (key, structs[key][1]) )
+
+        return cell_bytes, cells
+
+    def write_layout( self ):
+
+        cell_bytes, cells = self.cells()
+        rows = -(-len( cells ) // self.columns)
+
+        self.open_div( 'hex-overview' )
+        self.out_file.write(
+            ' <svg width="{}" height="{}" data-cell-bytes="{}">\n'.format(
+                self.columns * self.cell_px, rows * self.cell_px,
+                cell_bytes ) )
+
+        # Draw runs of cells in the same struct instance as one rect.
+        for row in range( rows ):
+            row_cells = cells[row * self.columns:(row + 1) * self.columns]
+            col = 0
+            while col < len( row_cells ):
+                run = 1
+                while col + run < len( row_cells ) and \
+                row_cells[col + run] == row_cells[col]:
+                    run += 1
+
+                if row_cells[col]:
+                    key, sid = row_cells[col]
+                    offset = (row * self.columns + col) * cell_bytes
+                    self.out_file.write(
+                        '  <rect x="{}" y="{}" width="{}" height="{}" ' \
+                        'fill="dimgray" class="hex-struct-{}" ' \
+                        'data-struct="hex-struct-{}-{}" data-offset="{}">' \
+                        '<title>{} {} @{} ({})</title></rect>\n'.format(
+                            col * self.cell_px, row * self.cell_px,
+                            run * self.cell_px, self.cell_px,
+                            self.format_class( key ), self.format_class( key ),
+                            sid, offset, key, sid, offset, hex( offset ) ) )
+
+                col += run
+
+        self.out_file.write( ' </svg>\n' )
+        self.close_div()
+
+class TermFormatter( BytesFormatter ):
+
+    ''' Writes a hexdump for a terminal, with offsets, bytes colored by
+    struct (alternating bold for its fields, dim for hidden bytes and bytes
+    in no field) and the stored fields starting on each line listed after
+    it. Lines are written as soon as their records are stored, so it can
+    keep up with a parse fed a chunk at a time. '''
+
+    COLORS = [31, 32, 33, 34, 35, 36, 91, 92, 93, 94, 95, 96]
+
+    HEX = ['{:02x}'.format( x ) for x in range( 256 )]
+
+    PRINTABLE = [chr( x ) if 32 <= x < 127 else '.' for x in range( 256 )]
+
+    # Longest field contents to list after a line.
+    CONTENTS_LEN = 24
+
+    def __init__(
+        self, out_file, parser : FileParser, column_len : int = 16,
+        color : bool = True
+    ):
+
+        super().__init__( out_file, parser )
+
+        self.column_len = column_len
+        self.color = color
+        self.buffer_pos = 0
+        self.gap_pos = 0
+        self.offset = 0
+        self.last_instance = None
+
+        self.struct_colors = {x: TermFormatter.COLORS[
+            idx % len( TermFormatter.COLORS )] \
+                for idx, x in enumerate( parser.format_data['structs'] )}
+        self.field_idx = {(x, y[0]): idx \
+            for x in parser.struct_fields \
+                for idx, y in enumerate( parser.struct_fields[x] )}
+        self.styles = {}
+
+    def _style( self, buf_tup : tuple ) -> str:
+
+        key = (buf_tup[1], buf_tup[3],
+            None if None == buf_tup[3] else buf_tup[4] % 2,
+            buf_tup[5]['hidden'])
+        if key in self.styles:
+            return self.styles[key]
+
+        if not buf_tup[1]:
+            style = '\x1b[0m'
+        elif not buf_tup[3] or buf_tup[5]['hidden']:
+            style = '\x1b[0;2;{}m'.format( self.struct_colors[buf_tup[1]] )
+        elif (self.field_idx[(buf_tup[1], buf_tup[3])] + buf_tup[4]) % 2:
+            style = '\x1b[0;1;{}m'.format( self.struct_colors[buf_tup[1]] )
+        else:
+            style = '\x1b[0;{}m'.format( self.struct_colors[buf_tup[1]] )
+
+        self.styles[key] = style
+        return style
+
+    def format_contents( self, record : dict ) -> str:
+        contents = record['contents']
+        if 'color' == record['format'] and int == type( contents ):
+            contents = '#{:06x}'.format( contents )
+        elif str == type( contents ):
+            contents = repr( contents )
+        else:
+            contents = str( contents )
+        if len( contents ) > TermFormatter.CONTENTS_LEN:
+            contents = contents[:TermFormatter.CONTENTS_LEN - 3] + '...'
+        return contents
+
+    def write_line( self, offset : int, line : list, records : list ):
+
+        ''' Write a line of buffer entries starting at the given offset, and
+        the given (offset, record) pairs starting on it. '''
+
+        out = ['{:08x} '.format( offset )]
+        last_style = None
+        for idx, buf_tup in enumerate( line ):
+            out.append( '  ' if 8 == idx else ' ' )
+            if self.color:
+                style = self._style( buf_tup )
+                if style != last_style:
+                    out.append( style )
+                    last_style = style
+            out.append( TermFormatter.HEX[buf_tup[0]] )
+        if last_style:
+            out.append( '\x1b[0m' )
+
+        # Pad short lines so the rest lines up.
+        missing = self.column_len - len( line )
+        out.append( '   ' * missing + \
+            (' ' if len( line ) <= 8 < self.column_len else '') )
+
+        out.append( '  |' + ''.join(
+            [TermFormatter.PRINTABLE[x[0]] for x in line] ) + \
+                '|' + ' ' * missing )
+
+        for record_offset, record in records:
+            note = []
+            instance = (record['struct'], record['sid'])
+            if instance != self.last_instance:
+                note.append( '[{}]'.format( record['struct'] ) )
+                self.last_instance = instance
+            if 'no_fields' != record['summarize']:
+                note.append( '{}={}'.format(
+                    record['field'], self.format_contents( record ) ) )
+            if not note:
+                continue
+            note = ' '.join( note )
+            if self.color:
+                note = '\x1b[{}m{}\x1b[0m'.format(
+                    self.struct_colors[record['struct']], note )
+            out.append( ' ' + note )
+
+        out.append( '\n' )
+        self.out_file.write( ''.join( out ) )
+
+    def write_bytes( self, final : bool = True ):
+
+        ''' Write the lines of bytes added to the parser buffer since the
+        last call. Unless final, hold back lines from the start of the
+        struct still being parsed, as its records aren't stored yet. '''
+
+        buffer = self.parser.buffer
+        gaps = self.parser.buffer_gaps
+
+        hold_from = sys.maxsize
+        if not final:
+            hold_from = self.parser.bytes_written
+            if self.parser.spans_open:
+                hold_from -= self.parser.spans_open[0].bytes_written
+
+        records = self.parser.storage.records( self.offset )
+        record = next( records, None )
+
+        while self.buffer_pos < len( buffer ):
+            if self.gap_pos < len( gaps ) and \
+            gaps[self.gap_pos][0] == self.buffer_pos:
+                self.offset = gaps[self.gap_pos][1]
+                self.gap_pos += 1
+
+            # Lines end early at gaps.
+            line_len = min( self.column_len, len( buffer ) - self.buffer_pos )
+            if self.gap_pos < len( gaps ):
+                line_len = min( line_len,
+                    gaps[self.gap_pos][0] - self.buffer_pos )
+            if self.offset + line_len > hold_from or (not final and \
+            line_len < self.column_len and \
+            self.buffer_pos + line_len == len( buffer )):
+                break
+
+            line_records = []
+            while record and record[0] < self.offset + line_len:
+                if record[0] >= self.offset:
+                    line_records.append( record )
+                record = next( records, None )
+
+            self.write_line( self.offset,
+                buffer[self.buffer_pos:self.buffer_pos + line_len],
+                line_records )
+
+            self.buffer_pos += line_len
+            self.offset += line_len
+
+    def write_tail( self ):
+
+        limit = self.parser.limit_reached
+        if limit:
+            self.out_file.write( '-- parsing stopped @{} ({}): {}\n'.format(
+                limit['offset'], hex( limit['offset'] ), limit['reason'] ) )
+
+    def write_layout( self ):
+        self.write_bytes()
+        self.write_tail()
+
+class LazyFormatter( BytesFormatter ):
+
+    ''' Writes a page that only holds where to find a sidecar data file,
+    from which a table of struct instances is loaded a page of rows at a
+    time, and each instance's fields and bytes when it is expanded, so the
+    page is the same size for any file.
+
+    The data file is ASCII, so offsets into it are the same in bytes and
+    characters. It holds a JSON line for each instance's fields and bytes,
+    followed by an index of JSON lines all padded to the same length, one
+    per instance with its struct, sid, offset, size and the offset and
+    length of its line. Any part of it can be read with a range request
+    (or mmap) without reading the rest. '''
+
+    # Bytes of an instance included in its line.
+    MAX_INSTANCE_BYTES = 4096
+
+    # Rows of the table loaded at a time.
+    PAGE_ROWS = 256
+
+    def __init__(
+        self, out_file, parser : FileParser, data_file, data_href : str
+    ):
+
+        super().__init__( out_file, parser )
+
+        # Opened for binary writing.
+        self.data_file = data_file
+        self.data_href = data_href
+
+    def write_data( self ) -> tuple:
+
+        ''' Write the data file and return the offset of its index, the
+        length of each index line and the number of instances. '''
+
+        rows = []
+        pos = 0
+        records = iter( self.parser.storage.records() )
+        record = next( records, None )
+        for start, end, struct, sid in self.struct_spans():
+
+            # Only list instances in the selected range and structs, with
+            # their bytes clipped to the range.
+            if self.parser.filtered:
+                if self.parser.select_structs and \
+                not struct in self.parser.select_structs:
+                    continue
+                start = max( start, self.parser.select_start )
+                end = min( end, self.parser.select_end )
+                if end <= start:
+                    continue
+
+            # Records and spans are both in offset order.
+            fields = []
+            while record and record[0] < end:
+                offset, field = record
+                if field['struct'] == struct and field['sid'] == sid:
+                    fields.append( [field['field'], field['fid'], offset,
+                        field['size'], field['contents'], field['format']] )
+                record = next( records, None )
+
+            line = json.dumps( {
+                'fields': fields,
+                'bytes': bytes( self.parser.in_file[start:min( end,
+                    start + LazyFormatter.MAX_INSTANCE_BYTES )] ).hex(),
+                'truncated': end - start > LazyFormatter.MAX_INSTANCE_BYTES},
+                default=repr ).encode( 'ascii' ) + b'\n'
+            self.data_file.write( line )
+            rows.append( json.dumps(
+                [struct, sid, start, end - start, pos, len( line )] ) )
+            pos += len( line )
+
+        row_len = max( [len( x ) for x in rows] ) + 1 if rows else 1
+        for row in rows:
+            self.data_file.write(
+                (row.ljust( row_len - 1 ) + '\n').encode( 'ascii' ) )
+
+        return pos, row_len, len( rows )
+
+    def write_layout( self ):
+
+        index_offset, row_len, rows = self.write_data()
+
+        self.out_file.write( '<div class="hex-lazy" data-href="{}" ' \
+            'data-index="{}" data-row-len="{}" data-rows="{}" ' \
+            'data-page-rows="{}"></div>\n'.format(
+                html.escape( self.data_href ), index_offset, row_len, rows,
+                LazyFormatter.PAGE_ROWS ) )
+
+        self.write_limit()
+
+def render_outputs( renders : list, workers : int = 0 ):
+
+    ''' Call each of the given functions, which each write an output from
+    the same finished parse. With more than one worker, up to that many run
+    at once, each in a forked process sharing the parse with this one
+    rather than copying it, so anything they write to must be flushed
+    first. Falls back to one after another where processes can't be
+    forked. '''
+
+    if 1 >= workers or \
+    not 'fork' in multiprocessing.get_all_start_methods():
+        for render in renders:
+            render()
+        return
+
+    context = multiprocessing.get_context( 'fork' )
+    running = deque()
+    failed = 0
+    for render in renders:
+        if len( running ) >= workers:
+            running[0].join()
+            failed += 0 != running.popleft().exitcode
+        process = context.Process( target=render )
+        process.start()
+        running.append( process )
+
+    while running:
+        running[0].join()
+        failed += 0 != running.popleft().exitcode
+
+    if failed:
+        raise RuntimeError( '{} output(s) failed to render'.format( failed ) )
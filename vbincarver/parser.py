@@ -1,11 +1,158 @@
 
+import sys
+import math
+import time
 import logging
 import re
+import bisect
 import pprint
 from collections import OrderedDict
+from .config import ConfigException
+
+class TraceLogger( object ):
+
+    ''' Logger for code run for every byte parsed. Whether it would log
+    debug messages is cached in on, so callers can skip building messages
+    with a single test. The cache is refreshed whenever a FileParser is
+    created, or by calling refresh() after changing log levels. '''
+
+    instances = []
+
+    def __init__( self, name : str ):
+        self.logger = logging.getLogger( name )
+        self.on = False
+        TraceLogger.instances.append( self )
+
+    @staticmethod
+    def refresh():
+        for trace_logger in TraceLogger.instances:
+            trace_logger.on = trace_logger.logger.isEnabledFor( logging.DEBUG )
+
+    def debug( self, *args ):
+        self.logger.debug( *args )
+
+    def warning( self, *args ):
+        self.logger.warning( *args )
+
+    def error( self, *args ):
+        self.logger.error( *args )
+
+_trace_storage_get = TraceLogger( 'storage.get' )
+_trace_storage_store = TraceLogger( 'storage.store' )
+_trace_chunk_dump = TraceLogger( 'chunk.dump' )
+_trace_chunk_push = TraceLogger( 'chunk.push' )
+_trace_add_span = TraceLogger( 'parser.add.span' )
+_trace_add_field = TraceLogger( 'parser.add.field' )
+_trace_last_field = TraceLogger( 'parser.set.last_field' )
+_trace_close_span = TraceLogger( 'parser.close_span' )
+_trace_match_byte = TraceLogger( 'parser.match.byte' )
+_trace_select_struct = TraceLogger( 'parser.select.span.struct' )
+_trace_select_field = TraceLogger( 'parser.select.span.field' )
+_trace_repeats = TraceLogger( 'parser.repeats.field' )
+_trace_skip = TraceLogger( 'parser.skip' )
+_trace_parse_byte = TraceLogger( 'parser.parse.byte' )
+
+def find_changed_range( old_data, new_data ) -> tuple:
+
+    ''' Return the (start, end) range of new_data that differs from
+    old_data, or None if they are the same. '''
+
+    if old_data == new_data:
+        return None
+
+    old_view = memoryview( old_data )
+    new_view = memoryview( new_data )
+    common = min( len( old_view ), len( new_view ) )
+
+    # Skip the common prefix and suffix a block at a time.
+    block = 65536
+    start = 0
+    while start < common and \
+    old_view[start:start + block] == new_view[start:start + block]:
+        start += block
+    while start < common and old_view[start] == new_view[start]:
+        start += 1
+
+    old_len = len( old_view )
+    new_len = len( new_view )
+    end = 0
+    while end + block <= common - start and \
+    old_view[old_len - end - block:old_len - end] == \
+    new_view[new_len - end - block:new_len - end]:
+        end += block
+    while end < common - start and \
+    old_view[old_len - end - 1] == new_view[new_len - end - 1]:
+        end += 1
+
+    return (start, new_len - end)
+
+class _ParserConverged( Exception ):
+
+    ''' Raised during FileParser.reparse() when the parser state matches a
+    checkpoint from the previous parse. '''
+
+    def __init__( self, checkpoint : dict ):
+        super().__init__()
+        self.checkpoint = checkpoint
+
+class _ParseLimitReached( Exception ):
+
+    ''' Raised when a FileParser goes over one of its ParseLimits. '''
+
+    def __init__( self, reason : str ):
+        super().__init__( reason )
+        self.reason = reason
+
+class NeedMoreInput( Exception ):
+
+    ''' Raised by a struct decoder when the input so far ends before the
+    struct does. '''
+
+class ParseLimits( object ):
+
+    ''' Limits on the work a FileParser may do, so a bogus count or size in
+    an untrusted file can't keep it repeating fields or growing forever.
+    Each limit is off if None. Once one is reached, parsing stops and what
+    was parsed up to there is kept, with the offset and reason noted in the
+    parser's limit_reached. '''
+
+    # Bytes parsed between checks of the memory and time limits.
+    CHECK_INTERVAL = 4096
+
+    def __init__(
+        self, max_repeats : int = None, max_structs : int = None,
+        max_records : int = None, max_memory : int = None,
+        max_time : float = None
+    ):
+
+        # Most times a single field may repeat in one struct.
+        self.max_repeats = max_repeats
+
+        # Most struct instances in the whole file.
+        self.max_structs = max_structs
+
+        # Most field records stored.
+        self.max_records = max_records
+
+        # Approximate memory held by the parser, in bytes.
+        self.max_memory = max_memory
+
+        # Wall clock seconds since the parse started.
+        self.max_time = max_time
+
+    def periodic( self ) -> bool:
+
+        ''' Return True if any limits must be checked as bytes are parsed.
+        '''
+
+        return None != self.max_memory or None != self.max_time
 
 class FileParserStorage( object ):
 
+    # Whether take_records() and truncate_fields() can rewind the storage,
+    # as reparse() needs.
+    REWINDABLE = True
+
     def __init__( self ):
         self.field_storage = {}
         self.byte_storage = OrderedDict()
@@ -17,9 +164,10 @@ class FileParserStorage( object ):
 
     def get_field( self, struct_key : str, field_key : str ):
         
-        logger = logging.getLogger( 'storage.get' )
+        logger = _trace_storage_get
 
-        logger.debug( 'getting field: %s/%s', struct_key, field_key )
+        if logger.on:
+            logger.debug( 'getting field: %s/%s', struct_key, field_key )
 
         # We don't process the #-replacer here, so ditch it for now.
         field_key = re.sub( '#.*', '', field_key )
@@ -27,21 +175,25 @@ class FileParserStorage( object ):
         try:
             return self.field_storage[struct_key]['fields'][field_key]
         except KeyError as e:
-            logger.warn( 'struct or field not found: %s', e )
+            logger.warning( 'struct or field not found: %s', e )
             return []
 
     def store_field(
         self, struct_key : str, field_key : str,
         contents : int, mod_contents : str
     ):
-        logger = logging.getLogger( 'storage.store' )
+        logger = _trace_storage_store
 
         contents = eval( mod_contents,
             {}, {'field_contents': contents } )
 
-        logger.debug( 'storing field %s/%s contents %s...',
-            struct_key, field_key, str( contents ) )
+        if logger.on:
+            logger.debug( 'storing field %s/%s contents %s...',
+                struct_key, field_key, str( contents ) )
+
+        self._append_field( struct_key, field_key, contents )
 
+    def _append_field( self, struct_key : str, field_key : str, contents ):
         if struct_key in self.field_storage:
             if field_key in self.field_storage[struct_key]['fields']:
                 self.field_storage[struct_key]['fields'][field_key].append(
@@ -53,46 +205,236 @@ class FileParserStorage( object ):
             self.field_storage[struct_key] = \
                 {'fields': {field_key: [contents]}}
 
+    def set_hot_fields( self, fields : set ):
+
+        ''' Note the struct/field keys the parser will look up with
+        get_field(). Storage that doesn't keep everything in memory should
+        keep these handy. '''
+
+        pass
+
     def store_offset(
         self, offset : int, sz : int, struct : str, field : str, fid : int,
         contents : int, mod_contents : str, sid : int, summarize : str,
         format_in : str, lsbf_in : bool
     ):
-        prev_offset = list( self.byte_storage.items() )
-
         contents = eval( mod_contents,
             {}, {'field_contents': contents } )
 
+        prev_record = self._last_record()
+
         if 'sum_repeat' == summarize and \
-        0 < len( self.byte_storage ) and \
-        prev_offset[-1][1]['field'] == field and \
-        prev_offset[-1][1]['struct'] == struct and \
-        prev_offset[-1][1]['sid'] == sid:
-            self.byte_storage[prev_offset[-1][0]]['size'] += sz
+        None != prev_record and \
+        prev_record['field'] == field and \
+        prev_record['struct'] == struct and \
+        prev_record['sid'] == sid:
+            prev_record['size'] += sz
             if 'string' == format_in:
                 # Try to build a string out of discrete bytes.
-                self.byte_storage[prev_offset[-1][0]]['contents'] += \
-                    contents
+                prev_record['contents'] += contents
             else:
                 # Don't sum number contents, the result is garbage.
-                self.byte_storage[prev_offset[-1][0]]['contents'] = None
+                prev_record['contents'] = None
+            self._count_size( struct, sid, sz )
 
         elif 'first_only' == summarize and \
-        struct in self.byte_storage_idx and \
-        not sid in self.byte_storage_idx[struct]:
+        self._skip_instance( struct, sid ):
             return
 
         else:
-            if struct in self.byte_storage_idx and \
-            not sid in self.byte_storage_idx[struct]:
-                self.byte_storage_idx[struct][sid] = offset
-            elif not struct in self.byte_storage_idx:
-                self.byte_storage_idx[struct] = {sid: offset}
-
-            self.byte_storage[offset] = {'struct': struct, 'size': sz,
+            self._add_record( offset, {'struct': struct, 'size': sz,
                 'sid': sid, 'field': field, 'fid': fid,
                 'contents': contents, 'summarize': summarize, 
-                'format': format_in, 'lsbf': lsbf_in}
+                'format': format_in, 'lsbf': lsbf_in} )
+
+    def _last_record( self ) -> dict:
+        if not self.byte_storage:
+            return None
+        return self.byte_storage[next( reversed( self.byte_storage ) )]
+
+    def _skip_instance( self, struct : str, sid : int ) -> bool:
+
+        ''' Return True if records for the given struct are only stored
+        for its first instance, and this isn't it. '''
+
+        return struct in self.byte_storage_idx and \
+            not sid in self.byte_storage_idx[struct]
+
+    def _count_size( self, struct : str, sid : int, sz : int ):
+        self.sz_storage[(struct, sid)] = \
+            self.sz_storage.get( (struct, sid), 0 ) + sz
+
+    def _add_record( self, offset : int, record : dict ):
+        if record['struct'] in self.byte_storage_idx:
+            if not record['sid'] in self.byte_storage_idx[record['struct']]:
+                self.byte_storage_idx[record['struct']][record['sid']] = \
+                    offset
+        else:
+            self.byte_storage_idx[record['struct']] = {record['sid']: offset}
+
+        self.byte_storage[offset] = record
+        self._count_size( record['struct'], record['sid'], record['size'] )
+
+    def records( self, start : int = 0 ):
+
+        ''' Yield stored (offset, record) pairs in offset order, starting
+        from the given offset. '''
+
+        if 0 >= start:
+            yield from self.byte_storage.items()
+            return
+
+        # Records are stored in offset order, so walk back to the start.
+        offsets = []
+        for offset in reversed( self.byte_storage ):
+            if offset < start:
+                break
+            offsets.append( offset )
+        for offset in reversed( offsets ):
+            yield offset, self.byte_storage[offset]
+
+    def get_record( self, offset : int ) -> dict:
+        return self.byte_storage.get( offset )
+
+    def record_count( self ) -> int:
+        return len( self.byte_storage )
+
+    def held_record_count( self ) -> int:
+
+        ''' Return the number of records held in memory. '''
+
+        return self.record_count()
+
+    def field_count( self ) -> int:
+
+        ''' Return the number of field values stored. '''
+
+        return sum( [len( y ) for x in self.field_storage.values() \
+            for y in x['fields'].values()] )
+
+    def struct_size( self, struct : str, sid : int ) -> int:
+
+        ''' Return the total size of the stored records of a struct
+        instance. '''
+
+        return self.sz_storage.get( (struct, sid), 0 )
+
+    def close( self ):
+
+        ''' Write out anything not yet stored once parsing is done. '''
+
+        pass
+
+    def take_records( self ) -> OrderedDict:
+
+        ''' Return the stored records and start over with none. '''
+
+        records = self.byte_storage
+        self.byte_storage = OrderedDict()
+        return records
+
+    def field_lengths( self ) -> dict:
+
+        ''' Return the number of values stored for each struct/field. '''
+
+        return {(x, y): len( self.field_storage[x]['fields'][y] ) \
+            for x in self.field_storage \
+                for y in self.field_storage[x]['fields'] \
+                    if self.field_storage[x]['fields'][y]}
+
+    def truncate_fields( self, lengths : dict ) -> dict:
+
+        ''' Cut stored field values back to the given lengths, returning
+        the values that were cut off. '''
+
+        tails = {}
+        for struct_key in self.field_storage:
+            fields = self.field_storage[struct_key]['fields']
+            for field_key in fields:
+                keep = lengths.get( (struct_key, field_key), 0 )
+                tails[(struct_key, field_key)] = fields[field_key][keep:]
+                del fields[field_key][keep:]
+
+        # Drop emptied entries so the storage matches a fresh parse.
+        for struct_key in list( self.field_storage ):
+            fields = self.field_storage[struct_key]['fields']
+            for field_key in list( fields ):
+                if not fields[field_key]:
+                    del fields[field_key]
+            if not fields:
+                del self.field_storage[struct_key]
+
+        return tails
+
+    def restore_fields( self, tails : dict, skip_lengths : dict ):
+
+        ''' Append field values cut off by truncate_fields(), skipping
+        as many of each as given in skip_lengths. '''
+
+        for key in tails:
+            if not tails[key][skip_lengths.get( key, 0 ):]:
+                continue
+            if not key[0] in self.field_storage:
+                self.field_storage[key[0]] = {'fields': {}}
+            fields = self.field_storage[key[0]]['fields']
+            if not key[1] in fields:
+                fields[key[1]] = []
+            fields[key[1]].extend( tails[key][skip_lengths.get( key, 0 ):] )
+
+    def rebuild_index( self ):
+        self.byte_storage_idx = {}
+        self.sz_storage = {}
+        for offset in self.byte_storage:
+            record = self.byte_storage[offset]
+            self._count_size( record['struct'], record['sid'], record['size'] )
+            if not record['struct'] in self.byte_storage_idx:
+                self.byte_storage_idx[record['struct']] = {}
+            if not record['sid'] in self.byte_storage_idx[record['struct']]:
+                self.byte_storage_idx[record['struct']][record['sid']] = \
+                    offset
+
+    def splice_records(
+        self, old_records : OrderedDict, start : int, end : int = None
+    ):
+
+        ''' Make byte_storage the old records, with those between the start
+        and end offsets (or all from start if end is None) replaced by the
+        records currently in byte_storage. '''
+
+        new_records = self.byte_storage
+
+        if None != end:
+            old_keys = [x for x in range( start, end ) if x in old_records]
+            if old_keys == list( new_records ):
+                # Same layout, so just swap the records in place.
+                reindex = False
+                for key in old_keys:
+                    if old_records[key]['struct'] != \
+                    new_records[key]['struct'] or \
+                    old_records[key]['sid'] != new_records[key]['sid']:
+                        reindex = True
+                    else:
+                        # The new record's size was counted as it was stored.
+                        self._count_size( old_records[key]['struct'],
+                            old_records[key]['sid'],
+                            -old_records[key]['size'] )
+                    old_records[key] = new_records[key]
+                self.byte_storage = old_records
+                if reindex:
+                    self.rebuild_index()
+                return
+
+        self.byte_storage = OrderedDict()
+        for key in old_records:
+            if key >= start:
+                break
+            self.byte_storage[key] = old_records[key]
+        self.byte_storage.update( new_records )
+        if None != end:
+            for key in old_records:
+                if key >= end:
+                    self.byte_storage[key] = old_records[key]
+        self.rebuild_index()
 
 class ChunkFinder( object ):
 
@@ -110,25 +452,27 @@ class ChunkFinder( object ):
 
     def dump( self ):
 
-        logger = logging.getLogger( 'chunk.dump' )
-
-        logger.debug( 'buffer (len %d) starting at %d is now %s%s%s%s...',
-            len( self.magic_buf ),
-            self.start_offset,
-            hex( ord( self.magic_buf[0] ) ) + ' ' \
-                if len( self.magic_buf ) > 0 else '',
-            hex( ord( self.magic_buf[1] ) ) + ' ' \
-                if len( self.magic_buf ) > 1 else '',
-            hex( ord( self.magic_buf[2] ) ) + ' ' \
-                if len( self.magic_buf ) > 2 else '',
-            hex( ord( self.magic_buf[3] ) ) \
-                if len( self.magic_buf ) > 3 else '' )
+        logger = _trace_chunk_dump
+
+        if logger.on:
+            logger.debug( 'buffer (len %d) starting at %d is now %s%s%s%s...',
+                len( self.magic_buf ),
+                self.start_offset,
+                hex( ord( self.magic_buf[0] ) ) + ' ' \
+                    if len( self.magic_buf ) > 0 else '',
+                hex( ord( self.magic_buf[1] ) ) + ' ' \
+                    if len( self.magic_buf ) > 1 else '',
+                hex( ord( self.magic_buf[2] ) ) + ' ' \
+                    if len( self.magic_buf ) > 2 else '',
+                hex( ord( self.magic_buf[3] ) ) \
+                    if len( self.magic_buf ) > 3 else '' )
 
     def push( self, c : int ) -> int:
 
-        logger = logging.getLogger( 'chunk.push' )
+        logger = _trace_chunk_push
 
-        logger.debug( 'pushing %s on buffer...', hex( c ) )
+        if logger.on:
+            logger.debug( 'pushing %s on buffer...', hex( c ) )
         
         # Only push positive bytes.
         if 0 <= c:
@@ -158,140 +502,391 @@ class ChunkFinder( object ):
         else:
             return -1
 
+class StructSpan( object ):
+
+    ''' A struct instance being parsed. Its definition is shared and left
+    alone, so which of its fields are still to come, how many times each
+    was written and what each last held are kept here, by index into the
+    struct's fields in order. '''
+
+    type = 'struct'
+
+    __slots__ = ['key', 'struct_def', 'fields', 'sid', 'bytes_written',
+        'last_field', 'counts', 'last_contents', 'removed', 'first', 'left']
+
+    def __init__(
+        self, key : str, struct_def : dict, fields : list, sid : int
+    ):
+        self.key = key
+        self.struct_def = struct_def
+        self.fields = fields
+        self.sid = sid
+        self.bytes_written = 0
+
+        # Index of the field written last, if any.
+        self.last_field = None
+
+        self.counts = [0] * len( fields )
+        self.last_contents = [None] * len( fields )
+
+        # Bits of fields written or ruled out, first field still to come
+        # and how many are.
+        self.removed = 0
+        self.first = 0
+        self.left = len( fields )
+
+    def remaining( self ):
+
+        ''' Yield the indexes of the fields still to come, in order. '''
+
+        for idx in range( self.first, len( self.fields ) ):
+            if not self.removed >> idx & 1:
+                yield idx
+
+    def remove( self, idx : int ):
+
+        ''' Note the given field won't be selected again. '''
+
+        if self.removed >> idx & 1:
+            return
+
+        self.removed |= 1 << idx
+        self.left -= 1
+        while self.first < len( self.fields ) and \
+        self.removed >> self.first & 1:
+            self.first += 1
+
+    @property
+    def fields_written( self ) -> dict:
+        return {self.fields[x][0]: {
+            'counts_written': self.counts[x],
+            'last_contents': self.last_contents[x]} \
+                for x in range( len( self.fields ) ) if self.counts[x]}
+
+    def __getitem__( self, key : str ):
+
+        # Grammar count_mod expressions look up the struct as a dict.
+        return getattr( self, key )
+
+class FieldSpan( object ):
+
+    ''' A field instance being parsed, with its definition shared. '''
+
+    type = 'field'
+
+    __slots__ = ['key', 'field_def', 'idx', 'counts_written', 'contents',
+        'bytes_written']
+
+    def __init__(
+        self, key : str, field_def : dict, idx : int, counts_written : int
+    ):
+        self.key = key
+        self.field_def = field_def
+        self.idx = idx
+        self.counts_written = counts_written
+        self.contents = None
+        self.bytes_written = 0
+
 class FileParser( object ):
 
-    def __init__( self, in_file, format_data : dict ):
+    # Smallest run of unselected bytes worth skipping over in one step.
+    SKIP_MIN = 16
+
+    # Rough per-item costs of the buffer's tuples and records, in bytes.
+    BUFFER_ENTRY_SZ = 400
+    RECORD_SZ = 600
+
+    def __init__(
+        self, in_file, format_data : dict, checkpoint_interval : int = 0,
+        start : int = 0, length : int = None, structs : list = None,
+        storage : FileParserStorage = None, limits : ParseLimits = None,
+        keep_buffer : bool = True
+    ):
+
+        TraceLogger.refresh()
 
         self.bytes_written = 0
+        self.bytes_read = 0
         self.last_struct = ''
         self.last_struct_match_miss = []
-        self.last_field = None
         self.spans_open = []
         self.in_file = in_file
         self.format_data = format_data
-        self.storage = FileParserStorage()
+
+        # Instances parsed of each struct, and each struct's fields in order.
+        self.struct_counts = {x: 0 for x in format_data['structs']}
+        self.struct_fields = {x: list(
+            format_data['structs'][x]['fields'].items() ) \
+                for x in format_data['structs']}
+        self.storage = storage if storage else FileParserStorage()
         self.buffer = []
+
+        if checkpoint_interval and not self.storage.REWINDABLE:
+            raise ConfigException( '{} cannot be rewound for reparsing; ' \
+                'use it without checkpoints'.format(
+                    type( self.storage ).__name__ ) )
+
+        # Without the buffer, only records and counts are kept, e.g. for
+        # stats that never render the bytes.
+        self.keep_buffer = keep_buffer
+
+        # (start, end, struct, sid) of each struct instance closed, in order.
+        self.struct_spans = []
+
         self.chunk_finder = ChunkFinder( self,
                 format_data['chunk_size'],
                 format_data['chunk_type_offset'] )
 
-    def _add_span( self, type_in : str, class_in : str ):
-        logger = logging.getLogger( 'parser.add.span' )
-        logger.debug( 'adding span for %s: %s',
-            type_in, class_in )
-        span = {
-            'class': class_in,
-            'type': type_in,
-            'bytes_written': 0
+        # Field repeats parsed (or skipped), for stats.
+        self.repeats_parsed = 0
+
+        # Struct instances closed, the total of struct_counts.
+        self.structs_parsed = 0
+
+        # Where and why parsing stopped early, if it did.
+        self.limits = limits if limits else ParseLimits()
+        self.limit_reached = None
+        self.parse_started = time.monotonic()
+        self.next_limit_check = ParseLimits.CHECK_INTERVAL \
+            if self.limits.periodic() else sys.maxsize
+
+        # Snapshots of parser state at struct boundaries, for reparse().
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = []
+        self.next_checkpoint = 0 if checkpoint_interval else sys.maxsize
+        self.dependent_fields = self._find_dependent_fields()
+        self.storage.set_hot_fields( self.dependent_fields )
+        self._replay = None
+
+        # Only keep bytes and records within the selected range and structs.
+        self.select_start = start
+        self.select_end = start + length if None != length else sys.maxsize
+        self.select_structs = set( structs ) if structs else None
+        self.filtered = 0 < start or None != length or None != structs
+        self.buffer_gaps = []
+        self._last_buffered = -1
+        assert( not (self.filtered and checkpoint_interval) )
+
+        # Input before this offset was already parsed by a struct decoder.
+        self.skip_input = 0
+
+        # Decoders wait for more input until parse() or finish() is called.
+        self.input_complete = False
+        self.decode_waiting = False
+
+    def _find_dependent_fields( self ) -> set:
+
+        ''' Return the struct/field keys whose stored contents the grammar
+        refers to, and so can change how later bytes are parsed. '''
+
+        dependent_fields = set()
+
+        def add_field_ref( field_ref : list ):
+            dependent_fields.add(
+                (field_ref[0], re.sub( '#.*', '', field_ref[1] )) )
+
+        for struct_key in self.format_data['structs']:
+            struct = self.format_data['structs'][struct_key]
+            for ref_key in ['count_field', 'offset_field']:
+                if ref_key in struct:
+                    add_field_ref( struct[ref_key] )
+            for field_key in struct['fields']:
+                field = struct['fields'][field_key]
+                for ref_key in ['count_field', 'match_field']:
+                    if ref_key in field:
+                        add_field_ref( field[ref_key] )
+
+                # Count expressions may look at earlier fields in the struct.
+                for ref_field in re.findall(
+                    r'fields_written\'\]\[\'(\w+)\'',
+                    str( field.get( 'count_mod', '' ) )
+                ):
+                    add_field_ref( [struct_key, ref_field] )
+
+        return dependent_fields
+
+    def _checkpoint_state( self ) -> dict:
+        return {
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'spans_open': list( self.spans_open ),
+            'last_struct': self.last_struct,
+            'last_struct_match_miss': list( self.last_struct_match_miss ),
+            'struct_counts': dict( self.struct_counts ),
+            'magic_buf': self.chunk_finder.magic_buf,
+            'start_offset': self.chunk_finder.start_offset,
+            'field_lens': self.storage.field_lengths()
         }
+
+    def _restore_state( self, checkpoint : dict ):
+        self.bytes_read = checkpoint['bytes_read']
+        self.bytes_written = checkpoint['bytes_written']
+        self.spans_open = list( checkpoint['spans_open'] )
+        self.last_struct = checkpoint['last_struct']
+        self.last_struct_match_miss = \
+            list( checkpoint['last_struct_match_miss'] )
+        self.struct_counts = dict( checkpoint['struct_counts'] )
+        self.structs_parsed = sum( self.struct_counts.values() )
+        self.chunk_finder.magic_buf = checkpoint['magic_buf']
+        self.chunk_finder.start_offset = checkpoint['start_offset']
+
+        # Checkpoints are never taken inside decoded structs.
+        self.skip_input = 0
+
+    def _converges( self, state : dict, checkpoint : dict ) -> bool:
+
+        ''' Return True if the current state (from _checkpoint_state()) is
+        the same as the given checkpoint of the previous parse. '''
+
+        for key in ['bytes_written', 'last_struct', 'last_struct_match_miss',
+        'struct_counts', 'magic_buf', 'start_offset', 'field_lens']:
+            if state[key] != checkpoint[key]:
+                return False
+
+        # Fields the grammar refers to must have been re-read the same.
+        resume_lens = self._replay['resume']['field_lens']
+        for key in self.dependent_fields:
+            skip = resume_lens.get( key, 0 )
+            if self.storage.field_storage.get( key[0], {'fields': {}} ) \
+                ['fields'].get( key[1], [] )[skip:] != \
+            self._replay['field_tails'].get( key, [] ) \
+                [:checkpoint['field_lens'].get( key, 0 ) - skip]:
+                return False
+
+        return True
+
+    def _reach_checkpoint( self ):
+
+        ''' Called at struct boundaries once next_checkpoint is reached, to
+        record a checkpoint and/or check if a reparse has converged. '''
+
+        logger = logging.getLogger( 'parser.checkpoint' )
+
+        state = None
+
+        if self._replay and self.bytes_read >= self._replay['changed_end']:
+            old_checkpoint = \
+                self._replay['checkpoints'].get( self.bytes_read )
+            if old_checkpoint:
+                state = self._checkpoint_state()
+                if self._converges( state, old_checkpoint ):
+                    raise _ParserConverged( old_checkpoint )
+
+        if not self.checkpoints or self.bytes_read >= \
+        self.checkpoints[-1]['bytes_read'] + self.checkpoint_interval:
+            logger.debug( 'recording checkpoint at %d...', self.bytes_read )
+            self.checkpoints.append(
+                state if state else self._checkpoint_state() )
+
+        self.next_checkpoint = \
+            self.checkpoints[-1]['bytes_read'] + self.checkpoint_interval
+        if self._replay:
+            # Look for convergence at every struct boundary after the change.
+            self.next_checkpoint = min( self.next_checkpoint,
+                max( self.bytes_read + 1, self._replay['changed_end'] ) )
+
+    def _add_span( self, span ):
+        logger = _trace_add_span
+        if logger.on:
+            logger.debug( 'adding span for %s: %s',
+                span.type, span.key )
         self.spans_open.append( span )
         assert( len( self.spans_open ) < 3 )
         return span
 
-    def _set_last_field( self, field_tuple : tuple ):
-        logger = logging.getLogger( 'parser.set.last_field' )
-        logger.debug( 'resetting last field to %s (was %s)...',
-            field_tuple[0] if field_tuple else None,
-            self.last_field[0] if self.last_field else None )
-        self.last_field = field_tuple
+    def _set_last_field( self, struct : StructSpan, idx : int ):
+        logger = _trace_last_field
+        if logger.on:
+            logger.debug( 'resetting last field to %s (was %s)...',
+                struct.fields[idx][0],
+                struct.fields[struct.last_field][0] \
+                    if None != struct.last_field else None )
+        struct.last_field = idx
 
-    def add_span_struct( self, class_in : str, **kwargs ):
+    def add_span_struct( self, class_in : str ):
         
-        logger = logging.getLogger( 'parser.add.struct' )
-
         for span in self.spans_open:
-            assert( 'struct' != span['class'] )
+            assert( 'struct' != span.key )
+
+        self._check_structs()
 
         self.last_struct = class_in
         self.last_struct_match_miss = []
 
-        self._set_last_field( None )
+        self._add_span( StructSpan( class_in,
+            self.format_data['structs'][class_in],
+            self.struct_fields[class_in], self.struct_counts[class_in] ) )
 
-        span = self._add_span( 'struct', class_in )
-        assert( 'fields' in kwargs )
-        span['fields'] = dict( kwargs['fields'] ) # Copy!
-        span['summarize'] = kwargs['summarize']
-        for field in span['fields']:
-            span['fields'][field]['counts_written'] = 0
-        if 'check_size' in kwargs:
-            span['check_size'] = kwargs['check_size']
+    def add_span_field( self, idx : int ):
 
-    def add_span_field( self, class_in : str, **kwargs ):
+        ''' Open the field at the given index in the open struct. '''
 
-        logger = logging.getLogger( 'parser.add.field' )
+        logger = _trace_add_field
         
         # Grab the parent struct class.
-        assert( 'struct' == self.spans_open[-1]['type'] )
-
-        span = self._add_span( 'field', class_in )
-        span['lsbf'] = kwargs['lsbf']
-        span['count_mod'] = kwargs['count_mod']
-        span['hidden'] = kwargs['hidden']
-        span['format'] = kwargs['format']
-        span['term_style'] = kwargs['term_style']
-        span['counts_written'] = kwargs['counts_written']
-        span['parent'] = kwargs['parent']
-        span['mod_contents'] = kwargs['mod_contents']
-        span['summarize'] = kwargs['summarize']
-        if 'size' in kwargs:
-            span['size'] = kwargs['size']
-        if 'count_field' in kwargs:
-            span['count_field'] = kwargs['count_field']
+        struct = self.spans_open[-1]
+        assert( 'struct' == struct.type )
+
+        key, field = struct.fields[idx]
+        span = self._add_span(
+            FieldSpan( key, field, idx, struct.counts[idx] ) )
 
         # Initialize contents correctly for format.
-        if 'string' == span['format']:
-            span['contents'] = ''
-        elif 'number' == span['format']:
-            span['contents'] = 0
-        elif 'color' == span['format']:
-            span['contents'] = 0
+        if 'string' == field['format']:
+            span.contents = ''
+        elif 'number' == field['format']:
+            span.contents = 0
+        elif 'color' == field['format']:
+            span.contents = 0
         else:
             logger.error( 'invalid format specified!' )
 
-    def span_key( self, span : dict ):
+    def span_key( self, span ):
 
         ''' Return the full heirarchal path to the given span. '''
 
-        return '{}/{}'.format( span['parent'], span['class'] ) \
-            if 'field' == span['type'] else span['class']
+        return '{}/{}'.format( span.field_def['parent'], span.key ) \
+            if 'field' == span.type else span.key
 
     def close_span( self, idx: int ):
     
         ''' Close or repeat a span as the rules dictate. '''
 
-        logger = logging.getLogger( 'parser.close_span' )
+        logger = _trace_close_span
 
         # Some convenience handlers.
         span = self.spans_open[idx]
         span_key = self.span_key( span )
 
-        logger.debug( 'closing span: %s after %d bytes',
-            span_key, self.spans_open[idx]['bytes_written'] )
+        if logger.on:
+            logger.debug( 'closing span: %s after %d bytes',
+                span_key, span.bytes_written )
 
-        if 'struct' == span['type']:
-            self.format_data['structs'][span['class']]['counts_written'] += 1
+        if 'struct' == span.type:
+            self.struct_counts[span.key] += 1
+            self.structs_parsed += 1
+            self.struct_spans.append( (self.bytes_written - span.bytes_written,
+                self.bytes_written, span.key, span.sid) )
 
         # Structs just get popped.
-        if 'field' == span['type']:
+        if 'field' == span.type:
             # Store field contents for later if requested.
             self.storage.store_field(
-                span['parent'], span['class'], span['contents'],
-                span['mod_contents'] )
+                span.field_def['parent'], span.key, span.contents,
+                span.field_def['mod_contents'] )
 
-            # Stow last contents in field def.
-            self.spans_open[-2]['fields_written'] \
-                [span['class']]['last_contents'] = span['contents']
+            # Stow last contents in the struct.
+            self.spans_open[-2].last_contents[span.idx] = span.contents
 
         # Actually remove the span.
         self.spans_open.pop( idx )
 
-        if self.spans_open and \
-        'fields' in self.spans_open[-1]:
+        if self.spans_open:
+            struct = self.spans_open[-1]
 
             # See if the final field is zero-length.
-            if 1 == len( self.spans_open[-1]['fields'] ):
-                key = list( self.spans_open[-1]['fields'].keys() )[-1]
-                field = self.spans_open[-1]['fields'][key]
+            if 1 == struct.left:
+                key, field = struct.fields[struct.first]
 
                 # Also check conditions from select_span_field() to see
                 # if last field won't appear.
@@ -299,28 +894,27 @@ class FileParser( object ):
                 if 'count_field' in field and \
                 0 == self.lookup_count_field( key, field ):
                     # This field should never appear!
-                    del self.spans_open[-1]['fields'][key]
+                    struct.remove( struct.first )
 
-                if 'match_field' in field and \
+                elif 'match_field' in field and \
                 not self.match_byte(
                 self.storage.get_field(
                     field['match_field'][0],
                     field['match_field'][1] ),
                 field['match_field'][1], field, 'match_field' ):
                     # This field should never appear!
-                    del self.spans_open[-1]['fields'][key]
+                    struct.remove( struct.first )
 
             # Finally, see if we're out of fields and close struct if so.
-            if not self.spans_open[-1]['fields']:
+            if not struct.left:
 
-                #if 'check_size' in self.spans_open[-1]:
-                #    if self.spans_open[-1]['bytes_written'] != \
-                #    self.spans_open[-1]['check_size']:
+                #if 'check_size' in struct.struct_def:
+                #    if struct.bytes_written != \
+                #    struct.struct_def['check_size']:
                 #        logger.warning(
                 #            'incorrect size for struct %s: %d (should be %d)',
-                #            self.spans_open[-1]['class'],
-                #            self.spans_open[-1]['bytes_written'],
-                #            self.spans_open[-1]['check_size'] )
+                #            struct.key, struct.bytes_written,
+                #            struct.struct_def['check_size'] )
 
                 # Parent struct has no more fields. Close the parent
                 # struct.
@@ -331,145 +925,289 @@ class FileParser( object ):
         self, c : int, key : str, span : dict, field_match : str = 'first'
     ):
 
-        logger = logging.getLogger( 'parser.match.byte' )
+        logger = _trace_match_byte
 
         if type( c ) == list:
             c = c[-1]
-            logger.debug( 'interpreting list as: %s', hex( c ) )
+            if logger.on:
+                logger.debug( 'interpreting list as: %s', hex( c ) )
 
-        logger.debug( 'comparing byte: %s', hex( c ) )
+        # Bytes can be checked against the tables compiled from the
+        # predicates, unless they're being logged.
+        if int == type( c ) and 0 <= c <= 0xff and not logger.on and \
+        'byte_tables' in span:
+            return 1 == span['byte_tables'][field_match][c]
+
+        if logger.on:
+            logger.debug( 'comparing byte: %s', hex( c ) )
 
         if field_match + '_byte_is' in span and \
         c not in span[field_match + '_byte_is']:
-            logger.debug( '%s %s byte is %s: negative match (%s)!',
-                key, field_match, hex( c ), ','.join(
-                    [hex( x ) for x in span[field_match + '_byte_is']] ) )
+            if logger.on:
+                logger.debug( '%s %s byte is %s: negative match (%s)!',
+                    key, field_match, hex( c ), ','.join(
+                        [hex( x ) for x in span[field_match + '_byte_is']] ) )
             return False
 
         if field_match + '_byte_is_and' in span and \
         not [x for x in span[field_match + '_byte_is_and'] if x == c & x]:
-            logger.debug(
-                '%s %s byte is %s (AND): negative match (%s)!',
-                key, field_match, hex( c ), ','.join(
-                    [hex( x ) for x in span[field_match + '_byte_is_and']] ) )
+            if logger.on:
+                logger.debug(
+                    '%s %s byte is %s (AND): negative match (%s)!',
+                    key, field_match, hex( c ), ','.join(
+                        [hex( x ) for x in \
+                            span[field_match + '_byte_is_and']] ) )
             return False
 
         if field_match + '_byte_not' in span and \
         c in span[field_match + '_byte_not']:
-            logger.debug(
-                '%s %s byte is %s: negative match (not %s)!',
-                key, field_match, hex( c ), ','.join( 
-                    [hex( x ) for x in span[field_match + '_byte_not']] ) )
+            if logger.on:
+                logger.debug(
+                    '%s %s byte is %s: negative match (not %s)!',
+                    key, field_match, hex( c ), ','.join( 
+                        [hex( x ) for x in span[field_match + '_byte_not']] ) )
             return False
 
         if field_match + '_byte_not_and' in span and \
         [x for x in span[field_match + '_byte_not_and'] if x == c & x]:
-            logger.debug(
-                '%s %s byte is %s: negative match (not %s)!',
-                key, field_match, hex( c ), ','.join( 
-                    [hex( x ) for x in \
-                        span[field_match + '_byte_not_and']] ) )
+            if logger.on:
+                logger.debug(
+                    '%s %s byte is %s: negative match (not %s)!',
+                    key, field_match, hex( c ), ','.join( 
+                        [hex( x ) for x in \
+                            span[field_match + '_byte_not_and']] ) )
             return False
 
         if field_match + '_byte_gt' in span and \
         c <= span[field_match + '_byte_gt']:
-            logger.debug( '%s %s byte is %s: negative match (gt %s)!',
-                key, field_match, hex( c ),
-                hex( span[field_match + '_byte_gt'] ) )
+            if logger.on:
+                logger.debug( '%s %s byte is %s: negative match (gt %s)!',
+                    key, field_match, hex( c ),
+                    hex( span[field_match + '_byte_gt'] ) )
             return False
 
         if field_match + '_byte_lt' in span and \
         c >= span[field_match + '_byte_lt']:
-            logger.debug( '%s %s byte is %s: negative match (lt %s)!',
-                key, field_match, hex( c ),
-                hex( span[field_match + '_byte_lt'] ) )
+            if logger.on:
+                logger.debug( '%s %s byte is %s: negative match (lt %s)!',
+                    key, field_match, hex( c ),
+                    hex( span[field_match + '_byte_lt'] ) )
             return False
 
         return True
 
-    def select_span_struct( self ):
+    def select_span_struct( self ) -> bool:
 
-        logger = logging.getLogger( 'parser.select.span.struct' )
+        ''' Open the struct starting at the next byte, if any. Returns True
+        if it was parsed whole by its decoder. '''
+
+        logger = _trace_select_struct
 
         assert( 0 == len( self.spans_open ) )
 
         self.chunk_finder.dump()
 
-        logger.debug( 'next byte is: %s', hex( self.chunk_finder.peek() ) )
+        if logger.on:
+            logger.debug( 'next byte is: %s', hex( self.chunk_finder.peek() ) )
 
         # We're not inside a struct... So find one!
         for key in self.format_data['structs']:
             struct = self.format_data['structs'][key]
 
-            # Figure out if a new struct is starting.
+            if self._try_struct( key, struct ):
+                if 'decode' in struct and self._decode_struct( key, struct ):
+                    return True
+                self.add_span_struct( key )
+                break
+
+            if logger.on:
+                logger.debug( 'adding %s to last struct match miss...', key )
+            self.last_struct_match_miss.append( key )
+
+        return False
+
+    def _decode_struct( self, key : str, struct : dict ) -> bool:
+
+        ''' Parse the struct starting at the next byte with its decoder,
+        instead of its fields' rules. The decoder is passed a memoryview of
+        the input from there on and this parser, and returns the number of
+        bytes the struct takes up and its fields as (offset in struct, size,
+        field, contents) tuples in order, or None to leave the struct to the
+        rules. If the decoder raises NeedMoreInput while input is still being
+        fed, parsing stops at this byte until the next feed(). Once the input
+        is complete, the struct is left to the rules instead. Returns True if
+        the struct was decoded or is waiting. '''
+
+        logger = logging.getLogger( 'parser.decode' )
+
+        start = self.bytes_written
+        view = memoryview( self.in_file )[start:]
+        try:
+            decoded = struct['decode']( view, self )
+        except NeedMoreInput:
+            if not self.input_complete:
+                logger.debug( 'decoder for %s waiting at %d', key, start )
+                self.decode_waiting = True
+                return True
+            decoded = None
+        finally:
+            view.release()
+
+        if not decoded or 0 >= decoded[0]:
+            logger.debug( 'decoder for %s declined at %d', key, start )
+            return False
+        length, fields = decoded
+
+        # The chunk finder is refilled from past the struct below, which
+        # takes as much input as it holds now.
+        if not self.input_complete and start + length + \
+        len( self.chunk_finder.magic_buf ) > len( self.in_file ):
+            logger.debug( 'decoder for %s waiting at %d', key, start )
+            self.decode_waiting = True
+            return True
+
+        self._check_structs()
+
+        sid = self.struct_counts[key]
+        counts = {}
+        pos = 0
+        for field_start, size, field_key, contents in fields + \
+        [(length, 0, None, None)]:
+
+            # Bytes between fields are in the struct, but no field.
+            self._buffer_decoded(
+                start + pos, field_start - pos, key, sid, None, None, False )
+            if not field_key:
+                break
 
-            # Struct that starts at a static field.
-            if 'static' == struct['offset_type'] and \
-            self.bytes_written == struct['offset']:
+            field = struct['fields'][field_key]
+            fid = counts.get( field_key, 0 )
+            counts[field_key] = fid + 1
+            self._buffer_decoded( start + field_start, size, key, sid,
+                field_key, fid, field['hidden'] )
+            pos = field_start + size
+
+            self.storage.store_field(
+                key, field_key, contents, field['mod_contents'] )
+            if 'none' != struct['summarize'] and \
+            (not self.filtered or self._select_record(
+                start + field_start, key )):
+                self._store_record( start + field_start, size, field_key,
+                    fid, contents, field, struct, sid )
+
+        self.struct_counts[key] += 1
+        self.structs_parsed += 1
+        self.struct_spans.append( (start, start + length, key, sid) )
+        self.last_struct = key
+        self.last_struct_match_miss = []
+
+        # Pick up from past the struct, refilling the chunk finder.
+        self.bytes_written += length
+        self.skip_input = min( self.bytes_written + len(
+            self.chunk_finder.magic_buf ), len( self.in_file ) )
+        self.chunk_finder.start_offset += length
+        self.chunk_finder.magic_buf = bytes(
+            self.in_file[self.bytes_written:self.skip_input] ).decode(
+                'latin-1' )
+
+        return True
+
+    def _buffer_decoded(
+        self, offset : int, size : int, struct : str, sid : int, field : str,
+        fid : int, hidden : bool
+    ):
+
+        ''' Add buffer entries for a run of decoded bytes. '''
+
+        if not self.keep_buffer:
+            return
+
+        hidden = {'hidden': hidden}
+        for pos in range( offset, offset + size ):
+            if self.filtered:
+                if not self._select_record( pos, struct ):
+                    continue
+                if self._last_buffered + 1 != pos:
+                    self.buffer_gaps.append( (len( self.buffer ), pos) )
+                self._last_buffered = pos
+            self.buffer.append(
+                (self.in_file[pos], struct, sid, field, fid, hidden) )
+
+    def _try_struct( self, key : str, struct : dict ) -> bool:
+
+        ''' Return True if the given struct starts at the next byte. '''
+
+        logger = _trace_select_struct
+
+        # Figure out if a new struct is starting.
+
+        # Struct that starts at a static field.
+        if 'static' == struct['offset_type'] and \
+        self.bytes_written == struct['offset']:
+            if logger.on:
                 logger.debug( 'found static struct %s at offset: %d',
                     key, self.bytes_written )
-                self.add_span_struct( key, **struct )
-                break
+            return True
 
-            elif 'chunk' == struct['offset_type'] and \
-            self.chunk_finder.compare( struct['offset_magic'] ):
-                
+        elif 'chunk' == struct['offset_type'] and \
+        self.chunk_finder.compare( struct['offset_magic'] ):
+            
+            if logger.on:
                 logger.debug( 'found chunk %s starting at offset: %d',
                     struct['offset_magic'],
                     self.chunk_finder.start_offset )
-                self.add_span_struct( key, **struct )
-                break
-
-            # Struct that repeats based on contents of other field.
-            elif self.last_struct == key and \
-            'count_field' in struct and \
-            self.match_byte(
-                self.chunk_finder.peek(), key, struct ) and \
-            self.storage.get_field(
-                struct['count_field'][0], struct['count_field'][1] )[-1] > \
-            struct['counts_written']:
+            return True
+
+        # Struct that repeats based on contents of other field.
+        elif self.last_struct == key and \
+        'count_field' in struct and \
+        self.match_byte(
+            self.chunk_finder.peek(), key, struct ) and \
+        self.storage.get_field(
+            struct['count_field'][0], struct['count_field'][1] )[-1] > \
+        self.struct_counts[key]:
+            if logger.on:
                 logger.debug( 'struct %s repeats %d more times',
                     key,
                     self.storage.get_field(
                     struct['count_field'][0], struct['count_field'][1] )[-1] \
-                    - struct['counts_written'] )
-                self.add_span_struct( key, **struct )
-                break
-
-            # Struct that starts at a field mentioned elsewhere in the
-            # file.
-            elif 'stored' == struct['offset_type'] and \
-            'offset_field' in struct and \
-            [x for x in self.storage.get_field(
-                struct['offset_field'][0], struct['offset_field'][1] ) \
-            if x == self.bytes_written]:
+                    - self.struct_counts[key] )
+            return True
+
+        # Struct that starts at a field mentioned elsewhere in the
+        # file.
+        elif 'stored' == struct['offset_type'] and \
+        'offset_field' in struct and \
+        [x for x in self.storage.get_field(
+            struct['offset_field'][0], struct['offset_field'][1] ) \
+        if x == self.bytes_written]:
+            if logger.on:
                 logger.debug( 'struct %s starts at stored field: %d',
                     key, self.storage.get_field(
                         struct['offset_field'][0], struct['offset_field'][1]
                     )[0] )
-                self.add_span_struct( key, **struct )
-                break
-
-            # Struct that starts after a certain other ends.
-            elif 'follow' == struct['offset_type'] and \
-            key not in self.last_struct_match_miss and \
-            self.match_byte(
-                self.chunk_finder.peek(), key, struct ) and \
-            self.last_struct in struct['follows']:
+            return True
+
+        # Struct that starts after a certain other ends.
+        elif 'follow' == struct['offset_type'] and \
+        key not in self.last_struct_match_miss and \
+        self.match_byte(
+            self.chunk_finder.peek(), key, struct ) and \
+        self.last_struct in struct['follows']:
+            if logger.on:
                 logger.debug( 'struct %s follows struct %s',
                     key, self.last_struct )
-                self.add_span_struct( key, **struct )
-                break
+            return True
 
-            logger.debug( 'adding %s to last struct match miss...', key )
-            self.last_struct_match_miss.append( key )
+        return False
 
     def lookup_count_field( self, key : str, field : dict ):
 
-        logger = logging.getLogger( 'parser.repeats.field' )
+        logger = _trace_repeats
 
         if 'count_field' not in field:
-            logger.debug( 'field %s has no count field.', key )
+            if logger.on:
+                logger.debug( 'field %s has no count field.', key )
             return -1
 
         count_field_storage = self.storage.get_field(
@@ -480,10 +1218,10 @@ class FileParser( object ):
         count_idx = -1
         if '#' in field['count_field'][1]:
             count_struct_key = re.sub( '.*#', '', field['count_field'][1] )
-            count_struct = self.format_data['structs'][count_struct_key]
-            count_idx = count_struct['counts_written'] - 1
-            logger.debug( 'parsed count index %d from structs[%s]...',
-                count_idx, count_struct_key )
+            count_idx = self.struct_counts[count_struct_key] - 1
+            if logger.on:
+                logger.debug( 'parsed count index %d from structs[%s]...',
+                    count_idx, count_struct_key )
 
         count_field = None
         try:
@@ -495,182 +1233,363 @@ class FileParser( object ):
         return eval( field['count_mod'],
             {}, {
                 'count_field': count_field,
-                'struct': self.spans_open[-1]
+                'struct': self.spans_open[0]
             } )
 
     def _last_field_repeats( self ):
 
-        logger = logging.getLogger( 'parser.repeats.field' )
+        logger = _trace_repeats
 
-        key = self.last_field[0]
-        field = self.last_field[1]
+        struct = self.spans_open[0]
+        key, field = struct.fields[struct.last_field]
 
-        logger.debug( 'checking if %s repeats...', key )
+        if logger.on:
+            logger.debug( 'checking if %s repeats...', key )
 
         repeat_count = self.lookup_count_field( key, field )
         if 0 > repeat_count:
             return False
 
-        if repeat_count <= self.last_field[1]['counts_written']:
-            logger.debug( 'repeat count %d satisfied by written count %d.',
-                repeat_count, self.last_field[1]['counts_written'] )
+        if repeat_count <= struct.counts[struct.last_field]:
+            if logger.on:
+                logger.debug( 'repeat count %d satisfied by written count %d.',
+                    repeat_count, struct.counts[struct.last_field] )
             return False
 
-        logger.debug( 'repeat count %d higher than written count %d...',
-            repeat_count, self.last_field[1]['counts_written'] )
+        if logger.on:
+            logger.debug( 'repeat count %d higher than written count %d...',
+                repeat_count, struct.counts[struct.last_field] )
         return True
 
-    def _stow_field_def( self, open_struct : dict, key : str ):
-        if not 'fields_written' in open_struct:
-            open_struct['fields_written'] = {}
-        open_struct['fields_written'][key] = open_struct['fields'][key]
-        del open_struct['fields'][key]
-
-    def select_span_field( self, open_struct : dict ):
+    def select_span_field( self, open_struct : StructSpan ):
         
-        logger = logging.getLogger( 'parser.select.span.field' )
+        logger = _trace_select_field
 
-        assert( 'struct' == open_struct['type'] )
+        assert( 'struct' == open_struct.type )
 
-        logger.debug( 'selecting field...' )
+        if logger.on:
+            logger.debug( 'selecting field...' )
 
-        if self.last_field and self._last_field_repeats():
+        idx = open_struct.last_field
+        if None != idx and self._last_field_repeats():
             # If this is a field, update counts written and restart
             # if the field says we have some left.
+            key, field = open_struct.fields[idx]
 
-            logger.debug( 'repeating span %s (%d/%d(%s))...',
-                self.last_field[0],
-                self.last_field[1]['counts_written'],
-                self.storage.get_field(
-                    self.last_field[1]['count_field'][0],
-                    self.last_field[1]['count_field'][1]
-                )[-1],
-                self.last_field[1]['count_mod'] )
+            if logger.on:
+                logger.debug( 'repeating span %s (%d/%d(%s))...',
+                    key,
+                    open_struct.counts[idx],
+                    self.storage.get_field(
+                        field['count_field'][0],
+                        field['count_field'][1]
+                    )[-1],
+                    field['count_mod'] )
+
+            self._check_repeats( key, field, open_struct.counts[idx] + 1 )
 
             # Refurbish the span to be repeated again.
-            self.last_field[1]['counts_written'] += 1
-            logger.debug(
-                'incrementing written count on field %s to %d...',
-                self.last_field[0], self.last_field[1]['counts_written'] )
-            self.add_span_field(
-                self.last_field[0], **(self.last_field[1]) )
+            open_struct.counts[idx] += 1
+            self.repeats_parsed += 1
+            if logger.on:
+                logger.debug(
+                    'incrementing written count on field %s to %d...',
+                    key, open_struct.counts[idx] )
+            self.add_span_field( idx )
 
             return
 
+        last_key = open_struct.fields[idx][0] if None != idx else None
+
         # If there's nothing to repeat, then check the open struct for
         # new fields.
-        for key in open_struct['fields']:
-            field = open_struct['fields'][key]
+        for idx in open_struct.remaining():
+            if self._try_field( open_struct, idx, last_key ):
+                break
 
-            # Adding a new condition here should also be reflected in
-            # close_span() so we know if a field won't appear and the struct
-            # has ended!
+        if logger.on:
+            logger.debug( 'selecting field complete.' )
 
-            if 'offset' in field and \
-            ('match_field' not in field or \
-            self.match_byte(
-                self.storage.get_field(
-                    field['match_field'][0], field['match_field'][1] ),
-                field['match_field'][1], field, 'match_field' )) and \
-            open_struct['bytes_written'] == field['offset']:
-                self.add_span_field( key, **field )
-                logger.debug( 'removing used field: %s', key )
+    def _try_field(
+        self, open_struct : StructSpan, idx : int, last_key : str
+    ) -> bool:
 
-                # Remove field now that we've written it.
-                open_struct['fields'][key]['counts_written'] += 1
-                self._set_last_field( (key, open_struct['fields'][key]) )
-                self._stow_field_def( open_struct, key )
-                break
+        ''' If the field at the given index in the open struct starts at the
+        next byte, open it and return True. '''
 
-            elif 'follows' in field and \
-            ('match_field' not in field or \
-            self.match_byte(
-                self.storage.get_field(
-                    field['match_field'][0], field['match_field'][1] ),
-                field['match_field'][1], field, 'match_field' )) and \
-            self.last_field[0] == field['follows']:
+        logger = _trace_select_field
+
+        key, field = open_struct.fields[idx]
+
+        # Adding a new condition here should also be reflected in
+        # close_span() so we know if a field won't appear and the struct
+        # has ended!
 
-                self.add_span_field( key, **field )
+        if ('offset' in field and \
+        ('match_field' not in field or \
+        self.match_byte(
+            self.storage.get_field(
+                field['match_field'][0], field['match_field'][1] ),
+            field['match_field'][1], field, 'match_field' )) and \
+        open_struct.bytes_written == field['offset']) or \
+        ('follows' in field and \
+        ('match_field' not in field or \
+        self.match_byte(
+            self.storage.get_field(
+                field['match_field'][0], field['match_field'][1] ),
+            field['match_field'][1], field, 'match_field' )) and \
+        last_key == field['follows']):
+
+            self.add_span_field( idx )
+            if logger.on:
                 logger.debug( 'removing used field: %s', key )
 
-                # Remove field now that we've written it.
-                open_struct['fields'][key]['counts_written'] += 1
-                self._set_last_field( (key, open_struct['fields'][key]) )
-                self._stow_field_def( open_struct, key )
-                break
+            # Remove field now that we've written it.
+            open_struct.counts[idx] += 1
+            self._set_last_field( open_struct, idx )
+            open_struct.remove( idx )
+            return True
+
+        return False
+
+    def _check_structs( self ):
+
+        if None != self.limits.max_structs and \
+        self.structs_parsed >= self.limits.max_structs:
+            raise _ParseLimitReached(
+                'more than {} struct instances'.format(
+                    self.limits.max_structs ) )
+
+    def _check_repeats( self, key : str, field : dict, count : int ):
+
+        if None != self.limits.max_repeats and \
+        count > self.limits.max_repeats:
+            raise _ParseLimitReached(
+                'field {}/{} repeats more than {} times'.format(
+                    field['parent'], key,
+                    self.limits.max_repeats ) )
+
+    def estimate_memory( self ) -> int:
+
+        ''' Return roughly how many bytes the input, buffer and records held
+        by this parser take up in memory. '''
+
+        return len( self.in_file ) + \
+            len( self.buffer ) * FileParser.BUFFER_ENTRY_SZ + \
+            self.storage.held_record_count() * FileParser.RECORD_SZ
+
+    def _check_limits( self ):
+
+        ''' Raise _ParseLimitReached if the parse has gone over its memory
+        or time limits. '''
+
+        limits = self.limits
+        self.next_limit_check = self.bytes_read + ParseLimits.CHECK_INTERVAL
+
+        if None != limits.max_memory and \
+        self.estimate_memory() > limits.max_memory:
+            raise _ParseLimitReached( 'more than {} bytes of memory'.format(
+                limits.max_memory ) )
+
+        if None != limits.max_time and \
+        time.monotonic() - self.parse_started > limits.max_time:
+            raise _ParseLimitReached( 'more than {} seconds'.format(
+                limits.max_time ) )
+
+    def _stop_at_limit( self, e : _ParseLimitReached ):
+
+        logger = logging.getLogger( 'parser.limits' )
+
+        self.limit_reached = \
+            {'offset': self.bytes_written, 'reason': e.reason}
+        logger.warning( 'stopped parsing at offset %d: %s',
+            self.bytes_written, e.reason )
+
+    def _select_byte( self ) -> bool:
+
+        ''' Return True if the byte being acknowledged is within the
+        selected range and structs, noting if it does not follow the last
+        selected byte. '''
+
+        if self.bytes_written < self.select_start or \
+        self.bytes_written >= self.select_end:
+            return False
 
-        logger.debug( 'selecting field complete.' )
+        if self.select_structs and (not self.spans_open or \
+        self.spans_open[0].key not in self.select_structs):
+            return False
+
+        if self._last_buffered + 1 != self.bytes_written:
+            self.buffer_gaps.append( (len( self.buffer ), self.bytes_written) )
+        self._last_buffered = self.bytes_written
+
+        return True
+
+    def _select_record( self, offset : int, struct : str ) -> bool:
+        return self.select_start <= offset < self.select_end and \
+            (not self.select_structs or struct in self.select_structs)
+
+    def _skip_unselected( self ):
+
+        ''' If the open field (or the field about to repeat) is in an
+        unselected struct or range and nothing refers to its contents, jump
+        over its remaining bytes and repeats using its size and count field
+        instead of parsing them byte by byte. It is left one byte short of
+        its end, so that it is closed as usual. '''
+
+        logger = _trace_skip
+
+        if not self.spans_open or None == self.spans_open[0].last_field:
+            return
+
+        span = self.spans_open[-1]
+        struct = self.spans_open[0]
+        idx = struct.last_field
+        key, field = struct.fields[idx]
+        if 'static' != field['term_style'] or \
+        (field['parent'], key) in self.dependent_fields:
+            return
+
+        if 'field' == span.type:
+            if span.idx != idx:
+                return
+            remaining = field['size'] - span.bytes_written
+        elif self._last_field_repeats():
+            # The next byte would start another repeat.
+            remaining = 0
+        else:
+            return
+
+        repeats = 0
+        if 'count_field' in field:
+            repeats = max( 0,
+                math.ceil( self.lookup_count_field( key, field ) ) - \
+                    struct.counts[idx] )
+        skip = remaining + repeats * field['size'] - 1
+
+        if skip < FileParser.SKIP_MIN or \
+        self.bytes_read + skip > len( self.in_file ):
+            return
+
+        # Make sure none of the bytes to skip are selected, nor is the open
+        # field they'd close (or drop, when jumping to its last repeat).
+        field_start = self.bytes_written - span.bytes_written \
+            if 'field' == span.type else self.bytes_written
+        if (not self.select_structs or \
+        struct.key in self.select_structs) and \
+        self.bytes_written + skip > self.select_start and \
+        field_start < self.select_end:
+            return
+
+        if logger.on:
+            logger.debug( 'skipping %d bytes of %s/%s...',
+                skip, field['parent'], key )
+
+        if repeats:
+            self._check_repeats( key, field, struct.counts[idx] + repeats )
+
+            # Jump straight to the last repeat.
+            if 'field' == span.type:
+                self.spans_open.pop()
+            struct.counts[idx] += repeats
+            self.repeats_parsed += repeats
+            self.add_span_field( idx )
+            self.spans_open[-1].bytes_written = field['size'] - 1
+        else:
+            span.bytes_written += skip
+        struct.bytes_written += skip
+
+        # Refill the chunk finder from past the skipped bytes.
+        self.bytes_written += skip
+        self.bytes_read += skip
+        self.chunk_finder.start_offset += skip
+        self.chunk_finder.magic_buf = bytes(
+            self.in_file[self.bytes_written:self.bytes_read] ).decode(
+                'latin-1' )
 
     def acknowledge_byte( self, byte_in : int ):
 
-        logger = logging.getLogger( 'parser.acknowledge_byte' )
+        spans_open = self.spans_open
 
         # Add our byte to the open field contents if there is one.
-        if self.spans_open and 'field' == self.spans_open[-1]['type']:
-            if 'string' == self.spans_open[-1]['format']:
-                self.spans_open[-1]['contents'] += chr( byte_in )
-            elif self.spans_open[-1]['lsbf']:
+        if spans_open and 'field' == spans_open[-1].type:
+            span = spans_open[-1]
+            if 'string' == span.field_def['format']:
+                span.contents += chr( byte_in )
+            elif span.field_def['lsbf']:
                 # Shift byte before adding it.
-                self.spans_open[-1]['contents'] |= \
-                    (byte_in << self.spans_open[-1]['bytes_written'] * 8)
+                span.contents |= (byte_in << span.bytes_written * 8)
             else:
-                self.spans_open[-1]['contents'] <<= 8
-                self.spans_open[-1]['contents'] |= byte_in
-            #logger.debug( 'current field %s/%s contents: 0x%08x',
-            #    self.spans_open[-1]['parent'], self.spans_open[-1]['class'],
-            #    self.spans_open[-1]['contents'] )
+                span.contents <<= 8
+                span.contents |= byte_in
+            #logger.debug( 'current field %s contents: 0x%08x',
+            #    self.span_key( span ), span.contents )
 
         # Write our byte.
-        self.buffer.append( (
-            byte_in,
-            self.spans_open[0]['class'] \
-                if 0 < len( self.spans_open ) else None,
-            self.format_data\
-                ['structs'][self.spans_open[0]['class']]['counts_written'] \
-                    if 0 < len( self.spans_open ) else -1,
-            self.spans_open[1]['class'] \
-                if 1 < len( self.spans_open ) else None,
-            self.spans_open[-1]['counts_written'] \
-                if 1 < len( self.spans_open ) else None,
-            {'hidden': self.spans_open[-1]['hidden']} \
-                if 1 < len( self.spans_open ) else {'hidden': False}) )
+        if self.keep_buffer and (not self.filtered or self._select_byte()):
+            self.buffer.append( (
+                byte_in,
+                spans_open[0].key if 0 < len( spans_open ) else None,
+                spans_open[0].sid if 0 < len( spans_open ) else -1,
+                spans_open[1].key if 1 < len( spans_open ) else None,
+                spans_open[-1].counts_written \
+                    if 1 < len( spans_open ) else None,
+                {'hidden': spans_open[-1].field_def['hidden']} \
+                    if 1 < len( spans_open ) else {'hidden': False}) )
 
         # Update accounting.
         self.bytes_written += 1
-        for idx in range( len( self.spans_open ) - 1, -1, -1 ):
-            self.spans_open[idx]['bytes_written'] += 1
+        for span in spans_open:
+            span.bytes_written += 1
 
     def _parse_byte( self, file_byte_in : int ):
 
-        logger = logging.getLogger( 'parser.parse.byte' )
+        logger = _trace_parse_byte
+
+        if self.bytes_read >= self.next_limit_check:
+            self._check_limits()
+
+        if self.bytes_read < self.skip_input and 0 <= file_byte_in:
+            return
 
         if not self.spans_open:
-            logger.debug( 'selecting struct...' )
-            self.select_span_struct()
+            if self.bytes_read >= self.next_checkpoint and 0 <= file_byte_in:
+                self._reach_checkpoint()
+            if logger.on:
+                logger.debug( 'selecting struct...' )
+            if self.select_span_struct():
+                # Its decoder already parsed it and this byte, or is waiting
+                # to be fed more.
+                return
         else:
-            logger.debug( 'spans open: %s', ','.join( 
-                [x['class'] for x in self.spans_open] ) )
+            if logger.on:
+                logger.debug( 'spans open: %s', ','.join( 
+                    [x.key for x in self.spans_open] ) )
 
         # Not an elif, as it can run after a new struct is added earlier
         # in this method.
-        if self.spans_open and 'struct' == self.spans_open[-1]['type']:
+        if self.spans_open and 'struct' == self.spans_open[-1].type:
             # We're inside a struct but not a field... so find one!
-            logger.debug( 'selecting field...' )
+            if logger.on:
+                logger.debug( 'selecting field...' )
             self.select_span_field( self.spans_open[-1] )
         else:
-            logger.debug( 'not selecting field!' )
+            if logger.on:
+                logger.debug( 'not selecting field!' )
 
         # Don't infinite loop if we're pushing chunk bytes in.
         file_byte = self.chunk_finder.push( file_byte_in )
-        logger.debug(
-            'swapped %s for %s...',
-            hex( file_byte_in ), hex( file_byte ) )
+        if logger.on:
+            logger.debug(
+                'swapped %s for %s...',
+                hex( file_byte_in ), hex( file_byte ) )
     
         # TODO ('var' == span['term_style'] and 0x80 != (0x80 & file_byte)):
         # OR away continue byte?
     
         if -1 != file_byte:
-            logger.debug( 'acknowledging byte %s...', hex( file_byte ) )
+            if logger.on:
+                logger.debug( 'acknowledging byte %s...', hex( file_byte ) )
             self.acknowledge_byte( file_byte )
         
         # Start from the end of the open spans so we don't alter
@@ -678,60 +1597,243 @@ class FileParser( object ):
         for idx in range( len( self.spans_open ) - 1, -1, -1 ):
             span = self.spans_open[idx]
 
-            if 'struct' == span['type']:
-                logger.debug( 'skipping closing span %s...', span['class'] )
+            if 'struct' == span.type:
+                if logger.on:
+                    logger.debug(
+                        'skipping closing span %s...', span.key )
                 continue
 
-            if ('on_null' == span['term_style'] and 0 == file_byte) or \
-            ('static' == span['term_style'] and \
-            span['bytes_written'] >= span['size']) or \
-            ('var' == span['term_style'] and 0x80 != (0x80 & file_byte)):
-                parent = self.spans_open[0]
-                parent_def = self.format_data['structs'][span['parent']]
-
-                if 'none' != parent_def['summarize']:
-                    # Store info for a summarization stanza.
-                    assert( None != span['contents'] )
-                    self.storage.store_offset(
-                        self.bytes_written - \
-                            self.spans_open[idx]['bytes_written'],
-                        span['bytes_written'],
-                        span['parent'],
-                        span['class'],
-                        span['counts_written'],
-                        span['contents'],
-                        span['mod_contents'],
-                        parent_def['counts_written'],
-                        parent_def['summarize'] \
-                            if 'default' == span['summarize'] else \
-                            span['summarize'],
-                        span['format'],
-                        span['lsbf'] )
+            field = span.field_def
+            if ('on_null' == field['term_style'] and 0 == file_byte) or \
+            ('static' == field['term_style'] and \
+            span.bytes_written >= field['size']) or \
+            ('var' == field['term_style'] and 0x80 != (0x80 & file_byte)):
+                parent_def = self.spans_open[0].struct_def
+
+                if 'none' != parent_def['summarize'] and \
+                (not self.filtered or self._select_record(
+                    self.bytes_written - span.bytes_written,
+                    field['parent'] )):
+                    self._store_span( span, parent_def )
 
                 self.close_span( idx )
                 if not self.spans_open:
                     # We must've popped the parent struct, too!
-                    logger.debug( 'no spans left to process!' )
+                    if logger.on:
+                        logger.debug( 'no spans left to process!' )
                     break
 
-        logger.debug( 'processing byte complete!' )
+        if logger.on:
+            logger.debug( 'processing byte complete!' )
+
+    def _store_span( self, span : FieldSpan, parent_def : dict ):
+
+        ''' Store info for a summarization stanza about a closing field. '''
+
+        assert( None != span.contents )
+        self._store_record( self.bytes_written - span.bytes_written,
+            span.bytes_written, span.key, span.counts_written, span.contents,
+            span.field_def, parent_def, self.spans_open[0].sid )
+
+    def _store_record(
+        self, offset : int, size : int, key : str, fid : int, contents,
+        field : dict, parent_def : dict, sid : int
+    ):
+
+        self.storage.store_offset(
+            offset,
+            size,
+            field['parent'],
+            key,
+            fid,
+            contents,
+            field['mod_contents'],
+            sid,
+            parent_def['summarize'] \
+                if 'default' == field['summarize'] else \
+                field['summarize'],
+            field['format'],
+            field['lsbf'] )
+
+        if None != self.limits.max_records and \
+        self.storage.record_count() > self.limits.max_records:
+            raise _ParseLimitReached( 'more than {} records stored'.format(
+                self.limits.max_records ) )
+
+    def finish( self ):
+
+        ''' Parse the bytes still held back by the chunk finder (or for a
+        waiting decoder) once there is no more input. '''
+
+        logger = logging.getLogger( 'parser.parse' )
+
+        if self.limit_reached:
+            return
+
+        self.input_complete = True
+
+        try:
+            # Parse any input held back for a decoder waiting for more.
+            while self.decode_waiting and \
+            self.bytes_read < len( self.in_file ):
+                self._parse_byte( self.in_file[self.bytes_read] )
+                self.bytes_read += 1
+
+            # Empty out the chunk finder!
+            while self.chunk_finder.has_bytes():
+                logger.debug(
+                    'shaking out the chunk finder (%d left!)...',
+                    self.chunk_finder.has_bytes() )
+                self._parse_byte( -1 )
+        except _ParseLimitReached as e:
+            self._stop_at_limit( e )
 
     def parse( self ):
 
         logger = logging.getLogger( 'parser.parse' )
 
         last_byte = None
-        for file_byte in self.in_file:
-            self._parse_byte( file_byte )
-            last_byte = file_byte
+        self.input_complete = True
+        try:
+            if self.filtered:
+                while self.bytes_read < len( self.in_file ):
+                    self._parse_byte( self.in_file[self.bytes_read] )
+                    self.bytes_read += 1
+                    if self.bytes_written >= self.select_end and \
+                    not self.spans_open:
+                        # Nothing more will be selected.
+                        break
+                    self._skip_unselected()
+            else:
+                for file_byte in self.in_file:
+                    self._parse_byte( file_byte )
+                    self.bytes_read += 1
+                    last_byte = file_byte
+        except _ParseLimitReached as e:
+            self._stop_at_limit( e )
+            return
 
         logger.debug( 'last byte was: %s, chunk_finder next byte is: %s',
             last_byte, self.chunk_finder.peek() )
 
-        # Empty out the chunk finder!
-        while self.chunk_finder.has_bytes():
-            logger.debug(
-                'shaking out the chunk finder (%d left!)...',
-                self.chunk_finder.has_bytes() )
-            self._parse_byte( -1 )
+        self.finish()
+
+    def feed( self, data ):
+
+        ''' Parse bytes appended to the input since the last feed(). Call
+        finish() once the input is complete. Input fed after a limit was
+        reached is ignored. '''
+
+        if self.limit_reached:
+            return
+
+        if bytearray != type( self.in_file ):
+            self.in_file = bytearray( self.in_file )
+        self.in_file += data
+
+        # Start from any input held back for a waiting decoder.
+        self.decode_waiting = False
+        try:
+            while self.bytes_read < len( self.in_file ):
+                self._parse_byte( self.in_file[self.bytes_read] )
+                if self.decode_waiting:
+                    break
+                self.bytes_read += 1
+        except _ParseLimitReached as e:
+            self._stop_at_limit( e )
+
+    def reparse( self, in_file, changed_start : int, changed_end : int ):
+
+        ''' Update a finished parse for new input in which the bytes from
+        changed_start to changed_end differ. Parsing resumes from the last
+        checkpoint before the change and, if the input size is unchanged,
+        stops as soon as the parser state converges with a checkpoint of the
+        previous parse, reusing its results from there on. Requires a
+        checkpoint_interval, and a previous parse that did not stop at a
+        limit. Returns True if the state converged. '''
+
+        logger = logging.getLogger( 'parser.reparse' )
+
+        assert( self.checkpoints )
+        assert( not self.limit_reached )
+
+        idx = bisect.bisect_right(
+            [x['bytes_read'] for x in self.checkpoints], changed_start ) - 1
+        resume = self.checkpoints[idx]
+
+        logger.debug( 'resuming from checkpoint at %d for change at %d-%d...',
+            resume['bytes_read'], changed_start, changed_end )
+
+        # Keep what the previous parse produced after the checkpoint.
+        old_checkpoints = self.checkpoints[idx + 1:]
+        final_state = self._checkpoint_state()
+        old_buffer = self.buffer
+        old_struct_spans = self.struct_spans
+        old_records = self.storage.take_records()
+        field_tails = self.storage.truncate_fields( resume['field_lens'] )
+
+        self._replay = {
+            'changed_end': changed_end,
+            'resume': resume,
+            'field_tails': field_tails,
+            'checkpoints': {x['bytes_read']: x for x in old_checkpoints} \
+                if len( in_file ) == len( self.in_file ) else {}
+        }
+        self.in_file = in_file
+        self.checkpoints = self.checkpoints[:idx + 1]
+        self.next_checkpoint = min(
+            resume['bytes_read'] + self.checkpoint_interval, changed_end )
+        self._restore_state( resume )
+        self.buffer = []
+
+        # Checkpoints are only taken between structs.
+        self.struct_spans = [x for x in old_struct_spans \
+            if x[1] <= resume['bytes_written']]
+        self.parse_started = time.monotonic()
+        if self.limits.periodic():
+            self.next_limit_check = resume['bytes_read']
+
+        converged = None
+        self.input_complete = True
+        try:
+            for pos in range( resume['bytes_read'], len( in_file ) ):
+                self.bytes_read = pos
+                self._parse_byte( in_file[pos] )
+            self.bytes_read = len( in_file )
+            self.finish()
+        except _ParserConverged as e:
+            converged = e.checkpoint
+        except _ParseLimitReached as e:
+            self._stop_at_limit( e )
+        finally:
+            self._replay = None
+
+        if converged:
+            logger.debug( 'converged with previous parse at %d',
+                converged['bytes_read'] )
+
+            # Splice the previous results back in after the re-parsed range.
+            old_buffer[resume['bytes_written']:converged['bytes_written']] = \
+                self.buffer
+            self.buffer = old_buffer
+            self.struct_spans += [x for x in old_struct_spans \
+                if x[0] >= converged['bytes_written']]
+            self.storage.splice_records( old_records,
+                resume['bytes_written'], converged['bytes_written'] )
+            self.storage.restore_fields( field_tails, {x: \
+                converged['field_lens'].get( x, 0 ) - \
+                resume['field_lens'].get( x, 0 ) for x in field_tails} )
+            self.checkpoints += [x for x in old_checkpoints \
+                if x['bytes_read'] >= converged['bytes_read']]
+            self._restore_state( final_state )
+
+        else:
+            old_buffer[resume['bytes_written']:] = self.buffer
+            self.buffer = old_buffer
+            self.storage.splice_records( old_records,
+                resume['bytes_written'] )
+
+        self.next_checkpoint = sys.maxsize
+
+        return None != converged
 
@@ -0,0 +1,160 @@
+
+import time
+from .parser import FileParser, StructSpan, FieldSpan
+
+class ProfilingFileParser( FileParser ):
+
+    ''' FileParser that attributes wall time and call counts to the grammar
+    elements it evaluates: each struct candidate tried, each struct decoder
+    run, field selection within each struct and each field tried there,
+    each byte predicate check and each count expression, as well as
+    storing records by summarize style. Time not spent in any of these is
+    attributed to the byte loop itself. '''
+
+    REPORT_SORTS = ['total', 'self', 'calls']
+
+    def __init__( self, *args, **kwargs ):
+
+        super().__init__( *args, **kwargs )
+
+        # Call stack (tuple of frame names) -> [calls, total, self].
+        self.profile = {}
+        self._stack = []
+        self._child_time = [0.0]
+
+    def _element_key( self, key : str, element : dict ) -> str:
+        return '{}/{}'.format( element['parent'], key ) \
+            if 'parent' in element else key
+
+    def _profiled( self, frame : str, func, *args, **kwargs ):
+
+        ''' Call func, adding its time to the given frame under the frames
+        currently being profiled. '''
+
+        self._stack.append( frame )
+        self._child_time.append( 0.0 )
+        start = time.perf_counter()
+        try:
+            return func( *args, **kwargs )
+        finally:
+            elapsed = time.perf_counter() - start
+            child_time = self._child_time.pop()
+            self._child_time[-1] += elapsed
+            stack = tuple( self._stack )
+            self._stack.pop()
+
+            if not stack in self.profile:
+                self.profile[stack] = [0, 0.0, 0.0]
+            entry = self.profile[stack]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += elapsed - child_time
+
+    def select_span_struct( self ):
+        return self._profiled( 'select_struct', super().select_span_struct )
+
+    def _try_struct( self, key : str, struct : dict ) -> bool:
+        return self._profiled( 'struct {} ({})'.format(
+            key, struct['offset_type'] ), super()._try_struct, key, struct )
+
+    def _decode_struct( self, key : str, struct : dict ) -> bool:
+        return self._profiled( 'decode {} ({})'.format(
+            key, struct['decoder'] ), super()._decode_struct, key, struct )
+
+    def select_span_field( self, open_struct : StructSpan ):
+        return self._profiled(
+            'select_field {}'.format( open_struct.key ),
+            super().select_span_field, open_struct )
+
+    def _try_field(
+        self, open_struct : StructSpan, idx : int, last_key : str
+    ) -> bool:
+        return self._profiled( 'field {}/{}'.format(
+            open_struct.key, open_struct.fields[idx][0] ),
+            super()._try_field, open_struct, idx, last_key )
+
+    def match_byte(
+        self, c : int, key : str, span : dict, field_match : str = 'first'
+    ):
+        predicates = [x for x in span if x.startswith( field_match + '_byte' )]
+        if not predicates:
+            # Nothing to check, so nothing worth profiling.
+            return super().match_byte( c, key, span, field_match )
+        return self._profiled( 'match {} {}'.format(
+            self._element_key( key, span ), ','.join( predicates ) ),
+            super().match_byte, c, key, span, field_match )
+
+    def lookup_count_field( self, key : str, field : dict ):
+        if 'count_field' not in field:
+            return super().lookup_count_field( key, field )
+        return self._profiled( 'count {} ({})'.format(
+            self._element_key( key, field ), field['count_mod'] ),
+            super().lookup_count_field, key, field )
+
+    def _store_span( self, span : FieldSpan, parent_def : dict ):
+        return self._profiled( 'store {}'.format(
+            parent_def['summarize'] \
+                if 'default' == span.field_def['summarize'] else \
+                    span.field_def['summarize'] ),
+            super()._store_span, span, parent_def )
+
+    def parse( self ):
+        return self._profiled( 'parse', super().parse )
+
+    def feed( self, data ):
+        return self._profiled( 'parse', super().feed, data )
+
+    def finish( self ):
+        # parse() finishes within its own frame.
+        if self._stack:
+            return super().finish()
+        return self._profiled( 'parse', super().finish )
+
+    def report( self, sort : str = 'total' ) -> list:
+
+        ''' Return a list of dicts with the calls, total and self time spent
+        in each grammar element, summed over where it was called from and
+        sorted by the given key, largest first. '''
+
+        assert( sort in ProfilingFileParser.REPORT_SORTS )
+
+        elements = {}
+        for stack in self.profile:
+            calls, total, self_time = self.profile[stack]
+            if not stack[-1] in elements:
+                elements[stack[-1]] = \
+                    {'element': stack[-1], 'calls': 0, 'total': 0.0,
+                        'self': 0.0}
+            element = elements[stack[-1]]
+            element['calls'] += calls
+            element['self'] += self_time
+
+            # Don't count time twice for elements called within themselves.
+            if not stack[-1] in stack[:-1]:
+                element['total'] += total
+
+        return sorted( elements.values(), key=lambda x: x[sort],
+            reverse=True )
+
+    def write_report(
+        self, out_file, sort : str = 'total', limit : int = None
+    ):
+
+        ''' Write the report as a table of plain text. '''
+
+        out_file.write( '{:>10} {:>12} {:>12}  {}\n'.format(
+            'calls', 'total (s)', 'self (s)', 'element' ) )
+        for element in self.report( sort )[:limit]:
+            out_file.write( '{:>10} {:>12.6f} {:>12.6f}  {}\n'.format(
+                element['calls'], element['total'], element['self'],
+                element['element'] ) )
+
+    def write_collapsed( self, out_file ):
+
+        ''' Write self time per call stack in microseconds, in the collapsed
+        stack format taken by flamegraph tools. '''
+
+        for stack in sorted( self.profile ):
+            out_file.write( '{} {}\n'.format(
+                ';'.join( [x.replace( ';', ',' ) for x in stack] ),
+                int( self.profile[stack][2] * 1000000 ) ) )
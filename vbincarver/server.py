@@ -0,0 +1,318 @@
+
+import io
+import os
+import bisect
+import json
+import logging
+import threading
+import http.server
+import urllib.parse
+import yaml
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from .parser import FileParser, ParseLimits, find_changed_range
+from .formatter import PageFormatter, HexFormatter, SummaryFormatter
+from .config import FormatConfig, ConfigException, detect_format
+
+class ParsedFileCache( object ):
+
+    ''' LRU of parsed files, bounded by their approximate size in memory.
+    Grammars are kept loaded, as parsing doesn't change them. '''
+
+    CHECKPOINT_INTERVAL = 4096
+
+    def __init__( self, max_bytes : int, limits : ParseLimits = None ):
+        self.max_bytes = max_bytes
+        self.limits = limits
+        self.bytes_used = 0
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.latest = {}
+        self.formats = {}
+        self.lock = threading.Lock()
+
+    def get_format( self, parse_path : str, format_name : str = None ):
+
+        ''' Return the named (or detected) grammar, shared by every parse of
+        that format. '''
+
+        if not format_name:
+            format_name = detect_format( parse_path )
+        if not format_name:
+            format_name = os.path.splitext( parse_path )[1][1:].lower()
+
+        with self.lock:
+            format_data = self.formats.get( format_name )
+
+        if not format_data:
+            format_data = FormatConfig( parse_path, format_name )
+            with self.lock:
+                self.formats[format_name] = format_data
+
+        return format_data
+
+    def estimate_size( self, entry : dict ) -> int:
+        return entry['parser'].estimate_memory() + \
+            sum( [len( x ) for x in entry['pages'].values()] )
+
+    def _evict( self ):
+        while self.bytes_used > self.max_bytes and 1 < len( self.entries ):
+            key, entry = self.entries.popitem( last=False )
+            self.bytes_used -= entry['size']
+
+    def _parse(
+        self, parse_path : str, format_name : str, stale : dict = None
+    ) -> dict:
+
+        logger = logging.getLogger( 'server.cache' )
+
+        with open( parse_path, 'rb' ) as parse_file:
+            in_file = parse_file.read()
+
+        if stale and not stale['parser'].limit_reached:
+            # Only re-parse what changed since the file was last parsed.
+            # The parser is updated in place, so requests still holding
+            # the old entry share its lock with the new one.
+            file_parser = stale['parser']
+            lock = stale['lock']
+            changed = find_changed_range( file_parser.in_file, in_file )
+            if changed:
+                logger.info( 'reparsing %s from %d...',
+                    parse_path, changed[0] )
+                with lock:
+                    file_parser.reparse( in_file, changed[0], changed[1] )
+                    stale.pop( 'record_offsets', None )
+        else:
+            logger.info( 'parsing %s...', parse_path )
+            lock = threading.RLock()
+            file_parser = FileParser( in_file,
+                self.get_format( parse_path, format_name ),
+                checkpoint_interval=ParsedFileCache.CHECKPOINT_INTERVAL,
+                limits=self.limits )
+            file_parser.parse()
+
+        return {'parser': file_parser, 'pages': {}, 'size': 0, 'lock': lock}
+
+    def get( self, parse_path : str, format_name : str = None ) -> dict:
+
+        ''' Return the cache entry for the given file, parsing it if it is
+        not cached or has changed. Concurrent requests for the same file
+        share a single parse. '''
+
+        parse_path = os.path.realpath( parse_path )
+        stat = os.stat( parse_path )
+        key = (parse_path, stat.st_mtime_ns, stat.st_size, format_name)
+
+        owner = False
+        stale = None
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end( key )
+                return self.entries[key]
+            if key in self.pending:
+                future = self.pending[key]
+            else:
+                future = Future()
+                self.pending[key] = future
+                owner = True
+
+                # Take over an older parse of the file to update it.
+                stale_key = self.latest.get( (parse_path, format_name) )
+                if stale_key in self.entries:
+                    stale = self.entries.pop( stale_key )
+                    self.bytes_used -= stale['size']
+                self.latest[(parse_path, format_name)] = key
+
+        if not owner:
+            return future.result()
+
+        try:
+            entry = self._parse( parse_path, format_name, stale )
+        except Exception as e:
+            with self.lock:
+                del self.pending[key]
+            future.set_exception( e )
+            raise
+
+        entry['size'] = self.estimate_size( entry )
+        with self.lock:
+            del self.pending[key]
+            self.entries[key] = entry
+            self.bytes_used += entry['size']
+            self._evict()
+        future.set_result( entry )
+
+        return entry
+
+    def record_offsets( self, entry : dict ) -> list:
+
+        ''' Return the sorted offsets of a cached file's stored records. '''
+
+        with entry['lock']:
+            if not 'record_offsets' in entry:
+                entry['record_offsets'] = \
+                    [x for x, y in entry['parser'].storage.records()]
+            return entry['record_offsets']
+
+    def render( self, entry : dict, page_key : str ) -> bytes:
+
+        ''' Return a rendered page for a cached file, rendering it on first
+        request. '''
+
+        with entry['lock']:
+            if page_key in entry['pages']:
+                return entry['pages'][page_key]
+
+            out_file = io.StringIO()
+            page = PageFormatter( out_file, entry['parser'],
+                css_href='/hex.css', js_href='/hex.js' )
+            page.write_head()
+            if page_key in ['page', 'hex']:
+                HexFormatter( out_file, entry['parser'] ).write_layout()
+            if page_key in ['page', 'summary']:
+                SummaryFormatter( out_file, entry['parser'] ).write_layout()
+            page.write_tail()
+
+            page_bytes = out_file.getvalue().encode( 'utf-8' )
+            entry['pages'][page_key] = page_bytes
+
+        with self.lock:
+            entry['size'] += len( page_bytes )
+            self.bytes_used += len( page_bytes )
+            self._evict()
+
+        return page_bytes
+
+def query_offset(
+    file_parser : FileParser, offset : int, record_offsets : list
+) -> dict:
+
+    ''' Describe the byte at the given offset and the stored field record
+    that contains it. record_offsets is the sorted list of stored record
+    offsets. '''
+
+    storage = file_parser.storage
+
+    if 0 > offset or len( file_parser.buffer ) <= offset:
+        raise IndexError( 'offset {} out of range'.format( offset ) )
+
+    buf_tup = file_parser.buffer[offset]
+    out = {
+        'offset': offset,
+        'byte': buf_tup[0],
+        'struct': buf_tup[1],
+        'sid': buf_tup[2],
+        'field': buf_tup[3],
+        'fid': buf_tup[4],
+        'hidden': buf_tup[5]['hidden'],
+        'record': None
+    }
+
+    # Find the last record starting at or before the offset.
+    idx = bisect.bisect_right( record_offsets, offset ) - 1
+    if 0 <= idx:
+        record = storage.get_record( record_offsets[idx] )
+        if offset < record_offsets[idx] + record['size']:
+            out['record'] = dict( record )
+            out['record']['offset'] = record_offsets[idx]
+
+    return out
+
+class DissectionRequestHandler( http.server.BaseHTTPRequestHandler ):
+
+    STATIC = {
+        '/hex.css': 'text/css',
+        '/hex.js': 'application/javascript'}
+
+    def send_body( self, code : int, content_type : str, body : bytes ):
+        self.send_response( code )
+        self.send_header( 'Content-Type', content_type )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def send_json( self, code : int, data : dict ):
+        self.send_body( code, 'application/json',
+            json.dumps( data ).encode( 'utf-8' ) )
+
+    def log_message( self, format_in : str, *args ):
+        logger = logging.getLogger( 'server.request' )
+        logger.info( format_in, *args )
+
+    def do_GET( self ):
+
+        logger = logging.getLogger( 'server.request' )
+
+        url = urllib.parse.urlparse( self.path )
+        query = dict( urllib.parse.parse_qsl( url.query ) )
+
+        if url.path in DissectionRequestHandler.STATIC:
+            static_path = os.path.join(
+                self.server.static_dir, url.path.lstrip( '/' ) )
+            with open( static_path, 'rb' ) as static_file:
+                self.send_body( 200, DissectionRequestHandler.STATIC[url.path],
+                    static_file.read() )
+            return
+
+        if url.path not in ['/page', '/hex', '/summary', '/offset']:
+            self.send_json( 404, {'error': 'unknown path: ' + url.path} )
+            return
+
+        if 'file' not in query:
+            self.send_json( 400, {'error': 'file parameter required'} )
+            return
+
+        try:
+            entry = self.server.cache.get(
+                query['file'], query.get( 'format' ) )
+
+            if '/offset' == url.path:
+                with entry['lock']:
+                    described = query_offset(
+                        entry['parser'], int( query.get( 'offset', 0 ) ),
+                        self.server.cache.record_offsets( entry ) )
+                self.send_json( 200, described )
+            else:
+                self.send_body( 200, 'text/html; charset=utf-8',
+                    self.server.cache.render( entry, url.path[1:] ) )
+
+        except (OSError, ValueError, IndexError) as e:
+            self.send_json( 400, {'error': str( e )} )
+
+        except (ConfigException, AssertionError, yaml.YAMLError) as e:
+            # A bad or unknown grammar for the file.
+            self.send_json( 400, {'error': 'grammar error: ' + str( e )} )
+
+        except Exception as e:
+            logger.exception( 'error handling %s', self.path )
+            self.send_json( 500, {'error': str( e )} )
+
+class DissectionServer( http.server.HTTPServer ):
+
+    ''' Local HTTP server that serves dissections of files from a cache of
+    parsed files, handling requests on a pool of worker threads. '''
+
+    def __init__(
+        self, address : tuple, static_dir : str, workers : int = 4,
+        cache_bytes : int = 512 * 1024 * 1024, limits : ParseLimits = None
+    ):
+        super().__init__( address, DissectionRequestHandler )
+        self.static_dir = static_dir
+        self.cache = ParsedFileCache( cache_bytes, limits )
+        self.pool = ThreadPoolExecutor( max_workers=workers )
+
+    def _process_request_worker( self, request, client_address ):
+        try:
+            self.finish_request( request, client_address )
+        except Exception:
+            self.handle_error( request, client_address )
+        finally:
+            self.shutdown_request( request )
+
+    def process_request( self, request, client_address ):
+        self.pool.submit(
+            self._process_request_worker, request, client_address )
+
+    def server_close( self ):
+        super().server_close()
+        self.pool.shutdown( wait=True )
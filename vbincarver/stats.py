@@ -0,0 +1,93 @@
+
+import os
+import sys
+import time
+import json
+import contextlib
+import tracemalloc
+from collections import OrderedDict
+from .parser import FileParser
+
+try:
+    import resource
+except ImportError:
+    # Not available on all platforms, so only tracemalloc can be used.
+    resource = None
+
+class ParseStats( object ):
+
+    ''' Collects timings for the phases of a dissection (grammar load,
+    parse, render...) and reports them with throughput, counts, storage
+    sizes and peak memory. Nothing is collected unless one is in use. '''
+
+    def __init__( self, trace_memory : bool = False ):
+
+        self.phases = OrderedDict()
+        self.trace_memory = trace_memory
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase( self, name : str ):
+
+        ''' Time the enclosed block, adding it to the named phase. '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get( name, 0.0 ) + \
+                time.perf_counter() - start
+
+    def memory( self ) -> dict:
+
+        ''' Return the peak memory used so far, in bytes. '''
+
+        memory = {}
+
+        if resource:
+            # Linux reports kilobytes, macOS bytes.
+            peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+            memory['peak_rss'] = peak if 'darwin' == sys.platform \
+                else peak * 1024
+
+        if self.trace_memory:
+            memory['peak_traced'] = tracemalloc.get_traced_memory()[1]
+
+        return memory
+
+    def report( self, file_parser : FileParser ) -> dict:
+
+        ''' Return the stats for the given finished parse as a dict. '''
+
+        storage = file_parser.storage
+        parse_time = self.phases.get( 'parse', 0.0 )
+
+        stats = {
+            'phases': dict( self.phases ),
+            'total_time': sum( self.phases.values() ),
+            'bytes': file_parser.bytes_read,
+            'bytes_per_sec': \
+                file_parser.bytes_read / parse_time if parse_time else None,
+            'counts': {
+                'structs': sum( file_parser.struct_counts.values() ),
+                'fields': storage.field_count(),
+                'repeats': file_parser.repeats_parsed
+            },
+            'storage': {
+                'buffer': len( file_parser.buffer ),
+                'records': storage.record_count()
+            },
+            'memory': self.memory(),
+            'limit_reached': file_parser.limit_reached
+        }
+
+        if hasattr( storage, 'db_path' ):
+            stats['storage']['db_bytes'] = os.path.getsize( storage.db_path )
+
+        return stats
+
+    def write( self, out_file, file_parser : FileParser ):
+        json.dump( self.report( file_parser ), out_file, indent=4 )
+        out_file.write( '\n' )
@@ -0,0 +1,217 @@
+
+import re
+import json
+import logging
+import sqlite3
+from .parser import FileParserStorage, TraceLogger
+
+_trace_storage_get = TraceLogger( 'storage.get' )
+
+# Storage ignores the #-replacer on field keys.
+_field_replacer = re.compile( '#.*' )
+
+class SQLiteParserStorage( FileParserStorage ):
+
+    ''' Parser storage that writes field records and values to a SQLite
+    database as they are parsed, so dissecting huge files doesn't need them
+    all in memory. Only the values of fields the grammar refers back to
+    are kept in memory, to answer the parser's get_field() lookups. The
+    database is left behind as a queryable artifact. The parser's
+    per-byte buffer is still kept in memory. '''
+
+    # Records and field values to insert per transaction.
+    BATCH_SZ = 10000
+
+    # Rows already inserted aren't taken back, so FileParser refuses
+    # checkpoints (and so reparse()) with this storage.
+    REWINDABLE = False
+
+    RECORD_KEYS = \
+        ['struct', 'size', 'sid', 'field', 'fid', 'contents', 'summarize',
+            'format', 'lsbf']
+
+    def __init__( self, db_path : str ):
+
+        super().__init__()
+
+        self.db_path = db_path
+        self.db = sqlite3.connect( db_path, check_same_thread=False )
+        self.db.executescript( '''
+            DROP TABLE IF EXISTS records;
+            DROP TABLE IF EXISTS fields;
+            CREATE TABLE records (
+                offset INTEGER PRIMARY KEY, struct TEXT, size INTEGER,
+                sid INTEGER, field TEXT, fid INTEGER, contents TEXT,
+                summarize TEXT, format TEXT, lsbf INTEGER );
+            CREATE INDEX records_struct_sid ON records (struct, sid);
+            CREATE TABLE fields (
+                struct TEXT, field TEXT, idx INTEGER, contents TEXT );
+            CREATE INDEX fields_struct_field ON fields (struct, field, idx);
+        ''' )
+
+        self.hot_fields = None
+        self.field_counts = {}
+        self.records_added = 0
+        self.field_batch = []
+        self.record_batch = []
+
+        # The last record may still grow, so it's held until the next.
+        self.pending = None
+
+        # First and last instance stored for each struct.
+        self.struct_sids = {}
+
+    def set_hot_fields( self, fields : set ):
+        self.hot_fields = fields
+
+    def _is_hot( self, struct_key : str, field_key : str ) -> bool:
+        return None == self.hot_fields or \
+            (struct_key, field_key) in self.hot_fields
+
+    def _append_field( self, struct_key : str, field_key : str, contents ):
+
+        if self._is_hot( struct_key, field_key ):
+            super()._append_field( struct_key, field_key, contents )
+
+        idx = self.field_counts.get( (struct_key, field_key), 0 )
+        self.field_counts[(struct_key, field_key)] = idx + 1
+        self.field_batch.append(
+            (struct_key, field_key, idx, json.dumps( contents )) )
+        if SQLiteParserStorage.BATCH_SZ <= len( self.field_batch ):
+            self.flush()
+
+    def get_field( self, struct_key : str, field_key : str ):
+
+        logger = _trace_storage_get
+
+        field_key = _field_replacer.sub( '', field_key )
+
+        if self._is_hot( struct_key, field_key ):
+            return super().get_field( struct_key, field_key )
+
+        if logger.on:
+            logger.debug( 'getting cold field: %s/%s', struct_key, field_key )
+
+        self.flush()
+        return [json.loads( x[0] ) for x in self.db.execute(
+            'SELECT contents FROM fields WHERE struct = ? AND field = ? ' \
+                'ORDER BY idx', (struct_key, field_key) )]
+
+    def _last_record( self ) -> dict:
+        return self.pending[1] if self.pending else None
+
+    def _skip_instance( self, struct : str, sid : int ) -> bool:
+
+        # Instances are stored in order, so an instance that has records
+        # is either the first or the latest stored.
+        return struct in self.struct_sids and \
+            not sid in self.struct_sids[struct]
+
+    def _count_size( self, struct : str, sid : int, sz : int ):
+        pass
+
+    def _add_record( self, offset : int, record : dict ):
+
+        if record['struct'] in self.struct_sids:
+            self.struct_sids[record['struct']] = \
+                (self.struct_sids[record['struct']][0], record['sid'])
+        else:
+            self.struct_sids[record['struct']] = \
+                (record['sid'], record['sid'])
+
+        if self.pending:
+            self.record_batch.append( self._record_row( *self.pending ) )
+            if SQLiteParserStorage.BATCH_SZ <= len( self.record_batch ):
+                self.flush()
+
+        self.pending = (offset, record)
+        self.records_added += 1
+
+    def _record_row( self, offset : int, record : dict ) -> tuple:
+        return (offset, record['struct'], record['size'], record['sid'],
+            record['field'], record['fid'], json.dumps( record['contents'] ),
+            record['summarize'], record['format'], int( record['lsbf'] ))
+
+    def _row_record( self, row : tuple ) -> tuple:
+        record = dict( zip( SQLiteParserStorage.RECORD_KEYS, row[1:] ) )
+        record['contents'] = json.loads( record['contents'] )
+        record['lsbf'] = bool( record['lsbf'] )
+        return row[0], record
+
+    def flush( self ):
+
+        ''' Insert the batched rows in a single transaction. '''
+
+        logger = logging.getLogger( 'storage.flush' )
+
+        if not self.record_batch and not self.field_batch:
+            return
+
+        logger.debug( 'inserting %d records and %d field values...',
+            len( self.record_batch ), len( self.field_batch ) )
+
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self.record_batch )
+            self.db.executemany(
+                'INSERT INTO fields VALUES (?, ?, ?, ?)', self.field_batch )
+
+        self.record_batch = []
+        self.field_batch = []
+
+    def records( self, start : int = 0 ):
+
+        self.flush()
+
+        for row in self.db.execute(
+            'SELECT offset, ' + ', '.join( SQLiteParserStorage.RECORD_KEYS ) +
+                ' FROM records WHERE offset >= ? ORDER BY offset', (start,)
+        ):
+            yield self._row_record( row )
+
+        if self.pending and self.pending[0] >= start:
+            yield self.pending
+
+    def get_record( self, offset : int ) -> dict:
+
+        if self.pending and self.pending[0] == offset:
+            return self.pending[1]
+
+        self.flush()
+
+        row = self.db.execute(
+            'SELECT offset, ' + ', '.join( SQLiteParserStorage.RECORD_KEYS ) +
+                ' FROM records WHERE offset = ?', (offset,) ).fetchone()
+        return self._row_record( row )[1] if row else None
+
+    def record_count( self ) -> int:
+
+        # Records are only ever added, so there's no need to ask the DB.
+        return self.records_added
+
+    def held_record_count( self ) -> int:
+        return len( self.record_batch ) + (1 if self.pending else 0)
+
+    def field_count( self ) -> int:
+        return sum( self.field_counts.values() )
+
+    def struct_size( self, struct : str, sid : int ) -> int:
+
+        self.flush()
+
+        sz = self.db.execute(
+            'SELECT TOTAL(size) FROM records WHERE struct = ? AND sid = ?',
+            (struct, sid) ).fetchone()[0]
+
+        if self.pending and self.pending[1]['struct'] == struct and \
+        self.pending[1]['sid'] == sid:
+            sz += self.pending[1]['size']
+
+        return int( sz )
+
+    def close( self ):
+        if self.pending:
+            self.record_batch.append( self._record_row( *self.pending ) )
+            self.pending = None
+        self.flush()